@@ -1,30 +1,75 @@
-SSH direkt nga PowerShell (më trego nëse ke lidhur)import os
+import os
 import urllib.parse
 import sys
 import csv
 import io
+import base64
+import itertools
 import datetime
 import hashlib
 import json
+import threading
+import time
 from decimal import Decimal, ROUND_HALF_UP
-from functools import lru_cache
-from flask import Flask, jsonify, request, send_from_directory, Response, make_response
+from functools import lru_cache, wraps
+from flask import Flask, jsonify, request, send_from_directory, Response, make_response, g
 import requests
 from flask import send_file
 from dotenv import load_dotenv
-from db import fetch_all
+from db import fetch_all, fetch_iter, pooled_conn, pool_stats
+from response_cache import ResponseCache
+from orders_snapshot import OrdersSnapshotStore
+from staging_index import index_for as staging_index_for
 
 try:
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
+    from xlsx_export import XlsxReport, XLSX_MIMETYPE
     OPENPYXL_AVAILABLE = True
 except ImportError:
     OPENPYXL_AVAILABLE = False
 
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+    from werkzeug.http import http_date
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+if ORJSON_AVAILABLE:
+    def _orjson_default(obj):
+        if isinstance(obj, datetime.date):
+            # Same RFC 1123 dates as Flask's default provider (orjson would emit ISO 8601)
+            return http_date(obj)
+        if isinstance(obj, Decimal):
+            return float(obj)
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """App-wide JSON via orjson (dates as http_date like Flask, Decimal -> float)"""
+
+        def _options(self):
+            opts = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                opts |= orjson.OPT_SORT_KEYS
+            return opts
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=_orjson_default, option=self._options()).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            body = orjson.dumps(obj, default=_orjson_default, option=self._options())
+            return self._app.response_class(body, mimetype=self.mimetype)
+
 # Faktura AI integration
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'app'))
 try:
-    from faktura_ai_mvp import parse_invoice_xml, load_lookup_from_db, load_config, write_csv, to_number, ensure_dir, dtstamp
+    from faktura_ai_mvp import parse_invoice_xml, load_lookup_from_db, barcode_index_for, load_config, write_csv, to_number, ensure_dir, dtstamp
     from faktura_import import parse_invoice_xml as parse_sopharma_xml, insert_kalkulacija, MP_CONFIG
     import psycopg2
     # Optional: eFaktura client
@@ -51,12 +96,18 @@ except ImportError as e:
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
 
 app = Flask(__name__)
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
 # Public UI directory (serves orders_pro_plus.html)
 UI_PUBLIC_PATH = os.path.join(os.path.dirname(__file__), 'public')
 
-# Simple in-memory cache for /api/orders (TTL: 5 minutes)
-_orders_cache = {}
-_cache_ttl = 300  # seconds
+# Response cache for /api/orders and /api/orders/v2 (LRU + TTL, single-flight)
+_cache_ttl = int(os.getenv("WPH_ORDERS_CACHE_TTL", "300"))  # seconds
+_orders_cache = ResponseCache(
+    ttl=_cache_ttl,
+    max_entries=int(os.getenv("WPH_ORDERS_CACHE_MAX_ENTRIES", "64")),
+    max_bytes=int(os.getenv("WPH_ORDERS_CACHE_MAX_MB", "64")) * 1024 * 1024,
+)
 
 # ============ POST /api/orders/{supplier} Setup ============
 OUT_DIR = r"C:\Wellona\wphAI\out\orders"
@@ -151,6 +202,158 @@ def _safe_fetch_all(sql, params=None, default=None):
         app.logger.exception("DB query failed: %s", e)
         raise
 
+
+def _safe_iter_rows(sql, params=None, itersize=None):
+    """Streaming counterpart of _safe_fetch_all for bulk exports.
+    Yields row dicts one by one from a server-side cursor; nothing when USE_DB is off.
+    """
+    if not USE_DB:
+        app.logger.debug("DB disabled (WPH_APP_USE_DB=0) - empty stream")
+        return
+    kwargs = {"itersize": itersize} if itersize else {}
+    for batch in fetch_iter(sql, params, **kwargs):
+        yield from batch
+
+
+# Decimal places per column for orders rows (avoids 80.000000000000000 in UI/exports)
+ORDERS_V2_ROUNDING = {
+    'avg_daily_sales': 2, 'days_cover': 1, 'current_stock': 0, 'monthly_sales': 1,
+    'sales_180d': 1, 'min_zaliha': 0, 'qty_to_order': 0,
+    'base_price': 2, 'rabat_pct': 2, 'effective_price': 2,
+}
+ORDERS_LEGACY_ROUNDING = {
+    'avg_daily_sales': 2, 'days_cover': 1, 'current_stock': 0, 'min_zaliha': 0,
+    'qty_to_order': 0, 'base_price': 2, 'rabat_pct': 2, 'effective_price': 2,
+}
+
+
+# Snapshot version probe for ETag/304 on /api/orders/v2.
+# REFRESH MATERIALIZED VIEW swaps the relfilenode; REFRESH ... CONCURRENTLY bumps tuple counters.
+SNAPSHOT_RELATION = "ops.orders_30d_snapshot"
+SNAPSHOT_VERSION_TTL = float(os.getenv("WPH_SNAPSHOT_VERSION_TTL", "5"))  # seconds between catalog probes
+_snapshot_version = {"token": None, "seen_at": None, "checked": 0.0}
+_snapshot_version_lock = threading.Lock()
+
+
+def get_snapshot_version(force=False):
+    """Return (token, last_modified) for the orders snapshot, or (None, None) if unknown.
+    last_modified is the first time this process saw the current token.
+    """
+    if not USE_DB:
+        return None, None
+    with _snapshot_version_lock:
+        now = time.monotonic()
+        if not force and _snapshot_version["token"] and now - _snapshot_version["checked"] < SNAPSHOT_VERSION_TTL:
+            return _snapshot_version["token"], _snapshot_version["seen_at"]
+        try:
+            rows = fetch_all("""
+                SELECT c.relfilenode,
+                       COALESCE(s.n_tup_ins, 0) + COALESCE(s.n_tup_upd, 0) + COALESCE(s.n_tup_del, 0) AS tup_changes
+                FROM pg_class c
+                LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid
+                WHERE c.oid = %s::regclass
+            """, [SNAPSHOT_RELATION])
+        except Exception as e:
+            app.logger.warning("Snapshot version probe failed: %s", e)
+            return None, None
+        if not rows:
+            return None, None
+        token = f"{rows[0]['relfilenode']}-{rows[0]['tup_changes']}"
+        if token != _snapshot_version["token"]:
+            _snapshot_version["token"] = token
+            _snapshot_version["seen_at"] = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        _snapshot_version["checked"] = now
+        return token, _snapshot_version["seen_at"]
+
+
+def snapshot_etag(view=None, *, version=None):
+    """ETag/Last-Modified keyed on snapshot version + query params; 304 skips the SQL entirely.
+    version() -> (token, last_modified) replaces the catalog probe when the view serves another copy.
+    """
+    if view is None:
+        return lambda v: snapshot_etag(v, version=version)
+    version_fn = version or get_snapshot_version
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token, last_modified = version_fn()
+        if token is None:
+            return view(*args, **kwargs)
+        g.snapshot_version = token
+        etag = hashlib.sha1(repr((token, _orders_cache_key())).encode("utf-8")).hexdigest()[:32]
+
+        not_modified = False
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and last_modified:
+            not_modified = last_modified <= request.if_modified_since
+
+        if not_modified:
+            resp = Response(status=304)
+        else:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+        resp.set_etag(etag, weak=True)
+        resp.last_modified = last_modified
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return wrapper
+
+
+def _orders_cache_key():
+    """Normalize orders query params so equivalent requests share a cache entry"""
+    args = request.args
+    scope = (args.get("product_scope") or "").strip().lower()
+    if args.get("include_zero") is not None:
+        include_zero = args.get("include_zero") == "1"
+    else:
+        include_zero = scope in ("all", "all_products", "allitems", "allproduct")
+    known = {"target_days", "date_from", "date_to", "include_zero", "product_scope", "q", "supplier", "download"}
+    extra = tuple(sorted((k, tuple(args.getlist(k))) for k in args.keys() if k not in known))
+    return (
+        request.path,
+        (args.get("target_days") or "").strip(),
+        args.get("date_from") or None,
+        args.get("date_to") or None,
+        include_zero,
+        (args.get("q") or "").strip().lower(),
+        tuple(sorted({s.strip().upper() for s in args.getlist("supplier") if s.strip()})),
+        (args.get("download") or "json").lower(),
+        extra,
+        g.get("snapshot_version"),
+    )
+
+
+def cached_orders(view):
+    """Serve the view through _orders_cache; only complete 200 responses are stored"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        def load():
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200 or resp.is_streamed:
+                return resp, None
+            body = resp.get_data()
+            headers = [(k, v) for k, v in resp.headers.items() if k.lower() != "content-length"]
+            return (body, resp.status_code, headers), len(body)
+
+        value, hit = _orders_cache.get_or_load(_orders_cache_key(), load)
+        if not isinstance(value, tuple):
+            return value
+        body, status, headers = value
+        resp = Response(body, status=status, headers=headers)
+        resp.headers["X-Cache"] = "HIT" if hit else "MISS"
+        return resp
+    return wrapper
+
+
+def _round_row(row, spec):
+    """Convert Decimal columns listed in spec to rounded floats (in place)"""
+    for col, digits in spec.items():
+        if row.get(col) is not None:
+            row[col] = round(float(row[col]), digits)
+    return row
+
 # ============ Routes ============
 
 @app.get("/health")
@@ -161,7 +364,9 @@ def health():
         "db_name": os.getenv("WPH_DB_NAME","wph_ai"),
         "app_port": int(os.getenv("APP_PORT","8055")),
         "cache_size": len(_orders_cache),
-        "cache_ttl_sec": _cache_ttl
+        "cache_ttl_sec": _cache_ttl,
+        "orders_cache": _orders_cache.stats(),
+        "orders_inmemory": _orders_snapshot.stats() if _orders_snapshot else {"enabled": False}
     })
 
 
@@ -190,9 +395,7 @@ def ui_swagger():
 @app.post("/api/cache/clear")
 def clear_cache():
     """Clear all cached orders data"""
-    global _orders_cache
-    cache_size = len(_orders_cache)
-    _orders_cache.clear()
+    cache_size = _orders_cache.clear()
     return jsonify({
         "status": "cleared",
         "entries_removed": cache_size,
@@ -218,7 +421,8 @@ def home():
         "primary_endpoints": [
             "/api/orders/v2 - 🚀 PRIMARY: Fast snapshot-based orders (use this!)",
             "/health - Health check",
-            "/api/suppliers - List active suppliers"
+            "/api/suppliers - List active suppliers",
+            "/api/products/search?q= - Product type-ahead (trigram ranked)"
         ],
         "legacy_endpoints": [
             "/api/orders - ⚠️ LEGACY: Slow function-based (deprecated)",
@@ -251,7 +455,121 @@ def get_sales_mv(sales_window: int) -> str:
     else:
         return "ops._sales_180d"  # 180+ days
 
+# /api/orders/v2 columns (fields= projection) and keyset sort key (limit/cursor pagination)
+ORDERS_V2_COLUMNS = [
+    "sifra", "emri", "barkod", "current_stock",
+    "monthly_sales", "avg_daily_sales", "days_cover",
+    "min_zaliha", "qty_to_order", "alarm_active", "flow_status",
+    "supplier_name", "base_price", "rabat_pct", "effective_price",
+    "sales_180d", "last_sale_date",
+]
+ORDERS_V2_KEYSET = {"_k_alarm": "alarm_active", "_k_flow": "flow_status", "_k_qty": "qty_to_order", "_k_sifra": "sifra"}
+# Keyset ORDER BY (each DESC): the unpaginated order plus sifra, text in "C" (code point) order like
+# the in-memory copy. Served by patches/orders_v2_keyset_index.sql.
+ORDERS_V2_KEY_EXPRS = ["alarm_active", 'flow_status COLLATE "C"', "qty_to_order", 'sifra COLLATE "C"']
+ORDERS_V2_MAX_LIMIT = 5000
+
+# /api/products/search: type-ahead over the snapshot, ranked by pg_trgm similarity
+PRODUCT_SEARCH_COLUMNS = ["sifra", "emri", "barkod", "supplier_name", "current_stock", "qty_to_order"]
+PRODUCT_SEARCH_MIN_CHARS = 2
+PRODUCT_SEARCH_DEFAULT_LIMIT = 20
+PRODUCT_SEARCH_MAX_LIMIT = 50
+
+
+def _like_contains(text):
+    """'%text%' pattern with LIKE wildcards in the user text escaped"""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _orders_v2_select_expr(col):
+    """Column as selected for output: numeric columns rounded and cast to float8 in SQL"""
+    digits = ORDERS_V2_ROUNDING.get(col)
+    if digits is None:
+        return col
+    return f"ROUND({col}::numeric, {digits})::float8 AS {col}"
+
+
+def _encode_orders_cursor(data):
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_orders_cursor(token):
+    data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    a, f, q, s = data["a"], data["f"], data["q"], data["s"]
+    return {"a": None if a is None else bool(a), "f": None if f is None else str(f),
+            "q": None if q is None else str(Decimal(str(q))), "s": None if s is None else str(s),
+            "t": int(data["t"])}
+
+
+def _orders_keyset_after(cursor):
+    """(sql, params) matching the rows after the cursor in ORDERS_V2_KEY_EXPRS DESC order.
+
+    DESC puts NULLs first. Without NULLs in the cursor this is one row comparison, a range
+    scan on the keyset index; rows with a NULL key compare as NULL there, which correctly
+    drops them (they sort before the cursor). A NULL in the cursor needs the expanded form.
+    sifra is the tiebreaker, so pages are exact as long as no two rows share the whole key.
+    """
+    values = [cursor["a"], cursor["f"], None if cursor["q"] is None else Decimal(cursor["q"]), cursor["s"]]
+    if None not in values:
+        return f"({', '.join(ORDERS_V2_KEY_EXPRS)}) < (%s, %s, %s, %s)", values
+
+    def after(i):
+        expr, value = ORDERS_V2_KEY_EXPRS[i], values[i]
+        if value is None:
+            later, same, p = f"{expr} IS NOT NULL", f"{expr} IS NULL", []
+        else:
+            later, same, p = f"{expr} < %s", f"{expr} = %s", [value]
+        if i == len(values) - 1:
+            return later, p
+        rest, rest_params = after(i + 1)
+        return f"({later} OR ({same} AND {rest}))", p + p + rest_params
+
+    return after(0)
+
+
+# Optional in-process columnar copy of the snapshot (needs numpy); reloaded on NOTIFY, see orders_snapshot.py.
+# Its LISTEN thread starts with the first /api/orders/v2 request, not at import.
+ORDERS_INMEMORY = os.getenv("WPH_ORDERS_INMEMORY", "0") == "1"
+_orders_snapshot = None
+if ORDERS_INMEMORY and USE_DB:
+    _orders_snapshot = OrdersSnapshotStore(
+        select_sql="SELECT {} FROM {}".format(
+            ", ".join([_orders_v2_select_expr(c) for c in ORDERS_V2_COLUMNS]
+                      + [f"{col} AS {alias}" for alias, col in ORDERS_V2_KEYSET.items()]),
+            SNAPSHOT_RELATION),
+        columns=ORDERS_V2_COLUMNS,
+        channel=os.getenv("WPH_ORDERS_INMEMORY_CHANNEL", "wph_orders_snapshot"),
+        recheck=float(os.getenv("WPH_ORDERS_INMEMORY_RECHECK", "60")),
+        version_fn=lambda: get_snapshot_version(force=True)[0],
+    )
+
+
+def _orders_inmemory():
+    """The in-memory store with its listener running, or None (disabled / numpy missing)"""
+    global _orders_snapshot
+    if _orders_snapshot is not None and not _orders_snapshot.start():
+        _orders_snapshot = None
+    return _orders_snapshot
+
+
+def _orders_served_version():
+    """(token, last_modified) of the data /api/orders/v2 will serve.
+    In-memory mode pins the loaded copy on g, so ETag, cache key and rows all come from
+    that one load; the catalog probe can run ahead of it until the NOTIFY reload lands.
+    """
+    store = _orders_inmemory()
+    snap = store.current() if store is not None else None
+    if snap is None:
+        return get_snapshot_version()
+    g.orders_snap = snap
+    return snap.token, datetime.datetime.fromtimestamp(int(snap.loaded_at), datetime.timezone.utc)
+
+
 @app.get("/api/orders/v2")
+@snapshot_etag(version=_orders_served_version)
+@cached_orders
 def api_orders_v2():
     """
     🚀 PRIMARY API ENDPOINT - Use this for all future work!
@@ -273,87 +591,201 @@ def api_orders_v2():
     - include_zero: 1=show 0_FLOW products, 0=hide (default 0)
     - supplier: Filter by supplier (PHOENIX, VEGA, SOPHARMA, ZEGIN)
     - download: csv|xlsx for download format
+    - fields: comma-separated column projection (default: all columns)
+    - limit: page size; enables keyset pagination (JSON only). Response headers:
+      X-Total-Count (matching rows) and X-Next-Cursor (pass back as cursor=)
+    - cursor: opaque token from the previous page's X-Next-Cursor
     """
     # Parse parameters
     search_query = request.args.get("q", "").strip() or None
     include_zero = request.args.get("include_zero", "0") == "1"
     suppliers = request.args.getlist("supplier")
     suppliers = [s.strip().upper() for s in suppliers if s.strip()]
+    download = request.args.get("download", "").lower()
     
-    # Base query from snapshot
-    sql = """
-        SELECT 
-            sifra, emri, barkod, current_stock, 
-            monthly_sales, avg_daily_sales, days_cover,
-            min_zaliha, qty_to_order, alarm_active, flow_status,
-            supplier_name, base_price, rabat_pct, effective_price,
-            sales_180d, last_sale_date
-        FROM ops.orders_30d_snapshot
-        WHERE 1=1
-    """
+    # Optional projection: fields=sifra,emri,qty_to_order
+    fields_raw = request.args.get("fields", "").strip()
+    if fields_raw:
+        fields = [f.strip() for f in fields_raw.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in ORDERS_V2_COLUMNS]
+        if unknown or not fields:
+            return jsonify({"error": "Unknown fields", "unknown": unknown, "allowed": ORDERS_V2_COLUMNS}), 400
+        fields = list(dict.fromkeys(fields))
+    else:
+        fields = list(ORDERS_V2_COLUMNS)
+    
+    # Optional keyset pagination (JSON only): limit=N [&cursor=<X-Next-Cursor>]
+    limit = None
+    cursor = None
+    if download not in ("csv", "xlsx") and request.args.get("limit"):
+        try:
+            limit = max(1, min(int(request.args["limit"]), ORDERS_V2_MAX_LIMIT))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        if request.args.get("cursor"):
+            try:
+                cursor = _decode_orders_cursor(request.args["cursor"])
+            except Exception:
+                return jsonify({"error": "Invalid cursor"}), 400
+    
+    # In-memory mode: same filters/order/pagination served from the columnar copy, no DB round trip
+    snap = g.get("orders_snap")
+    if snap is not None:
+        rows, total, last_key = _orders_snapshot.query(fields, include_zero, suppliers, search_query, limit, cursor,
+                                                       snap=snap)
+        if download in ("csv", "xlsx"):
+            return _csv_response(rows) if download == "csv" else _xlsx_response(rows)
+        if limit is None:
+            return jsonify(rows)
+        return _orders_page_response(rows, total, last_key)
+    
+    # Rounding happens in the projection, so rows arrive JSON-ready (no per-row Python pass)
+    select_cols = [_orders_v2_select_expr(f) for f in fields]
+    if limit is not None:
+        # Raw (unrounded) sort key for the keyset predicate, stripped from the output
+        select_cols += [f"{col} AS {alias}" for alias, col in ORDERS_V2_KEYSET.items()]
+    
+    # Filters (shared by the row query and the first-page count)
+    where = " WHERE 1=1"
     params = []
     
     # Filter: include_zero (exclude 0_FLOW if False)
     if not include_zero:
-        sql += " AND flow_status != '0_FLOW'"
+        where += " AND flow_status != '0_FLOW'"
     
     # Filter: search query
     if search_query:
-        sql += " AND (LOWER(emri) LIKE %s OR LOWER(sifra) LIKE %s OR LOWER(barkod) LIKE %s)"
-        pattern = f"%{search_query.lower()}%"
+        # ILIKE on the bare columns can use the pg_trgm GIN indexes (patches/products_search_trgm.sql)
+        where += " AND (emri ILIKE %s OR sifra ILIKE %s OR barkod ILIKE %s)"
+        pattern = _like_contains(search_query)
         params.extend([pattern, pattern, pattern])
     
     # Filter: suppliers
     if suppliers:
         placeholders = ','.join(['%s'] * len(suppliers))
-        sql += f" AND UPPER(supplier_name) IN ({placeholders})"
+        where += f" AND UPPER(supplier_name) IN ({placeholders})"
         params.extend(suppliers)
     
-    # Order by priority (alarm first, then flow, then qty)
-    sql += " ORDER BY alarm_active DESC, flow_status DESC, qty_to_order DESC"
+    # Base query from snapshot
+    sql = f"SELECT {', '.join(select_cols)} FROM ops.orders_30d_snapshot{where}"
+    count_sql = None
+    
+    if limit is None:
+        # Order by priority (alarm first, then flow, then qty)
+        sql += " ORDER BY alarm_active DESC, flow_status DESC, qty_to_order DESC"
+    else:
+        # Keyset page: index range scan + LIMIT. The first page counts matches in a separate
+        # COUNT(*) (a window count would materialize every row); later pages carry it in the cursor.
+        count_params = list(params)
+        if cursor:
+            after_sql, after_params = _orders_keyset_after(cursor)
+            sql += f" AND {after_sql}"
+            params.extend(after_params)
+        else:
+            count_sql = f"SELECT COUNT(*) AS total FROM ops.orders_30d_snapshot{where}"
+        sql += " ORDER BY " + ", ".join(f"{e} DESC" for e in ORDERS_V2_KEY_EXPRS) + " LIMIT %s"
+        params.append(limit)
+    
+    # Downloads stream from a server-side cursor instead of materializing the snapshot
+    if download in ("csv", "xlsx"):
+        rows = _safe_iter_rows(sql, params)
+        try:
+            return _csv_response(rows) if download == "csv" else _xlsx_response(rows)
+        except Exception as e:
+            import traceback
+            tb = traceback.format_exc()
+            app.logger.exception("api_orders_v2 export failed")
+            return jsonify({"error": "Database error: unable to export orders", "message": str(e), "traceback": tb}), 503
     
     try:
         rows = _safe_fetch_all(sql, params, default=[])
+        if count_sql is not None:
+            # A short first page is the whole result
+            total = len(rows) if len(rows) < limit else \
+                _safe_fetch_all(count_sql, count_params, default=[{"total": 0}])[0]["total"]
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
         app.logger.exception("api_orders_v2 DB query failed")
         return jsonify({"error": "Database error: unable to fetch orders", "message": str(e), "traceback": tb}), 503
     
-    # Format decimals
-    for row in rows:
-        if row.get('avg_daily_sales') is not None:
-            row['avg_daily_sales'] = round(float(row['avg_daily_sales']), 2)
-        if row.get('days_cover') is not None:
-            row['days_cover'] = round(float(row['days_cover']), 1)
-        if row.get('current_stock') is not None:
-            row['current_stock'] = round(float(row['current_stock']), 0)
-        if row.get('monthly_sales') is not None:
-            row['monthly_sales'] = round(float(row['monthly_sales']), 1)
-        if row.get('sales_180d') is not None:
-            row['sales_180d'] = round(float(row['sales_180d']), 1)
-        if row.get('min_zaliha') is not None:
-            row['min_zaliha'] = round(float(row['min_zaliha']), 0)
-        if row.get('qty_to_order') is not None:
-            row['qty_to_order'] = round(float(row['qty_to_order']), 0)
-        if row.get('base_price') is not None:
-            row['base_price'] = round(float(row['base_price']), 2)
-        if row.get('rabat_pct') is not None:
-            row['rabat_pct'] = round(float(row['rabat_pct']), 2)
-        if row.get('effective_price') is not None:
-            row['effective_price'] = round(float(row['effective_price']), 2)
+    if limit is None:
+        return jsonify(rows)
     
-    # Check if download format requested
-    download = request.args.get("download", "").lower()
-    if download == "csv":
-        return _csv_response(rows)
-    elif download == "xlsx":
-        return _xlsx_response(rows)
+    if cursor:
+        total = cursor["t"]
+    last_key = None
+    if len(rows) == limit:
+        last = rows[-1]
+        last_key = (last["_k_alarm"], last["_k_flow"], last["_k_qty"], last["_k_sifra"])
+    page = [{f: row.get(f) for f in fields} for row in rows]
+    return _orders_page_response(page, total, last_key)
+
+
+def _orders_page_response(page, total, last_key):
+    """JSON page + X-Total-Count / X-Next-Cursor (last_key: sort key of the last row of a full page)"""
+    resp = jsonify(page)
+    resp.headers["X-Total-Count"] = str(total)
+    if last_key is not None:
+        alarm, flow, qty, sifra = last_key
+        resp.headers["X-Next-Cursor"] = _encode_orders_cursor({
+            "a": alarm,
+            "f": flow,
+            "q": None if qty is None else str(qty),
+            "s": sifra,
+            "t": total,
+        })
+    return resp
+
+
+@app.get("/api/products/search")
+@snapshot_etag
+def api_products_search():
+    """
+    🔎 Product type-ahead over ops.orders_30d_snapshot (pg_trgm, GIN-indexed)
+    
+    Parameters:
+    - q: search text (min 2 chars), matched on emri (word similarity), sifra, barkod
+    - limit: max results (default 20, max 50)
     
+    Exact sifra/barkod hits first, then by similarity score (0..1).
+    Requires patches/products_search_trgm.sql.
+    """
+    q = request.args.get("q", "").strip()
+    if len(q) < PRODUCT_SEARCH_MIN_CHARS:
+        return jsonify([])
+    try:
+        limit = max(1, min(int(request.args.get("limit", PRODUCT_SEARCH_DEFAULT_LIMIT)), PRODUCT_SEARCH_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    
+    # Every WHERE branch is an indexable trigram operator, so this is a BitmapOr over the GIN indexes
+    sql = f"""
+        SELECT {", ".join(_orders_v2_select_expr(c) for c in PRODUCT_SEARCH_COLUMNS)},
+               ROUND(GREATEST(word_similarity(%(q)s, emri),
+                              similarity(sifra, %(q)s),
+                              similarity(barkod, %(q)s))::numeric, 3)::float8 AS score
+        FROM ops.orders_30d_snapshot
+        WHERE %(q)s <%% emri
+           OR emri ILIKE %(pattern)s
+           OR sifra ILIKE %(pattern)s
+           OR barkod ILIKE %(pattern)s
+        ORDER BY (sifra = %(q)s OR barkod = %(q)s) DESC, score DESC, emri
+        LIMIT %(limit)s
+    """
+    params = {"q": q, "pattern": _like_contains(q), "limit": limit}
+    try:
+        rows = _safe_fetch_all(sql, params, default=[])
+    except Exception as e:
+        import traceback
+        tb = traceback.format_exc()
+        app.logger.exception("api_products_search DB query failed")
+        return jsonify({"error": "Database error: unable to search products", "message": str(e), "traceback": tb}), 503
     return jsonify(rows)
 
 
 @app.get("/api/orders")
+@cached_orders
 def api_orders():
     """
     ⚠️  LEGACY ENDPOINT - Use /api/orders/v2 instead!
@@ -437,24 +869,7 @@ def api_orders():
     
     # 🔧 FIX: Format decimal numbers to avoid 80.000000000000000 display
     for row in rows:
-        # Convert Decimal to float with proper precision
-        if row.get('avg_daily_sales') is not None:
-            row['avg_daily_sales'] = round(float(row['avg_daily_sales']), 2)
-        if row.get('days_cover') is not None:
-            row['days_cover'] = round(float(row['days_cover']), 1)
-        if row.get('current_stock') is not None:
-            row['current_stock'] = round(float(row['current_stock']), 0)
-        if row.get('min_zaliha') is not None:
-            row['min_zaliha'] = round(float(row['min_zaliha']), 0)
-        if row.get('qty_to_order') is not None:
-            row['qty_to_order'] = round(float(row['qty_to_order']), 0)
-        # New rabat columns
-        if row.get('base_price') is not None:
-            row['base_price'] = round(float(row['base_price']), 2)
-        if row.get('rabat_pct') is not None:
-            row['rabat_pct'] = round(float(row['rabat_pct']), 2)
-        if row.get('effective_price') is not None:
-            row['effective_price'] = round(float(row['effective_price']), 2)
+        _round_row(row, ORDERS_LEGACY_ROUNDING)
     
     # Check if download format requested
     download = request.args.get("download", "").lower()
@@ -466,83 +881,81 @@ def api_orders():
     return jsonify(rows)
 
 
+CSV_CHUNK_BYTES = 64 * 1024
+
+
 def _csv_response(rows):
-    """Generate CSV download response"""
-    if not rows:
+    """Stream CSV download (rows: list or lazy iterable of dicts).
+    
+    Rows are written in ~64KB chunks straight from the iterator, so time-to-first-byte
+    and memory do not depend on export size. Output keeps ';' delimiter and a UTF-8 BOM.
+    """
+    rows = iter(rows)
+    # Pull the first row before responding so query errors still surface as a normal error response
+    first = next(rows, None)
+    if first is None:
         return Response("", mimetype="text/csv")
     
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=rows[0].keys(), delimiter=";")
-    writer.writeheader()
-    writer.writerows(rows)
+    def generate():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=first.keys(), delimiter=";")
+        buf.write("\ufeff")
+        writer.writeheader()
+        writer.writerow(first)
+        try:
+            for row in rows:
+                writer.writerow(row)
+                if buf.tell() >= CSV_CHUNK_BYTES:
+                    yield buf.getvalue().encode("utf-8")
+                    buf.seek(0)
+                    buf.truncate()
+        except Exception:
+            app.logger.exception("CSV export aborted mid-stream")
+            raise
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")
     
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"orders_{ts}.csv"
     
-    response = make_response(output.getvalue())
+    response = Response(generate(), mimetype="text/csv")
+    if hasattr(rows, "close"):
+        # Release the server-side cursor / pooled connection even if the client disconnects early
+        response.call_on_close(rows.close)
     response.headers["Content-Disposition"] = f"attachment; filename={filename}"
     response.headers["Content-Type"] = "text/csv; charset=utf-8-sig"
     return response
 
 
 def _xlsx_response(rows):
-    """Generate XLSX download response with styling"""
+    """Generate XLSX download response (rows: list or lazy iterable of dicts).
+    
+    Built with the write-only export engine and spooled to a temp file, so memory
+    stays bounded for large exports; the file is streamed to the client from the spool.
+    """
     if not OPENPYXL_AVAILABLE:
         return jsonify({"error": "openpyxl not installed"}), 500
     
-    if not rows:
-        return Response("", mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Orders"
-    
-    # Header styling
-    header_fill = PatternFill(start_color="4F46E5", end_color="4F46E5", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    
-    # Write headers
-    headers = list(rows[0].keys())
-    for col_idx, header in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=col_idx, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    # Write data rows
-    for row_idx, row in enumerate(rows, start=2):
-        for col_idx, header in enumerate(headers, start=1):
-            value = row.get(header)
-            # Convert Decimal to float for Excel
-            if isinstance(value, Decimal):
-                value = float(value)
-            ws.cell(row=row_idx, column=col_idx, value=value)
-    
-    # Auto-adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column].width = adjusted_width
-    
-    # Save to BytesIO
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    rows = iter(rows)
+    try:
+        first = next(rows, None)
+        if first is None:
+            return Response("", mimetype=XLSX_MIMETYPE)
+        
+        headers = list(first.keys())
+        report = XlsxReport(header_color="4F46E5")
+        report.add_sheet("Orders", headers,
+                         ([row.get(h) for h in headers] for row in itertools.chain([first], rows)),
+                         freeze="A2")
+        output = report.save()
+    finally:
+        if hasattr(rows, "close"):
+            rows.close()
     
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"orders_{ts}.xlsx"
     
-    response = make_response(output.read())
-    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-    response.headers["Content-Type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    return response
+    return send_file(output, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=filename)
 
 
 @app.get("/api/health/db")
@@ -897,6 +1310,7 @@ def api_health_full():
     
     try:
         health_data = monitor.get_full_health()
+        health_data["db_pool"] = pool_stats()
         
         # Check for critical issues
         issues = monitor.check_critical_issues()
@@ -969,18 +1383,20 @@ def api_faktura_upload():
             return jsonify({"error": "Only XML invoices supported currently"}), 400
         
         hdr, items = parse_invoice_xml(temp_path)
+        _staging_index(temp_dir).put(temp_path, _staging_summary_of(hdr, items))
         
         # Load validation lookup
         cfg_path = os.path.join(base, 'configs', 'faktura_ai.json')
         cfg = load_config(cfg_path)
-        sifra_set, barcode_set = load_lookup_from_db(cfg['db'])
+        sifra_set, barcode_set, _, artikli_map = load_lookup_from_db(cfg['db'])
+        barcode_index = barcode_index_for(artikli_map)
         
-        # Validate items
+        # Validate items (barcode: exact or fuzzy variant, same index as the CLI importer)
         matched = 0
         for item in items:
             s = (item.get('sifra') or '').strip()
             b = (item.get('barcode') or '').strip()
-            if (s and s in sifra_set) or (b and b in barcode_set):
+            if (s and s in sifra_set) or (b and (b in barcode_set or barcode_index.match(b, barcode_set))):
                 matched += 1
                 item['valid'] = True
             else:
@@ -1158,6 +1574,36 @@ def api_faktura_download(date, invoice_no, file_type):
         return jsonify({"error": str(e)}), 500
 
 
+# Listing fields of staged XMLs, kept in staging/faktura_uploads/.staging_index.sqlite
+# (staging_index.py); bump the version when the summary fields change
+STAGING_SUMMARY_VERSION = 1
+
+
+def _staging_summary_of(header, items):
+    total_calc = sum(
+        to_number(it.get('qty'), 0) *
+        to_number(it.get('price'), 0) *
+        (1 - to_number(it.get('rabat_pct'), 0) / 100.0)
+        for it in items
+    )
+    return {
+        "supplier": header.get('supplier', 'N/A'),
+        "invoice_no": header.get('invoice_no', 'N/A'),
+        "invoice_date": header.get('invoice_date', 'N/A'),
+        "currency": header.get('currency', 'RSD'),
+        "items_count": len(items),
+        "total_amount": round(total_calc, 2),
+    }
+
+
+def _staging_summary(fpath):
+    return _staging_summary_of(*parse_invoice_xml(fpath))
+
+
+def _staging_index(staging_dir):
+    return staging_index_for(staging_dir, _staging_summary, STAGING_SUMMARY_VERSION)
+
+
 @app.route("/api/faktura/pending", methods=["GET"])
 def api_faktura_pending():
     """
@@ -1184,37 +1630,34 @@ def api_faktura_pending():
         ensure_dir(staging_dir)
         
         pending = []
-        for fname in os.listdir(staging_dir):
-            if not fname.lower().endswith('.xml'):
-                continue
-            
+        for entry in _staging_index(staging_dir).scan():
+            fname = entry['filename']
             fpath = os.path.join(staging_dir, fname)
-            stat = os.stat(fpath)
+            summary = entry['summary']
             
-            # Quick parse to get header info
-            try:
-                header, items = parse_invoice_xml(fpath)
+            # Header info from the staging index (parsed once per file content)
+            if summary is not None:
                 pending.append({
                     "filename": fname,
                     "path": fpath,
-                    "uploaded_at": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "size_kb": round(stat.st_size / 1024, 2),
-                    "supplier": header.get('supplier', 'N/A'),
-                    "invoice_no": header.get('invoice_no', 'N/A'),
-                    "invoice_date": header.get('invoice_date', 'N/A'),
-                    "items_count": len(items)
+                    "uploaded_at": datetime.datetime.fromtimestamp(entry['mtime']).isoformat(),
+                    "size_kb": round(entry['size'] / 1024, 2),
+                    "supplier": summary['supplier'],
+                    "invoice_no": summary['invoice_no'],
+                    "invoice_date": summary['invoice_date'],
+                    "items_count": summary['items_count']
                 })
-            except Exception as e:
+            else:
                 # If parse fails, still show file
                 pending.append({
                     "filename": fname,
                     "path": fpath,
-                    "uploaded_at": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "size_kb": round(stat.st_size / 1024, 2),
+                    "uploaded_at": datetime.datetime.fromtimestamp(entry['mtime']).isoformat(),
+                    "size_kb": round(entry['size'] / 1024, 2),
                     "supplier": "PARSE_ERROR",
                     "invoice_no": "N/A",
                     "items_count": 0,
-                    "error": str(e)
+                    "error": entry['error']
                 })
         
         return jsonify({"pending": pending})
@@ -1253,22 +1696,21 @@ def api_faktura_preview():
         # Parse XML
         header, items = parse_invoice_xml(xml_path)
         
-        # Load lookup for matching (use configured DB connection)
-        try:
-            base = os.path.dirname(os.path.dirname(__file__))
-            cfg_path = os.path.join(base, 'configs', 'faktura_ai.json')
-            cfg = load_config(cfg_path)
-            sifra_set, barcode_set, _, _ = load_lookup_from_db(cfg['db'])
-        except Exception:
-            sifra_set, barcode_set = set(), set()
+        # Load lookup for matching (use configured DB connection); a load failure is a 500,
+        # not a preview with every line unmatched
+        base = os.path.dirname(os.path.dirname(__file__))
+        cfg_path = os.path.join(base, 'configs', 'faktura_ai.json')
+        cfg = load_config(cfg_path)
+        sifra_set, barcode_set, _, artikli_map = load_lookup_from_db(cfg['db'])
+        barcode_index = barcode_index_for(artikli_map)
         
         # Match and calculate
         matched = 0
         total_calc = 0.0
         for item in items:
             sifra = item.get('sifra', '')
-            barcode = item.get('barcode', '')
-            if sifra in sifra_set or barcode in barcode_set:
+            barcode = (item.get('barcode') or '').strip()
+            if sifra in sifra_set or barcode in barcode_set or barcode_index.match(barcode, barcode_set):
                 matched += 1
             
             qty = to_number(item.get('qty', '0'))
@@ -1379,9 +1821,8 @@ def api_faktura_execute():
         if not db_cfg['password']:
             return jsonify({"error": "WPH_PG18_PASS environment variable not set"}), 500
         
-        # Connect and execute
-        conn = psycopg2.connect(**db_cfg)
-        try:
+        # Borrow a pooled connection and execute
+        with pooled_conn(**db_cfg) as conn:
             allow_remote = os.getenv('WPH_WRITE_REMOTE', '0') == '1'
             
             kalk_id = insert_kalkulacija(
@@ -1403,6 +1844,7 @@ def api_faktura_execute():
                     ensure_dir(archive_dir)
                     archive_path = os.path.join(archive_dir, os.path.basename(resolved_path))
                     os.rename(resolved_path, archive_path)
+                    _staging_index(os.path.dirname(resolved_path)).forget(resolved_path)
                 
                 return jsonify({
                     "success": True,
@@ -1413,9 +1855,6 @@ def api_faktura_execute():
                 })
             else:
                 return jsonify({"error": "insert_kalkulacija returned None"}), 500
-        
-        finally:
-            conn.close()
     
     except Exception as e:
         import traceback
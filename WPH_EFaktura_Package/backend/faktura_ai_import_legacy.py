@@ -8,6 +8,8 @@ import subprocess
 from io import StringIO
 import psycopg2
 
+from name_match import semantic_name_match, index_for_artikli
+
 
 def load_config(path):
     with open(path, 'r', encoding='utf-8') as f:
@@ -244,61 +246,6 @@ def fuzzy_barcode_match(invoice_barcode, inventory_barcodes):
     return None
 
 
-def semantic_name_match(invoice_name, inventory_names, threshold=0.8):
-    """Semantic matching for products that are essentially the same but with different wording.
-    This should NOT match different dosages or strengths of the same medication.
-    Returns the best matching inventory name or None.
-    """
-    if not invoice_name:
-        return None
-
-    import re
-
-    def extract_core_name(name):
-        name = name.replace('UL CLEAN', 'ULTRA CLEAN')
-        name = name.replace('UL ', 'ULTRA ')
-        name = name.replace(' PAS ', ' PASTE ')
-        name = name.replace(' TBL ', ' TABLET ')
-        name = name.replace(' CPS ', ' CAPSULES ')
-        name = re.sub(r'\d+x\s*$', '', name)
-        name = ' '.join(name.split())
-        return name.lower().strip()
-
-    invoice_core = extract_core_name(invoice_name)
-    if not invoice_core:
-        return None
-
-    best_match = None
-    best_score = 0.0
-
-    for inv_name in inventory_names:
-        if not inv_name:
-            continue
-        inv_core = extract_core_name(inv_name)
-        if not inv_core:
-            continue
-
-        if invoice_core == inv_core:
-            return inv_name
-
-        inv_words = set(inv_core.split())
-        invoice_words = set(invoice_core.split())
-        if len(inv_words) < 2 or len(invoice_words) < 2:
-            continue
-
-        intersection = invoice_words & inv_words
-        union = invoice_words | inv_words
-        if not union:
-            continue
-        score = len(intersection) / len(union)
-
-        if score > best_score and score >= threshold:
-            best_score = score
-            best_match = inv_name
-
-    return best_match if best_score >= threshold else None
-
-
 def find_artikli_by_barcode(barcode, artikli_map):
     if not barcode:
         return None
@@ -317,14 +264,7 @@ def find_artikli_by_sifra(sifra, artikli_map):
 def find_artikli_by_name(name, artikli_map):
     if not name:
         return None
-    inventory_names = [a['naziv'] for a in artikli_map.values() if a.get('naziv')]
-    matched_name = semantic_name_match(name, inventory_names, threshold=0.8)
-    if not matched_name:
-        return None
-    candidates = [a for a in artikli_map.values() if a.get('naziv') == matched_name]
-    if not candidates:
-        return None
-    return max(candidates, key=lambda x: (x.get('current_stock', 0.0), x.get('avg_daily_sales', 0.0)))
+    return index_for_artikli(artikli_map).best_artikli(name, threshold=0.8)
 
 
 def to_number(val, default=0.0):
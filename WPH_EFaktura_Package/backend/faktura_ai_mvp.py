@@ -3,11 +3,14 @@ import sys
 import json
 import csv
 import datetime as dt
-import xml.etree.ElementTree as ET
-import subprocess
+import time
 from io import StringIO
 import psycopg2
 
+from name_match import semantic_name_match, index_for_artikli
+from lookup_snapshot import load_lookup, lookup_sql
+from invoice_xml import scan, Section, ScanPlan, UBL_NS
+
 def load_config(path):
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
@@ -19,174 +22,135 @@ def ensure_dir(p):
 def dtstamp():
     return dt.datetime.now().strftime('%Y%m%d_%H%M%S')
 
+# Candidate paths per field, in priority order; {ns} is the root element's default namespace
+HEADER_PATHS = {
+    'supplier': [
+        './/{cac}AccountingSupplierParty/{cac}Party/{cac}PartyName/{cbc}Name',
+        './/{ns}AccountingSupplierParty/{ns}Party/{ns}PartyName/{ns}Name',
+        './/{ns}Supplier', './/supplier', './/Furnizuesi', './/Dobavljac'
+    ],
+    'invoice_no': [
+        './/{cbc}ID', './/{ns}ID', './/{ns}InvoiceNumber', './/Broj', './/Number', './/InvoiceNo'
+    ],
+    'invoice_date': [
+        './/{cbc}IssueDate', './/{ns}IssueDate', './/{ns}InvoiceDate', './/Datum', './/Date'
+    ],
+    'currency': [
+        './/{cbc}DocumentCurrencyCode', './/{ns}DocumentCurrencyCode', './/Currency', './/Valuta'
+    ],
+    'total_amount': [
+        './/{cac}LegalMonetaryTotal/{cbc}PayableAmount',
+        './/{ns}LegalMonetaryTotal/{ns}PayableAmount',
+        './/{cbc}TaxInclusiveAmount', './/{ns}TaxInclusiveAmount', './/Total', './/IznosUkupno'
+    ],
+}
+LINE_CANDIDATES = [
+    './/{ns}InvoiceLine', './/{cac}InvoiceLine', './/InvoiceLine', './/Stavka', './/Line'
+]
+LINE_PATHS = {
+    'sifra': ['.//{ns}Sifra', './/{cac}SellersItemIdentification/{cbc}ID', './/ItemID', './/Sifra'],
+    'barcode': ['.//{ns}Barcode', './/{cac}StandardItemIdentification/{cbc}ID', './/EAN', './/GTIN'],
+    'name': ['.//{ns}Name', './/{cac}Item/{cbc}Name', './/Naziv'],
+    'qty': ['.//{ns}InvoicedQuantity', './/{cbc}InvoicedQuantity', './/{ns}Kolicina', './/Qty'],
+    'price': ['.//{ns}PriceAmount', './/{cac}Price/{cbc}PriceAmount', './/{ns}Cena', './/UnitPrice'],
+    'rabat_pct': ['.//{cac}AllowanceCharge/{cbc}MultiplierFactorNumeric', './/{ns}AllowanceCharge/{ns}MultiplierFactorNumeric', './/Rabat', './/Discount'],
+}
+
+_scan_plans = {}  # root namespace -> ScanPlan
+
+def _norm(path: str) -> str:
+    return (path.replace('{ns}', 'ns:')
+                .replace('{cbc}', 'cbc:')
+                .replace('{cac}', 'cac:'))
+
+def _scan_plan(root_tag):
+    """Compiled paths for a document whose root is root_tag (default namespace mapped to 'ns')"""
+    uri = root_tag.split('}')[0].strip('{') if root_tag.startswith('{') else None
+    plan = _scan_plans.get(uri)
+    if plan is None:
+        ns = {'ns': uri} if uri else {}
+        ns.setdefault('cbc', UBL_NS['cbc'])
+        ns.setdefault('cac', UBL_NS['cac'])
+        header = {(field, i): _norm(p) for field, paths in HEADER_PATHS.items() for i, p in enumerate(paths)}
+        line = {(field, i): _norm(p) for field, paths in LINE_PATHS.items() for i, p in enumerate(paths)}
+        sections = [Section('header', None, header, ns)]
+        for i, cand in enumerate(LINE_CANDIDATES):
+            try:
+                sections.append(Section(i, _norm(cand), line, ns))
+            except KeyError:
+                continue  # {ns} candidate on a document without a default namespace
+        plan = _scan_plans[uri] = ScanPlan(sections)
+    return plan
+
+def _pick(record, field, paths):
+    """First candidate whose first matching element has text (as root.find(p) per candidate did)"""
+    for i in range(len(paths)):
+        text = (record.get((field, i)) or '').strip()
+        if text:
+            return text
+    return None
+
 def parse_invoice_xml(xml_path):
     """Parse invoice XML (UBL or custom vendor XML) and extract header + line items.
     Robust to default namespaces by mapping them to the 'ns' prefix.
+    Streams the file once (invoice_xml.scan) instead of searching the whole tree per field.
     """
-    # Build namespace map
-    ns = {}
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        if root.tag.startswith('{'):
-            uri = root.tag.split('}')[0].strip('{')
-            ns['ns'] = uri
-        ns.setdefault('cbc', 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2')
-        ns.setdefault('cac', 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2')
+        _, found = scan(xml_path, _scan_plan)
     except Exception as e:
         raise RuntimeError(f'XML parse failed for {xml_path}: {e}')
 
-    def _norm(path: str) -> str:
-        return (path.replace('{ns}', 'ns:')
-                    .replace('{cbc}', 'cbc:')
-                    .replace('{cac}', 'cac:'))
-
-    def find_text(paths):
-        for p in paths:
-            q = _norm(p)
-            try:
-                el = root.find(q, ns) if ns else root.find(q)
-                if el is not None and (el.text or '').strip():
-                    return el.text.strip()
-            except Exception:
-                pass
-        return None
-
-    hdr = {
-        'supplier': find_text([
-            './/{cac}AccountingSupplierParty/{cac}Party/{cac}PartyName/{cbc}Name',
-            './/{ns}AccountingSupplierParty/{ns}Party/{ns}PartyName/{ns}Name',
-            './/{ns}Supplier', './/supplier', './/Furnizuesi', './/Dobavljac'
-        ]),
-        'invoice_no': find_text([
-            './/{cbc}ID', './/{ns}ID', './/{ns}InvoiceNumber', './/Broj', './/Number', './/InvoiceNo'
-        ]),
-        'invoice_date': find_text([
-            './/{cbc}IssueDate', './/{ns}IssueDate', './/{ns}InvoiceDate', './/Datum', './/Date'
-        ]),
-        'currency': find_text([
-            './/{cbc}DocumentCurrencyCode', './/{ns}DocumentCurrencyCode', './/Currency', './/Valuta'
-        ]),
-        'total_amount': find_text([
-            './/{cac}LegalMonetaryTotal/{cbc}PayableAmount',
-            './/{ns}LegalMonetaryTotal/{ns}PayableAmount',
-            './/{cbc}TaxInclusiveAmount', './/{ns}TaxInclusiveAmount', './/Total', './/IznosUkupno'
-        ])
-    }
+    head = found['header'][0]
+    hdr = {field: _pick(head, field, paths) for field, paths in HEADER_PATHS.items()}
 
-    lines = []
-    line_candidates = [
-        './/{ns}InvoiceLine', './/{cac}InvoiceLine', './/InvoiceLine', './/Stavka', './/Line'
-    ]
     found_elems = []
-    for cand in line_candidates:
-        try:
-            elems = root.findall(_norm(cand), ns) if ns else root.findall(cand)
-            if elems:
-                found_elems = elems
-                break
-        except Exception:
-            continue
+    for i in range(len(LINE_CANDIDATES)):
+        if found.get(i):
+            found_elems = found[i]
+            break
 
-    def get(el, paths):
-        for p in paths:
-            q = _norm(p)
-            try:
-                node = el.find(q, ns) if ns else el.find(q)
-                if node is not None and (getattr(node, 'text', '') or '').strip():
-                    return node.text.strip()
-            except Exception:
-                pass
-        return None
-
-    for el in found_elems:
-        item = {
-            'sifra': get(el, ['.//{ns}Sifra', './/{cac}SellersItemIdentification/{cbc}ID', './/ItemID', './/Sifra']),
-            'barcode': get(el, ['.//{ns}Barcode', './/{cac}StandardItemIdentification/{cbc}ID', './/EAN', './/GTIN']),
-            'name': get(el, ['.//{ns}Name', './/{cac}Item/{cbc}Name', './/Naziv']),
-            'qty': get(el, ['.//{ns}InvoicedQuantity', './/{cbc}InvoicedQuantity', './/{ns}Kolicina', './/Qty']),
-            'price': get(el, ['.//{ns}PriceAmount', './/{cac}Price/{cbc}PriceAmount', './/{ns}Cena', './/UnitPrice']),
-            'rabat_pct': get(el, ['.//{cac}AllowanceCharge/{cbc}MultiplierFactorNumeric', './/{ns}AllowanceCharge/{ns}MultiplierFactorNumeric', './/Rabat', './/Discount'])
-        }
-        lines.append(item)
+    lines = []
+    for rec in found_elems:
+        lines.append({field: _pick(rec, field, paths) for field, paths in LINE_PATHS.items()})
 
     return hdr, lines
 
+def _copy_lookup_rows(conn):
+    """Lookup rows [(sifra, barkod, naziv, stock, sales)] via in-process COPY ... TO STDOUT (CSV)."""
+    start = time.monotonic()
+    buf = StringIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({lookup_sql('ref.')}) TO STDOUT WITH CSV HEADER", buf)
+    buf.seek(0)
+    reader = csv.reader(buf)
+    next(reader, None)  # header
+    rows = [(r[0] or None, r[1] or None, r[2] or None, r[3], r[4]) for r in reader if len(r) >= 5]
+    print(f"Lookup COPY: {len(rows)} rows in {(time.monotonic() - start) * 1000.0:.1f} ms")
+    return rows
+
 def load_lookup_from_db(cfg_db):
-    """Loads artikli lookup (sifra, barkod, naziv) from wph_ai.ref.artikli via psql COPY.
+    """Loads artikli lookup (sifra, barkod, naziv) from wph_ai.ref.artikli.
     When duplicates exist, selects the article with highest current_stock or avg_daily_sales.
-    Returns: sifra_set, barcode_set, name_list, artikli_map (sifra -> full record).
+    Served from the versioned on-disk snapshot (lookup_snapshot.py); COPY runs only when ref.artikli changed.
+    Returns: sifra_set, barcode_set, name_list, artikli_map (sifra -> full record). Treat as read-only (shared).
+    Raises RuntimeError if the lookup cannot be loaded (matching against empty sets would be silently wrong).
     """
-    host = cfg_db['host']; port = str(cfg_db['port']); user = cfg_db['user']; db = cfg_db['dbname']
     pw_env = cfg_db.get('password_env')
-    psql_candidates = [
-        r"C:\\Program Files\\PostgreSQL\\18\\bin\\psql.exe",
-        'psql'
-    ]
-    psql = next((p for p in psql_candidates if os.path.exists(p) or p == 'psql'), 'psql')
-    env = os.environ.copy()
-    if pw_env and env.get(pw_env):
-        env['PGPASSWORD'] = env.get(pw_env)
-    
-    # Query that selects best article when duplicates exist
-    query = (
-        "COPY ("
-        "WITH artikli_with_metrics AS ("
-        "    SELECT DISTINCT ON (COALESCE(ra.sifra, ra.barkod)) "
-        "        ra.sifra, ra.barkod, ra.naziv, "
-        "        COALESCE(wo.current_stock, 0) as current_stock, "
-        "        COALESCE(wo.avg_daily_sales, 0) as avg_daily_sales "
-        "    FROM ref.artikli ra "
-        "    LEFT JOIN wph_core.get_orders(28, 30, false, NULL, NULL) wo ON wo.sifra = ra.sifra "
-        "    WHERE ra.sifra IS NOT NULL OR ra.barkod IS NOT NULL "
-        "    ORDER BY COALESCE(ra.sifra, ra.barkod), "
-        "             COALESCE(wo.current_stock, 0) DESC, "
-        "             COALESCE(wo.avg_daily_sales, 0) DESC "
-        ") "
-        "SELECT COALESCE(NULLIF(TRIM(sifra),''),NULL) AS sifra, "
-        "COALESCE(NULLIF(TRIM(barkod),''),NULL) AS barkod, "
-        "COALESCE(NULLIF(TRIM(naziv),''),NULL) AS naziv, "
-        "current_stock, avg_daily_sales "
-        "FROM artikli_with_metrics"
-        ") TO STDOUT WITH CSV HEADER"
-    )
-    
     try:
-        proc = subprocess.run([
-            psql, '-h', host, '-p', port, '-U', user, '-d', db, '-c', query
-        ], capture_output=True, text=True, env=env, check=True)
+        conn = psycopg2.connect(
+            host=cfg_db['host'], port=str(cfg_db['port']), user=cfg_db['user'], dbname=cfg_db['dbname'],
+            password=os.environ.get(pw_env) if pw_env else None
+        )
+        try:
+            lookup = load_lookup(conn, 'ref.', fetch_rows=lambda: _copy_lookup_rows(conn))
+        finally:
+            conn.close()
     except Exception as e:
-        # fallback: empty sets and list
-        return set(), set(), [], {}
-    
-    data = proc.stdout
-    sifra_set, barcode_set, name_list, artikli_map = set(), set(), [], {}
-    
-    for i, line in enumerate(StringIO(data)):
-        if i == 0:  # header
-            continue
-        parts = [p.strip() for p in line.rstrip('\n').split(',')]
-        if len(parts) >= 5:
-            s, b, n, stock, sales = parts[0] or None, parts[1] or None, parts[2] or None, parts[3], parts[4]
-            
-            # Create artikli record
-            artikli_record = {
-                'sifra': s,
-                'barkod': b, 
-                'naziv': n,
-                'current_stock': float(stock) if stock and stock not in ('NULL', '') and stock.replace('.', '').replace('-', '').isdigit() else 0,
-                'avg_daily_sales': float(sales) if sales and sales not in ('NULL', '') and sales.replace('.', '').replace('-', '').isdigit() else 0
-            }
-            
-            if s:
-                sifra_set.add(s)
-                artikli_map[s] = artikli_record
-            if b:
-                barcode_set.add(b)
-            if n:
-                name_list.append(n)
+        raise RuntimeError(f"Artikli lookup load failed ({cfg_db.get('host')}/{cfg_db.get('dbname')}): {e}") from e
     
-    return sifra_set, barcode_set, name_list, artikli_map
+    # Barcode index is built here once and reused by find_artikli_by_barcode for this artikli_map
+    barcode_index_for(lookup[3])
+    return lookup
 
 def write_csv(path, rows, header):
     ensure_dir(os.path.dirname(path))
@@ -231,38 +195,73 @@ def fuzzy_barcode_match(invoice_barcode, inventory_barcodes):
     
     return None
 
+def _stock_rank(artikli):
+    return (artikli['current_stock'], artikli['avg_daily_sales'])
+
+def barcode_variants(barcode):
+    """Fallback barcodes tried by find_artikli_by_barcode when there is no exact match."""
+    variations = []
+    if len(barcode) > 12:
+        variations.append(barcode.lstrip('0'))
+    if barcode.startswith('0'):
+        variations.append('86' + barcode[1:])
+    if barcode.startswith('60'):
+        variations.append('8' + barcode)
+    return variations
+
+class BarcodeIndex:
+    """barkod -> best artikli record (highest stock, then sales), so exact and fuzzy lookups are dict hits.
+    Built once per artikli_map; ties keep the first record, as the linear scan did."""
+
+    def __init__(self, artikli_map):
+        self.best = {}
+        for artikli in artikli_map.values():
+            b = artikli['barkod']
+            if not b:
+                continue
+            current = self.best.get(b)
+            if current is None or _stock_rank(artikli) > _stock_rank(current):
+                self.best[b] = artikli
+        self.barcodes = set(self.best)
+
+    def find(self, barcode):
+        """Best artikli for barcode (exact, else the fuzzy variations). Same result as the old linear scan."""
+        if not barcode:
+            return None
+        best = self.best.get(barcode)
+        if best is not None:
+            return best
+        for var in barcode_variants(barcode):
+            candidate = self.best.get(var)
+            if candidate is not None and (best is None or _stock_rank(candidate) > _stock_rank(best)):
+                best = candidate
+        return best
+
+    def match(self, barcode, inventory_barcodes=None):
+        """Exact barcode, else fuzzy_barcode_match, then find() - the barcode steps of main()."""
+        if not barcode:
+            return None
+        inventory_barcodes = self.barcodes if inventory_barcodes is None else inventory_barcodes
+        if barcode in inventory_barcodes:
+            return self.find(barcode)
+        fuzzy_barcode = fuzzy_barcode_match(barcode, inventory_barcodes)
+        return self.find(fuzzy_barcode) if fuzzy_barcode else None
+
+_barcode_index = (None, None)
+
+def barcode_index_for(artikli_map):
+    """BarcodeIndex for artikli_map, reused while the same (unchanged) map is passed in."""
+    global _barcode_index
+    cached_map, index = _barcode_index
+    if cached_map is not artikli_map or index.size != len(artikli_map):
+        index = BarcodeIndex(artikli_map)
+        index.size = len(artikli_map)
+        _barcode_index = (artikli_map, index)
+    return index
+
 def find_artikli_by_barcode(barcode, artikli_map):
     """Find artikli record by barcode (exact or fuzzy match). Returns best artikli if duplicates."""
-    if not barcode:
-        return None
-    
-    candidates = []
-    
-    # Try exact match first
-    for artikli in artikli_map.values():
-        if artikli['barkod'] == barcode:
-            candidates.append(artikli)
-    
-    # Try fuzzy variations if no exact match
-    if not candidates:
-        variations = []
-        if len(barcode) > 12:
-            variations.append(barcode.lstrip('0'))
-        if barcode.startswith('0'):
-            variations.append('86' + barcode[1:])
-        if barcode.startswith('60'):
-            variations.append('8' + barcode)
-        
-        for var in variations:
-            for artikli in artikli_map.values():
-                if artikli['barkod'] == var:
-                    candidates.append(artikli)
-    
-    # Return best candidate (highest stock or sales)
-    if candidates:
-        return max(candidates, key=lambda x: (x['current_stock'], x['avg_daily_sales']))
-    
-    return None
+    return barcode_index_for(artikli_map).find(barcode)
 
 def find_artikli_by_sifra(sifra, artikli_map):
     """Find artikli record by sifra. Returns best artikli if duplicates."""
@@ -276,19 +275,9 @@ def find_artikli_by_name(name, artikli_map):
     """Find artikli record by semantic name match. Returns best artikli if duplicates."""
     if not name:
         return None
-    
-    # Get all names from artikli_map
-    inventory_names = [art['naziv'] for art in artikli_map.values() if art['naziv']]
-    
-    matched_name = semantic_name_match(name, inventory_names, threshold=0.8)
-    if matched_name:
-        # Find all artikli records with this name
-        candidates = [art for art in artikli_map.values() if art['naziv'] == matched_name]
-        
-        # Return best candidate (highest stock or sales)
-        if candidates:
-            return max(candidates, key=lambda x: (x['current_stock'], x['avg_daily_sales']))
-    
+    # The name index over artikli_map is built on first use and reused while the same map is passed in
+    return index_for_artikli(artikli_map).best_artikli(name, threshold=0.8)
+
 def register_new_artikuj(new_items, cfg_db, supplier_name):
     """Register new artikuj in the database using advanced lookup logic."""
     if not new_items:
@@ -470,69 +459,6 @@ def lookup_or_create_artikal(cur, item, schema_prefix='ref.', auto_register=True
                 return (None, None, None, 'NOT_FOUND')
 
     return (None, None, None, 'NOT_FOUND')
-    """Semantic matching for products that are essentially the same but with different wording.
-    This should NOT match different dosages or strengths of the same medication."""
-    if not invoice_name:
-        return None
-    
-    # Extract core product name by normalizing abbreviations but keeping key identifiers
-    import re
-    
-    def extract_core_name(name):
-        # Normalize common abbreviations
-        name = name.replace('UL CLEAN', 'ULTRA CLEAN')
-        name = name.replace('UL ', 'ULTRA ')
-        name = name.replace(' PAS ', ' PASTE ')
-        name = name.replace(' TBL ', ' TABLET ')
-        name = name.replace(' CPS ', ' CAPSULES ')
-        
-        # For semantic matching, we want to keep the dosage as part of the identity
-        # Only remove packaging quantities (30x, 20x) but keep the actual dosage
-        name = re.sub(r'\d+x\s*$', '', name)  # Remove trailing quantities like "30x"
-        
-        # Clean up extra spaces
-        name = ' '.join(name.split())
-        return name.lower().strip()
-    
-    invoice_core = extract_core_name(invoice_name)
-    if not invoice_core:
-        return None
-    
-    best_match = None
-    best_score = 0
-    
-    for inv_name in inventory_names:
-        if not inv_name:
-            continue
-        
-        inv_core = extract_core_name(inv_name)
-        if not inv_core:
-            continue
-        
-        # For semantic matching, require very high similarity
-        # This prevents matching different dosages
-        if invoice_core == inv_core:
-            return inv_name  # Exact match after normalization
-        
-        # For fuzzy matching, require most words to match
-        inv_words = set(inv_core.split())
-        invoice_words = set(invoice_core.split())
-        
-        if len(inv_words) < 2 or len(invoice_words) < 2:
-            continue
-            
-        intersection = invoice_words & inv_words
-        union = invoice_words | inv_words
-        
-        if union:
-            score = len(intersection) / len(union)
-            
-            # Only match if score is very high (near identical)
-            if score > best_score and score >= threshold:
-                best_score = score
-                best_match = inv_name
-    
-    return best_match if best_score >= threshold else None
 
 def to_number(val, default=0):
     """Convert string to number, return default if conversion fails."""
@@ -663,6 +589,7 @@ def main():
 
     # load lookup sets for validation
     sifra_set, barcode_set, name_list, artikli_map = load_lookup_from_db(cfg['db'])
+    barcode_index = barcode_index_for(artikli_map)
     tol_pct = float(cfg.get('tolerance', {}).get('total_pct', 0.1))
     summary_rows = []
 
@@ -697,7 +624,7 @@ def main():
                             
                             # Priority 1: Exact barcode match
                             if b and b in barcode_set:
-                                matched_artikli = find_artikli_by_barcode(b, artikli_map)
+                                matched_artikli = barcode_index.find(b)
                                 if matched_artikli:
                                     matched += 1
                                     matched_artikuj.append(matched_artikli)
@@ -706,7 +633,7 @@ def main():
                             elif b:
                                 fuzzy_barcode = fuzzy_barcode_match(b, barcode_set)
                                 if fuzzy_barcode:
-                                    matched_artikli = find_artikli_by_barcode(fuzzy_barcode, artikli_map)
+                                    matched_artikli = barcode_index.find(fuzzy_barcode)
                                     if matched_artikli:
                                         matched += 1
                                         matched_artikuj.append(matched_artikli)
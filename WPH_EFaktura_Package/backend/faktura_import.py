@@ -6,12 +6,17 @@ import argparse
 from getpass import getpass
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
-import xml.etree.ElementTree as ET
 import psycopg2
+from psycopg2.extras import execute_values
 
 # Ensure local app path import
 sys.path.insert(0, r'C:\Wellona\wphAI\app')
 from mpkalk import mp_kalk, MPCfg
+from id_allocator import IdAllocator
+from article_resolver import ArticleResolver
+from name_match import semantic_name_match, index_for_artikli
+from lookup_snapshot import load_lookup
+from invoice_xml import parse_invoice
 
 try:
     sys.stdout.reconfigure(encoding='utf-8')
@@ -60,12 +65,107 @@ AUTO_NIVELIZACIJA = bool(int(env_or('WPH_AUTO_NIVELIZACIJA', '0')))
 # Auto-create nivelizacija documents when MP changes (default 0 = log only, no DB writes)
 AUTO_NIVELIZACIJA = bool(int(env_or('WPH_AUTO_NIVELIZACIJA', '0')))
 
-def create_nivelizacija(cur, price_changes, magacin='101', periodid=4, userid=14, schema_prefix='public.', dry_run=False):
+# Batched ERP writes: rows per multi-row INSERT statement
+INSERT_PAGE_SIZE = int(env_or('WPH_INSERT_PAGE_SIZE', '500'))
+
+KALKSTAVKE_COLUMNS = ['id', 'kalkid', 'artikal', 'jedmere', 'kolicina', 'nabavnacena', 'rabatstopa', 'trosak',
+                      'rucstopa', 'cena', 'pdvstopa', 'cenasapdv', 'serija', 'roktrajanja']
+NIVSTAVKE_COLUMNS = ['id', 'nivid', 'artikal', 'jedmere', 'kolicina', 'staracena', 'novacena', 'stariporez',
+                     'noviporez', 'staracenasaporezom', 'novacenasaporezom']
+# lookup_or_create_artikal actions for artikli that already existed (have price history)
+EXISTING_ARTIKAL_ACTIONS = ('FOUND', 'BARCODE_ADDED', 'SIFRA_FALLBACK')
+
+
+def _insert_rows(cur, table, columns, rows, page_size=None):
+    """Multi-row INSERT via execute_values: one statement per page_size rows instead of one per row"""
+    if not rows:
+        return 0
+    execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", rows,
+                   page_size=page_size or INSERT_PAGE_SIZE)
+    return len(rows)
+
+
+def _execute_guarded(cur, sql, params=None):
+    """Execute one statement; on error roll back only that statement (SAVEPOINT) so the import transaction survives"""
+    in_tx = not cur.connection.autocommit
+    if in_tx:
+        cur.execute("SAVEPOINT wph_stmt")
+    try:
+        cur.execute(sql, params)
+    except Exception:
+        if in_tx:
+            cur.execute("ROLLBACK TO SAVEPOINT wph_stmt")
+        raise
+    if in_tx:
+        cur.execute("RELEASE SAVEPOINT wph_stmt")
+
+
+def _last_kalk_prices(cur, sifre, schema_prefix):
+    """{artikal: (rucstopa, cenasapdv, nabavnacena)} from each artikal's latest kalkstavke line with RUC > 0"""
+    if not sifre:
+        return {}
+    cur.execute(f"""
+        SELECT a.artikal, k.rucstopa, k.cenasapdv, k.nabavnacena
+        FROM unnest(%s::text[]) AS a(artikal)
+        CROSS JOIN LATERAL (
+            SELECT rucstopa, cenasapdv, nabavnacena FROM {schema_prefix}kalkstavke
+            WHERE artikal = a.artikal AND rucstopa IS NOT NULL AND rucstopa > 0
+            ORDER BY id DESC LIMIT 1
+        ) k
+    """, [list(sifre)])
+    return {r[0]: (r[1], r[2], r[3]) for r in cur.fetchall()}
+
+
+def _artikli_prices(cur, sifre, schema_prefix):
+    """{sifra: artikli.cena} (master retail price)"""
+    if not sifre:
+        return {}
+    cur.execute(f"SELECT sifra, cena FROM {schema_prefix}artikli WHERE sifra = ANY(%s)", [list(sifre)])
+    return dict(cur.fetchall())
+
+
+def _write_price_lock_audit(rows):
+    """Write price-lock audit rows to LOCAL wph_ai (NEVER to remote ebdata server); commits on its own connection"""
+    audit_conn = psycopg2.connect(
+        dbname='wph_ai',
+        user='postgres',  # Local user
+        password=os.getenv('WPH_LOCAL_PASS', ''),  # Local password
+        host='127.0.0.1',  # ALWAYS localhost
+        port=5432
+    )
+    try:
+        with audit_conn.cursor() as audit_cur:
+            audit_cur.execute("""
+                CREATE TABLE IF NOT EXISTS public.wph_audit_price_lock (
+                    id bigserial PRIMARY KEY,
+                    ts timestamptz DEFAULT now(),
+                    kalkid bigint,
+                    artikal varchar(15),
+                    source varchar(20),
+                    computed_mp numeric(19,4),
+                    preserved_mp numeric(19,4),
+                    last_nabavna numeric(19,4),
+                    new_nabavna numeric(19,4),
+                    rabat_pct numeric(10,4),
+                    pdv_pct numeric(10,4),
+                    ruc_used numeric(10,4),
+                    action_tag varchar(30)
+                )
+            """)
+            _insert_rows(audit_cur, "public.wph_audit_price_lock",
+                         ['kalkid', 'artikal', 'source', 'computed_mp', 'preserved_mp', 'last_nabavna',
+                          'new_nabavna', 'rabat_pct', 'pdv_pct', 'ruc_used', 'action_tag'], rows)
+        audit_conn.commit()
+    finally:
+        audit_conn.close()
+
+def create_nivelizacija(cur, price_changes, magacin='101', periodid=4, userid=14, schema_prefix='public.', dry_run=False, ids=None):
     """
     Create a nivelizacija (MP adjustment) document when purchase prices change.
     
     Args:
         price_changes: list of dicts with keys: artikal, stara_cena, nova_cena, kolicina
+        ids: IdAllocator of the caller's transaction (a new one is used if omitted)
         Returns: nivid (nivelizacija document ID) or None
     """
     if not price_changes:
@@ -87,8 +187,8 @@ def create_nivelizacija(cur, price_changes, magacin='101', periodid=4, userid=14
             return None
         
         # Insert header
-        cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {schema_prefix}nivopste")
-        niv_id = cur.fetchone()[0]
+        ids = ids or IdAllocator(cur, schema_prefix)
+        niv_id = ids.next_id('nivopste')
         
         cur.execute(f"""
             INSERT INTO {schema_prefix}nivopste
@@ -100,34 +200,29 @@ def create_nivelizacija(cur, price_changes, magacin='101', periodid=4, userid=14
             userid, userid, datetime.now()
         ])
         
-        # Insert lines
-        for pc in price_changes:
-            cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {schema_prefix}nivstavke")
-            line_id = cur.fetchone()[0]
-            
-            # Get PDV for this artikal
-            cur.execute(f"SELECT vrstaporeza FROM {schema_prefix}artikli WHERE sifra=%s", [pc['artikal']])
-            row_pdv = cur.fetchone()
+        # Insert lines: PDV for all artikli in one query, then one multi-row INSERT
+        cur.execute(f"SELECT sifra, vrstaporeza FROM {schema_prefix}artikli WHERE sifra = ANY(%s)",
+                    [sorted({pc['artikal'] for pc in price_changes})])
+        vrsta_by_sifra = dict(cur.fetchall())
+        line_ids = ids.reserve('nivstavke', len(price_changes))
+        niv_rows = []
+        for line_id, pc in zip(line_ids, price_changes):
+            vrsta = vrsta_by_sifra.get(pc['artikal'])
             pdv_pct = 10.0  # default
-            if row_pdv and row_pdv[0]:
-                if row_pdv[0] in ['OPO', 'PDV10']:
+            if vrsta:
+                if vrsta in ['OPO', 'PDV10']:
                     pdv_pct = 10.0
-                elif row_pdv[0] in ['PDV20']:
+                elif vrsta in ['PDV20']:
                     pdv_pct = 20.0
             
             stara_bez = float(pc['stara_cena']) / (1 + pdv_pct/100.0)
             nova_bez = float(pc['nova_cena']) / (1 + pdv_pct/100.0)
-            
-            cur.execute(f"""
-                INSERT INTO {schema_prefix}nivstavke
-                (id, nivid, artikal, jedmere, kolicina, staracena, novacena, stariporez, noviporez, 
-                 staracenasaporezom, novacenasaporezom)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, [
+            niv_rows.append([
                 line_id, niv_id, pc['artikal'], 'KOM', pc.get('kolicina', 0),
                 stara_bez, nova_bez, pdv_pct, pdv_pct,
                 pc['stara_cena'], pc['nova_cena']
             ])
+        _insert_rows(cur, f"{schema_prefix}nivstavke", NIVSTAVKE_COLUMNS, niv_rows)
         
         print(f"✓ Nivelizacija created: broj={broj}, nivid={niv_id}, items={len(price_changes)}")
         return niv_id
@@ -163,266 +258,21 @@ def get_next_broj(cur, year_suffix=None, schema_prefix=SCHEMA_PREFIX):
 
 def load_artikli_lookup(conn, schema_prefix='ref.'):
     """Loads artikli lookup (sifra, barkod, naziv) from database.
-    Returns: sifra_set, barcode_set, name_list, artikli_map (sifra -> full record).
+    Served from the versioned on-disk snapshot (lookup_snapshot.py), rebuilt only when artikli changed.
+    Returns: sifra_set, barcode_set, name_list, artikli_map (sifra -> full record). Treat as read-only (shared).
     """
-    cur = conn.cursor()
-    try:
-        # Query that selects best article when duplicates exist
-        query = f"""
-            WITH artikli_with_metrics AS (
-                SELECT DISTINCT ON (COALESCE(ra.sifra, ra.barkod)) 
-                    ra.sifra, ra.barkod, ra.naziv, 
-                    COALESCE(wo.current_stock, 0) as current_stock, 
-                    COALESCE(wo.avg_daily_sales, 0) as avg_daily_sales 
-                FROM {schema_prefix}artikli ra 
-                LEFT JOIN wph_core.get_orders(28, 30, false, NULL, NULL) wo ON wo.sifra = ra.sifra 
-                WHERE ra.sifra IS NOT NULL OR ra.barkod IS NOT NULL 
-                ORDER BY COALESCE(ra.sifra, ra.barkod), 
-                         COALESCE(wo.current_stock, 0) DESC, 
-                         COALESCE(wo.avg_daily_sales, 0) DESC 
-            ) 
-            SELECT COALESCE(NULLIF(TRIM(sifra),''),NULL) AS sifra, 
-            COALESCE(NULLIF(TRIM(barkod),''),NULL) AS barkod, 
-            COALESCE(NULLIF(TRIM(naziv),''),NULL) AS naziv, 
-            current_stock, avg_daily_sales 
-            FROM artikli_with_metrics
-        """
-        
-        cur.execute(query)
-        rows = cur.fetchall()
-        
-        sifra_set, barcode_set, name_list, artikli_map = set(), set(), [], {}
-        
-        for row in rows:
-            s, b, n, stock, sales = row
-            
-            # Create artikli record
-            artikli_record = {
-                'sifra': s,
-                'barkod': b, 
-                'naziv': n,
-                'current_stock': float(stock) if stock and stock not in ('NULL', '') and str(stock).replace('.', '').replace('-', '').isdigit() else 0,
-                'avg_daily_sales': float(sales) if sales and sales not in ('NULL', '') and str(sales).replace('.', '').replace('-', '').isdigit() else 0
-            }
-            
-            if s:
-                sifra_set.add(s)
-                artikli_map[s] = artikli_record
-            if b:
-                barcode_set.add(b)
-            if n:
-                name_list.append(n)
-        
-        return sifra_set, barcode_set, name_list, artikli_map
-        
-    finally:
-        cur.close()
+    return load_lookup(conn, schema_prefix)
 
 def find_artikli_by_name(name, artikli_map):
     """Find artikli record by semantic name match. Returns best artikli if duplicates."""
     if not name:
         return None
-    
-    # Get all names from artikli_map
-    inventory_names = [art['naziv'] for art in artikli_map.values() if art['naziv']]
-    
-    matched_name = semantic_name_match(name, inventory_names, threshold=0.8)
-    if matched_name:
-        # Find all artikli records with this name
-        candidates = [art for art in artikli_map.values() if art['naziv'] == matched_name]
-        
-        # Return best candidate (highest stock or sales)
-        if candidates:
-            return max(candidates, key=lambda x: (x['current_stock'], x['avg_daily_sales']))
-    
-    return None
-
-def semantic_name_match(invoice_name, inventory_names, threshold=0.8):
-    """Semantic matching for products that are essentially the same but with different wording."""
-    if not invoice_name:
-        return None
-    
-    # Extract core product name by normalizing abbreviations but keeping key identifiers
-    import re
-    
-    def extract_core_name(name):
-        # Normalize common abbreviations
-        name = name.replace('UL CLEAN', 'ULTRA CLEAN')
-        name = name.replace('UL ', 'ULTRA ')
-        name = name.replace(' PAS ', ' PASTE ')
-        name = name.replace(' TBL ', ' TABLET ')
-        name = name.replace(' CPS ', ' CAPSULES ')
-        
-        # For semantic matching, we want to keep the dosage as part of the identity
-        # Only remove packaging quantities (30x, 20x) but keep the actual dosage
-        name = re.sub(r'\d+x\s*$', '', name)  # Remove trailing quantities like "30x"
-        
-        # Clean up extra spaces
-        name = ' '.join(name.split())
-        return name.lower().strip()
-    
-    invoice_core = extract_core_name(invoice_name)
-    if not invoice_core:
-        return None
-    
-    best_match = None
-    best_score = 0
-    
-    for inv_name in inventory_names:
-        if not inv_name:
-            continue
-        
-        inv_core = extract_core_name(inv_name)
-        if not inv_core:
-            continue
-        
-        # For semantic matching, require very high similarity
-        # This prevents matching different dosages
-        if invoice_core == inv_core:
-            return inv_name  # Exact match after normalization
-        
-        # For fuzzy matching, require most words to match
-        inv_words = set(inv_core.split())
-        invoice_words = set(invoice_core.split())
-        
-        if len(inv_words) < 2 or len(invoice_words) < 2:
-            continue
-            
-        intersection = invoice_words & inv_words
-        union = invoice_words | inv_words
-        
-        if union:
-            score = len(intersection) / len(union)
-            
-            # Only match if score is very high (near identical)
-            if score > best_score and score >= threshold:
-                best_score = score
-                best_match = inv_name
-    
-    return best_match if best_score >= threshold else None
+    # The name index over artikli_map is built on first use and reused while the same map is passed in
+    return index_for_artikli(artikli_map).best_artikli(name, threshold=0.8)
 
 def parse_invoice_xml(xml_path):
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
-    # UBL namespace definitions
-    ns = {
-        'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
-        'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2'
-    }
-    
-    dok = root.find('.//Dokument')
-
-    # Valuta datum - podržava oba Sopharma i UBL (eFaktura.rs) format
-    valuta_node = root.find('.//Valutacije/Valutacija/Datum')
-    if valuta_node is None:
-        # Fallback za UBL format (eFaktura.rs)
-        valuta_node = root.find('.//cbc:DueDate', ns)
-    valuta_dt = datetime.strptime(valuta_node.text, '%Y-%m-%d') if valuta_node is not None and valuta_node.text else None
-
-    popust_node = root.find('.//Valutacije/Valutacija/Popust')
-    vrednost_node = root.find('.//Valutacije/Valutacija/Vrednost')
-    cash_discount = D(popust_node.text if popust_node is not None else None, '0')
-    payable_amount = D(vrednost_node.text if vrednost_node is not None else None, '0')
-
-    # Broj fakture - podržava Sopharma i UBL format
-    broj_node = dok.find('Broj') if dok is not None else None
-    if broj_node is None:
-        broj_node = root.find('.//cbc:ID', ns)
-    broj_faktura = broj_node.text.strip() if broj_node is not None and broj_node.text else ''
-
-    # Datum fakture - podržava Sopharma i UBL format
-    datum_node = dok.find('Datum') if dok is not None else None
-    if datum_node is None:
-        datum_node = root.find('.//cbc:IssueDate', ns)
-    datum_text = datum_node.text if datum_node is not None and datum_node.text else None
-    datum = datetime.strptime(datum_text, '%Y-%m-%d') if datum_text else datetime.now()
-
-    # Dobavljač - podržava Sopharma i UBL format
-    dobavljac_node = root.find('.//Dobavljac/Naziv')
-    if dobavljac_node is None:
-        dobavljac_node = root.find('.//cac:AccountingSupplierParty//cbc:RegistrationName', ns)
-    dobavljac = dobavljac_node.text.strip() if dobavljac_node is not None and dobavljac_node.text else ''
-
-    # Total neto - podržava Sopharma i UBL format  
-    total_neto_node = root.find('.//Vrednosti/NetoFakturna')
-    if total_neto_node is None:
-        total_neto_node = root.find('.//cbc:TaxExclusiveAmount', ns)
-    total_neto = D(total_neto_node.text, '0') if total_neto_node is not None and total_neto_node.text else D('0')
-
-    header = {
-        'broj_faktura': broj_faktura,
-        'datum': datum,
-        'dobavljac': dobavljac,
-        'total_neto': total_neto,
-        'valuta_datum': valuta_dt,
-        'cash_discount': cash_discount,
-        'payable_amount': payable_amount,
-    }
-
-    items = []
-    # Try legacy vendor format first
-    stavke = root.findall('.//Stavke/Stavka') or root.findall('.//Stavka')
-    if stavke:
-        print(f'Parsed items: {len(stavke)} (legacy vendor format)')
-        for stavka in stavke:
-            pdv_txt = (stavka.findtext('PorezProcenat') or '').strip()
-            pdv_val = D(pdv_txt, '10.0')
-
-            sifra = (stavka.findtext('Sifra') or '').strip()
-            gtin = (stavka.findtext('GTIN') or '').strip() or None
-            naziv = (stavka.findtext('Naziv') or '').strip()
-            serija = (stavka.findtext('BrojSerije') or '').strip()
-            rok = (stavka.findtext('RokUpotrebe') or '').strip()
-
-            if serija in ('0', '0000', 'None', ''):
-                serija = None
-            if rok in ('0', '0000-00-00', 'None', ''):
-                rok_dt = None
-            else:
-                rok_dt = datetime.strptime(rok, '%Y-%m-%d')
-
-            items.append({
-                'sifra': sifra,
-                'barcode': gtin,
-                'naziv': naziv,
-                'kolicina': D(stavka.findtext('Kolicina'), '0'),
-                'cena_fakturna': D(stavka.findtext('CenaFakturna'), '0'),
-                'rabat_pct': D(stavka.findtext('RabatProcenat'), '0'),
-                'serija': serija,
-                'rok_dt': rok_dt,
-                'pdv_pct': float(pdv_val),
-            })
-    else:
-        # Fallback to UBL eFaktura format
-        inv_lines = root.findall('.//cac:InvoiceLine', ns)
-        print(f'Parsed items: {len(inv_lines)} (UBL format)')
-        for il in inv_lines:
-            qty_txt = il.findtext('./cbc:InvoicedQuantity', namespaces=ns) or '0'
-            price_txt = il.findtext('./cac:Price/cbc:PriceAmount', namespaces=ns) or '0'
-            disc_pct_txt = il.findtext('./cac:AllowanceCharge/cbc:MultiplierFactorNumeric', namespaces=ns) or '0'
-            pdv_txt = (
-                il.findtext('./cac:Item/cac:ClassifiedTaxCategory/cbc:Percent', namespaces=ns)
-                or il.findtext('./cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent', namespaces=ns)
-                or '10'
-            )
-            supplier_id = il.findtext('./cac:Item/cac:SellersItemIdentification/cbc:ID', namespaces=ns) or ''
-            gtin = il.findtext('./cac:Item/cac:StandardItemIdentification/cbc:ID', namespaces=ns) or None
-            name = il.findtext('./cac:Item/cbc:Name', namespaces=ns) or ''
-
-            items.append({
-                'sifra': supplier_id.strip(),
-                'barcode': (gtin or '').strip() or None,
-                'naziv': name.strip(),
-                'kolicina': D(qty_txt, '0'),
-                'cena_fakturna': D(price_txt, '0'),
-                'rabat_pct': D(disc_pct_txt, '0'),
-                'serija': None,
-                'rok_dt': None,
-                'pdv_pct': float(D(pdv_txt, '10.0')),
-            })
-
-    return header, items
+    """(header, items) from Sopharma vendor XML or UBL eFaktura, streamed once (invoice_xml.py)"""
+    return parse_invoice(xml_path)
 
 def _build_napomena(header):
     # Empty napomena to avoid ERP filter exclusion (originally had "AUTO:" prefix)
@@ -517,7 +367,7 @@ def lookup_komintent(cur, dobavljac_name, schema_prefix=SCHEMA_PREFIX):
     print(f"Warning: No komintent found for '{dobavljac_name}', using fallback='1'")
     return '1'
 
-def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=True):
+def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=True, ids=None, resolver=None):
     """Resolve or create an artikal by barcode/name.
 
     Returns (sifra, naziv, ruc, action): action in
@@ -528,6 +378,9 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
       NOT_FOUND      – no match and auto_register disabled/failed
     
     ruc is the existing RUC% (marža) from last purchase, or None for new artikli.
+    ids: IdAllocator of the caller's transaction, used for new sifre (a new one is used if omitted).
+    resolver: loaded ArticleResolver; answers steps 1-4 in memory instead of per-item queries.
+              ruc is not looked up on that path (None): batch imports price from _last_kalk_prices.
     """
     barcode = (item.get('barcode') or '').strip()
     supplier_sifra = (item.get('sifra') or '').strip()
@@ -550,8 +403,21 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
     allow_auto_create = os.getenv('WPH_ALLOW_AUTO_CREATE', '0') == '1'
     auto_register = auto_register and allow_auto_create
 
+    # 1-4 in memory (same cascade as the queries below)
+    if resolver is not None:
+        hit = resolver.resolve(barcode, naziv, supplier_sifra)
+        if hit:
+            sifra, erp_naziv, action = hit
+            if action == 'BARCODE_ADDED' and not resolver.has_ean(sifra, barcode):
+                try:
+                    _execute_guarded(cur, f"INSERT INTO {schema_prefix}artikliean(sifra, ean) VALUES (%s, %s)", [sifra, barcode])
+                    resolver.add_ean(sifra, barcode)
+                except Exception as e:
+                    print(f"Warning: could not append alternative EAN for existing sifra={sifra}: {e}")
+            return (sifra, erp_naziv, None, action)
+
     # 1. Primary barcode match in artikli
-    if barcode:
+    if barcode and resolver is None:
         cur.execute(f"SELECT sifra, naziv, barkod FROM {schema_prefix}artikli WHERE barkod=%s LIMIT 1", [barcode])
         row = cur.fetchone()
         if row:
@@ -629,7 +495,7 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
             return (row[0], row[1], ruc, 'BARCODE_ADDED')
 
     # 1b. Fuzzy match even without barcode (previous code only tried when barcode existed)
-    if not barcode:
+    if not barcode and resolver is None:
         norm_name = ' '.join(naziv.upper().split())
         row = None
         try:
@@ -662,7 +528,7 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
             return (row[0], row[1], ruc, 'FOUND')
 
     # 4. Fallback by supplier sifra
-    if supplier_sifra:
+    if supplier_sifra and resolver is None:
         cur.execute(f"SELECT sifra, naziv FROM {schema_prefix}artikli WHERE sifra=%s LIMIT 1", [supplier_sifra])
         row = cur.fetchone()
         if row:
@@ -673,8 +539,7 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
     #    Kur lejohet auto-create, bej regjistrim me BARKOD si identifikues kryesor universal
     #    Gjenerojmë sifër të re unike për ERP, barkodi është lidhësi ndërmjet furnitorëve
     if auto_register and (barcode or naziv != 'UNKNOWN'):
-        cur.execute(f"SELECT COALESCE(MAX(sifra::bigint),2300000000)+1 FROM {schema_prefix}artikli WHERE sifra ~ '^\\d+$'")
-        new_sifra = str(cur.fetchone()[0])
+        new_sifra = (ids or IdAllocator(cur, schema_prefix)).next_sifra()
         
         # Inteligjent guessing për fusha bazuar në emër dhe të dhëna
         name_lower = naziv.lower() if naziv != 'UNKNOWN' else ''
@@ -764,17 +629,17 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
             except Exception as e2:
                 print(f"❌ Dështoi regjistrimi auto: {e2}")
                 return (None, None, None, 'NOT_FOUND')
+        if resolver is not None:
+            resolver.add_artikal(new_sifra, naziv, barcode or None)
         
         # Regjistro sifrën e furnitorit si EAN alternativë (jo si barkod kryesor)
         if supplier_sifra and supplier_sifra != barcode:
             try:
-                cur.execute(f"INSERT INTO {schema_prefix}artikliean(sifra, ean) VALUES (%s,%s)", [new_sifra, supplier_sifra])
+                _execute_guarded(cur, f"INSERT INTO {schema_prefix}artikliean(sifra, ean) VALUES (%s,%s)", [new_sifra, supplier_sifra])
+                if resolver is not None:
+                    resolver.add_ean(new_sifra, supplier_sifra)
                 print(f"✓ Regjistruar sifra furnitori {supplier_sifra} si EAN alternativë")
             except Exception:
-                try:
-                    cur.connection.rollback()
-                except Exception:
-                    pass
                 pass
         
         return (new_sifra, naziv, None, 'CREATED')
@@ -782,13 +647,19 @@ def lookup_or_create_artikal(cur, item, schema_prefix='public.', auto_register=T
     print(f"Warning: No artikal found for barcode='{barcode}' or sifra='{supplier_sifra}'")
     return (None, None, None, 'NOT_FOUND')
 
-def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='101', komintent='1', periodid=4, userid=14, dry_run=False, allow_remote_write=False, schema_override=None):
+def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='101', komintent='1', periodid=4, userid=14, dry_run=False, allow_remote_write=False, schema_override=None, resolver=None, commit=True):
     """
     Insert kalkulacija header and items.
     
     Args:
         schema_override: If provided, overrides SCHEMA_PREFIX (use 'public.' for dry-run, 'eb_fdw.' for production)
+        resolver: ArticleResolver shared by a batch of invoices (loaded on first use). Without one, artikli
+                  are resolved with the per-item queries, so a single-invoice import never loads the catalog.
+        commit: False = the caller owns the transaction (batched import, see import_pipeline.py); the invoice runs
+                in a SAVEPOINT that is released on success and rolled back on error. Ignored for dry_run.
     """
+    resolver_mark = resolver.mark() if resolver is not None else 0
+    batched = not commit and not dry_run
     # In dry-run mode we don't intend to persist anything; autocommit avoids transaction-aborted cascades on harmless failures
     try:
         if dry_run:
@@ -800,6 +671,8 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
     active_schema = schema_override if schema_override is not None else SCHEMA_PREFIX
     
     try:
+        if batched:
+            cur.execute("SAVEPOINT kalk_import")
         # Safety check: verify connection and schema
         cur.execute("SELECT current_database()")
         current_db = cur.fetchone()[0]
@@ -834,6 +707,9 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
         if (active_schema == 'eb_fdw.') and (not dry_run) and (not allow_remote_write):
             raise RuntimeError("FDW remote write blocked for safety. Set WPH_WRITE_REMOTE=1 to enable.")
         
+        # Block id allocation for this transaction (advisory-locked per table, see id_allocator.py)
+        ids = IdAllocator(cur, active_schema)
+        
         # Dynamic komintent lookup by supplier name
         resolved_komintent = lookup_komintent(cur, header.get('dobavljac', ''), active_schema)
         print(f"Komintent resolved: dobavljac='{header.get('dobavljac','')}' → sifra='{resolved_komintent}'")
@@ -851,9 +727,8 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                 kalk_id = None
                 lines = 0
             else:
-                # FDW remote write requires explicit id; fetch next from max+1
-                cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {active_schema}kalkopste")
-                next_kalkopste_id = cur.fetchone()[0]
+                # FDW remote write requires explicit id
+                next_kalkopste_id = ids.next_id('kalkopste')
                 cur.execute(
                     f"""
                     INSERT INTO {active_schema}kalkopste
@@ -891,9 +766,8 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                 if dry_run:
                     print(f"[DRY-RUN] Would INSERT kalkkasa into {active_schema}kalkkasa: iznos={float(iznos_for_payment):.2f}, datumuplate={valuta_datum}, dokbroj={broj_rendor}")
                 else:
-                    # FDW remote write requires explicit id; fetch next from max+1 (sequence might not be accessible)
-                    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {active_schema}kalkkasa")
-                    next_id = cur.fetchone()[0]
+                    # FDW remote write requires explicit id (sequence might not be accessible)
+                    next_id = ids.next_id('kalkkasa')
                     cur.execute(
                         f"""
                         INSERT INTO {active_schema}kalkkasa
@@ -923,26 +797,40 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                     print('kalkkasa present → updated if missing date/amount')
 
         # 3) Lines: insert only if none yet
+        #    Resolve every line first (artikal, price history, MP), then write all kalkstavke in one multi-row INSERT
         print(f'Items to insert: {len(items)} (existing_lines={lines})')
+        inserted = 0
         if lines == 0 and items:
             stats = {'FOUND': 0, 'CREATED': 0, 'BARCODE_ADDED': 0, 'SIFRA_FALLBACK': 0, 'SKIPPED': 0}
             preserve_flag = os.getenv('WPH_PRESERVE_EXISTING_MP', '0') == '1'
             preserve_source = os.getenv('WPH_MP_PRESERVE_SOURCE', 'LAST_KALK')  # LAST_KALK | ARTIKLI
-            audit_inited = False
+            audit_needed = False
+            audit_rows = []
             price_changes = []  # Track items where MP changed due to nabavna change
+            kalk_rows = []
+
+            # 3a) Artikal resolution (lookup or auto-create), in memory when a batch resolver is given
+            if resolver is not None:
+                resolver.ensure(cur, active_schema)
+            resolved = []
             for item in items:
-                # Lookup or auto-create artikal (returns: sifra, naziv, ruc_placeholder, action)
                 erp_sifra, erp_naziv, _, action = lookup_or_create_artikal(
-                    cur, item, active_schema, auto_register=(not dry_run)
+                    cur, item, active_schema, auto_register=(not dry_run), ids=ids, resolver=resolver
                 )
-
                 if not erp_sifra:
                     print(f"Warning: Artikal not found/created for item={item.get('naziv')}, barcode={item.get('barcode')}, skipping")
                     stats['SKIPPED'] += 1
                     continue
-
                 stats[action] += 1
+                resolved.append((item, erp_sifra, erp_naziv, action))
 
+            # 3b) Last RUC / MP / nabavna per existing artikal, one round trip for the whole invoice
+            existing_sifre = sorted({s for _, s, _, a in resolved if a in EXISTING_ARTIKAL_ACTIONS})
+            last_kalk = _last_kalk_prices(cur, existing_sifre, active_schema)
+            master_mp = _artikli_prices(cur, existing_sifre, active_schema) if preserve_flag and preserve_source == 'ARTIKLI' else {}
+
+            # 3c) Prices per line
+            for item, erp_sifra, erp_naziv, action in resolved:
                 item_pdv = item.get('pdv_pct', mp_cfg.pdv_pct)
                 mp_result = mp_kalk(
                     float(item['cena_fakturna']), float(item['rabat_pct']),
@@ -950,27 +838,17 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                           rounding=mp_cfg.rounding, round_threshold=mp_cfg.round_threshold, min_decimals=mp_cfg.min_decimals),
                 )
 
-                # For existing articles, try to fetch RUC, last MP, and last nabavna cena from last kalkulacija
+                # For existing articles, use RUC, last MP, and last nabavna cena from last kalkulacija
                 existing_ruc = None
                 last_mp = None
                 last_nabavna = None
-                if action in ['FOUND', 'BARCODE_ADDED', 'SIFRA_FALLBACK']:
-                    cur.execute(f"""
-                        SELECT rucstopa, cenasapdv, nabavnacena FROM {active_schema}kalkstavke
-                        WHERE artikal=%s AND rucstopa IS NOT NULL AND rucstopa > 0
-                        ORDER BY id DESC LIMIT 1
-                    """, [erp_sifra])
-                    ruc_row = cur.fetchone()
+                if action in EXISTING_ARTIKAL_ACTIONS:
+                    ruc_row = last_kalk.get(erp_sifra)
                     if ruc_row:
-                        existing_ruc = ruc_row[0]
-                        last_mp = ruc_row[1]
-                        last_nabavna = ruc_row[2]
-                    if preserve_flag and preserve_source == 'ARTIKLI':
+                        existing_ruc, last_mp, last_nabavna = ruc_row
+                    if master_mp.get(erp_sifra):
                         # Fallback to artikli.cena if user wants master price as source
-                        cur.execute(f"SELECT cena FROM {active_schema}artikli WHERE sifra=%s LIMIT 1", [erp_sifra])
-                        row_c = cur.fetchone()
-                        if row_c and row_c[0]:
-                            last_mp = row_c[0]
+                        last_mp = master_mp[erp_sifra]
 
                 # Decide MP and RUC to use
                 final_mp = mp_result['mp_rounded']
@@ -978,7 +856,7 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                 price_action = 'COMPUTED'  # default: new calculation
 
                 # SMART PRESERVATION: Only preserve MP if nabavnacena has NOT changed
-                if preserve_flag and action in ['FOUND', 'BARCODE_ADDED', 'SIFRA_FALLBACK'] and last_mp is not None:
+                if preserve_flag and action in EXISTING_ARTIKAL_ACTIONS and last_mp is not None:
                     # Check if nabavna cena changed (allow small tolerance for float comparison)
                     nabavna_tolerance = 0.01
                     nabavna_changed = (last_nabavna is None or 
@@ -1013,59 +891,13 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                             print(f"  ⚠️  {erp_sifra}: RUC recompute failed: {_e}; falling back to computed values")
                             price_action = 'FALLBACK'
 
-                    # Audit table init (ALWAYS in wph_ai localhost, NEVER on remote ebdata server)
-                    if not audit_inited and not dry_run:
-                        # Force audit connection to LOCAL wph_ai database
-                        audit_conn = psycopg2.connect(
-                            dbname='wph_ai',
-                            user='postgres',  # Local user
-                            password=os.getenv('WPH_LOCAL_PASS', ''),  # Local password
-                            host='127.0.0.1',  # ALWAYS localhost
-                            port=5432
-                        )
-                        audit_cur = audit_conn.cursor()
-                        audit_cur.execute("""
-                            CREATE TABLE IF NOT EXISTS public.wph_audit_price_lock (
-                                id bigserial PRIMARY KEY,
-                                ts timestamptz DEFAULT now(),
-                                kalkid bigint,
-                                artikal varchar(15),
-                                source varchar(20),
-                                computed_mp numeric(19,4),
-                                preserved_mp numeric(19,4),
-                                last_nabavna numeric(19,4),
-                                new_nabavna numeric(19,4),
-                                rabat_pct numeric(10,4),
-                                pdv_pct numeric(10,4),
-                                ruc_used numeric(10,4),
-                                action_tag varchar(30)
-                            )
-                        """)
-                        audit_conn.commit()
-                        audit_cur.close()
-                        audit_conn.close()
-                        audit_inited = True
-                    if not dry_run and price_action in ['PRESERVED', 'RECALC_NABAVNA_CHANGED']:
-                        # Write audit to LOCAL wph_ai (NEVER to remote ebdata server)
-                        audit_conn = psycopg2.connect(
-                            dbname='wph_ai',
-                            user='postgres',
-                            password=os.getenv('WPH_LOCAL_PASS', ''),
-                            host='127.0.0.1',  # ALWAYS localhost
-                            port=5432
-                        )
-                        audit_cur = audit_conn.cursor()
-                        audit_cur.execute("""
-                            INSERT INTO public.wph_audit_price_lock
-                            (kalkid, artikal, source, computed_mp, preserved_mp, last_nabavna, new_nabavna, rabat_pct, pdv_pct, ruc_used, action_tag)
-                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        """, [
-                            kalk_id, erp_sifra, preserve_source, mp_result['mp_rounded'], final_mp,
-                            last_nabavna, item['cena_fakturna'], item['rabat_pct'], item_pdv, ruc_to_use, price_action
-                        ])
-                        audit_conn.commit()
-                        audit_cur.close()
-                        audit_conn.close()
+                    if not dry_run:
+                        audit_needed = True
+                        if price_action in ['PRESERVED', 'RECALC_NABAVNA_CHANGED']:
+                            audit_rows.append((
+                                kalk_id, erp_sifra, preserve_source, mp_result['mp_rounded'], final_mp,
+                                last_nabavna, item['cena_fakturna'], item['rabat_pct'], item_pdv, ruc_to_use, price_action
+                            ))
 
                 if dry_run:
                     preserve_marker = ''
@@ -1075,25 +907,27 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                         preserve_marker = ' ⚠RECALC(nabavna↑)'
                     print(f"[DRY-RUN] Would INSERT line into {active_schema}kalkstavke: sifra={erp_sifra} ({action}), barcode={item.get('barcode')}, naziv={erp_naziv}, qty={item['kolicina']}, pdv={item_pdv}, mp={final_mp:.2f}, ruc={ruc_to_use:.2f}%{preserve_marker}")
                 else:
-                    # FDW remote write requires explicit id for kalkstavke too
-                    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {active_schema}kalkstavke")
-                    next_stavka_id = cur.fetchone()[0]
-                    cur.execute(
-                        f"""
-                        INSERT INTO {active_schema}kalkstavke
-                        (id, kalkid, artikal, jedmere, kolicina, nabavnacena, rabatstopa, trosak, rucstopa, cena, pdvstopa, cenasapdv, serija, roktrajanja)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """,
-                        [
-                            next_stavka_id, kalk_id, erp_sifra, 'KOM', item['kolicina'], item['cena_fakturna'],
-                            item['rabat_pct'], 0.0, ruc_to_use, 0.0, item_pdv,
-                            final_mp, item['serija'], item['rok_dt'],
-                        ],
-                    )
+                    kalk_rows.append([
+                        kalk_id, erp_sifra, 'KOM', item['kolicina'], item['cena_fakturna'],
+                        item['rabat_pct'], 0.0, ruc_to_use, 0.0, item_pdv,
+                        final_mp, item['serija'], item['rok_dt'],
+                    ])
+
+            # 3d) Price-lock audit (ALWAYS in wph_ai localhost, NEVER on remote ebdata server), one connection per invoice
+            if audit_needed:
+                _write_price_lock_audit(audit_rows)
+
+            # 3e) kalkstavke: explicit ids from one reserved block, one multi-row INSERT
+            if kalk_rows:
+                line_ids = ids.reserve('kalkstavke', len(kalk_rows))
+                inserted = _insert_rows(
+                    cur, f"{active_schema}kalkstavke", KALKSTAVKE_COLUMNS,
+                    [[line_id] + row for line_id, row in zip(line_ids, kalk_rows)],
+                )
 
             print(f"Artikal resolution stats: {stats}")
             if not dry_run:
-                print(f'Inserted {len(items)} lines')
+                print(f'Inserted {inserted} lines')
                 # Log price changes (NEVER creates nivelizacija in production ebdata)
                 if price_changes and preserve_flag:
                     print(f'\n📊 PRICE CHANGES DETECTED: {len(price_changes)} items')
@@ -1114,7 +948,7 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
                         print(f'\n⚠️  WPH_AUTO_NIVELIZACIJA=1 → Creating nivelizacija in {current_db}...')
                         niv_id = create_nivelizacija(
                             cur, price_changes, magacin=magacin, periodid=periodid, userid=userid,
-                            schema_prefix=active_schema, dry_run=False
+                            schema_prefix=active_schema, dry_run=False, ids=ids
                         )
                         if niv_id:
                             print(f'✓ Nivelizacija document created: nivid={niv_id}, price changes={len(price_changes)}')
@@ -1132,14 +966,27 @@ def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='1
 
         if dry_run:
             conn.rollback()
+            if resolver is not None:
+                resolver.rollback()
             print('\n[D R Y - R U N] No DB writes executed.')
+        elif batched:
+            cur.execute("RELEASE SAVEPOINT kalk_import")
+            print('\nStaged (commit with the batch).')
         else:
             conn.commit()
+            if resolver is not None:
+                resolver.commit()
             print('\nCommit OK.')
 
         return kalk_id
     except Exception as e:
-        conn.rollback()
+        if batched:
+            # Only this invoice is undone; a failing ROLLBACK TO propagates so the batch writer aborts the batch
+            cur.execute("ROLLBACK TO SAVEPOINT kalk_import")
+        else:
+            conn.rollback()
+        if resolver is not None:
+            resolver.rollback(resolver_mark)
         print(f'Error: {e}')
         import traceback
         traceback.print_exc()
@@ -0,0 +1,82 @@
+# file: backend/id_allocator.py - Block ID allocation for ERP tables
+"""
+ERP tables (kalkopste, kalkstavke, kalkkasa, nivopste, nivstavke, artikli.sifra)
+have no sequence we can reach through FDW, so ids were computed per row with
+SELECT MAX(id)+1. That costs a query per row, and two imports running at the
+same time get the same value.
+
+IdAllocator reserves ids in blocks instead:
+- Tables mapped in WPH_ID_SEQUENCES ("kalkstavke=public.kalkstavke_id_seq,...")
+  take a whole block from the sequence in one nextval() round trip.
+- Other tables are locked with pg_advisory_xact_lock on first use. MAX(id) is
+  read once, and every later id in the same transaction comes from memory.
+  The lock is held until commit/rollback, so a concurrent import of the same
+  table waits and then sees the committed rows.
+
+Use one allocator per transaction; it must not outlive the commit.
+"""
+import os
+
+LOCK_NAMESPACE = 'wph_ids:'
+ARTIKAL_SIFRA_FLOOR = 2300000000
+
+
+def _parse_sequences(raw):
+    out = {}
+    for part in (raw or '').split(','):
+        if '=' in part:
+            table, seq = part.split('=', 1)
+            if table.strip() and seq.strip():
+                out[table.strip()] = seq.strip()
+    return out
+
+
+ID_SEQUENCES = _parse_sequences(os.getenv('WPH_ID_SEQUENCES', ''))
+
+
+class IdAllocator:
+    def __init__(self, cur, schema_prefix='public.', sequences=None):
+        self.cur = cur
+        self.schema_prefix = schema_prefix
+        self.sequences = ID_SEQUENCES if sequences is None else sequences
+        self._next = {}       # (table, column) -> next free value
+        self._locked = set()
+
+    def _lock(self, table):
+        if table not in self._locked:
+            self.cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [LOCK_NAMESPACE + table])
+            self._locked.add(table)
+
+    def reserve(self, table, n=1):
+        """List of n new ids for <schema_prefix><table>.id"""
+        if n <= 0:
+            return []
+        seq = self.sequences.get(table)
+        if seq:
+            self.cur.execute("SELECT nextval(%s::regclass) FROM generate_series(1, %s)", [seq, n])
+            return [r[0] for r in self.cur.fetchall()]
+        key = (table, 'id')
+        if key not in self._next:
+            self._lock(table)
+            self.cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.schema_prefix}{table}")
+            self._next[key] = self.cur.fetchone()[0] + 1
+        start = self._next[key]
+        self._next[key] = start + n
+        return list(range(start, start + n))
+
+    def next_id(self, table):
+        return self.reserve(table, 1)[0]
+
+    def next_sifra(self, floor=ARTIKAL_SIFRA_FLOOR):
+        """Next numeric artikli.sifra as str (max numeric sifra + 1, never below floor + 1)"""
+        key = ('artikli', 'sifra')
+        if key not in self._next:
+            self._lock('artikli')
+            self.cur.execute(
+                f"SELECT COALESCE(MAX(sifra::bigint), %s) FROM {self.schema_prefix}artikli WHERE sifra ~ '^\\d+$'",
+                [floor],
+            )
+            self._next[key] = self.cur.fetchone()[0] + 1
+        value = self._next[key]
+        self._next[key] = value + 1
+        return str(value)
@@ -0,0 +1,284 @@
+# file: backend/lookup_snapshot.py - Persistent artikli lookup snapshot
+"""
+load_artikli_lookup (faktura_import) and load_lookup_from_db (faktura_ai_mvp)
+both joined artikli against a full wph_core.get_orders(28, 30, ...) call just
+to pick the best row when a sifra/barkod is duplicated, and
+/api/faktura/preview repeated that on every request.
+
+The lookup rows (sifra, barkod, naziv, current_stock, avg_daily_sales) are now
+materialized once into a binary file under WPH_LOOKUP_SNAPSHOT_DIR. The file
+name is derived from a DB change token: the artikli insert/update/delete
+counters from pg_stat_all_tables, plus current_date because the stock/sales
+tie-breakers move daily. Foreign tables have no counters; for them the token
+is count(*) plus a sum of hashtext(sifra|barkod|naziv), so an UPDATE of a
+barkod or naziv is seen on the next probe. Every process (Flask workers,
+faktura_ai_mvp.main, CLI importers) probes the token, then either mmaps the
+existing file or rebuilds it. The token is probed at most
+every WPH_LOOKUP_TOKEN_TTL seconds per process. The decoded lookup is shared
+in-process and must be treated as read-only.
+
+File layout (native byte order, recorded in the header):
+  MAGIC | u32 header_len | JSON header | pad to 8
+  f64 stock[n] | f64 sales[n] | u32 offsets[3n+1] | u8 nulls[n] | utf-8 blob
+offsets index the blob per (sifra, barkod, naziv) field; nulls has bit 0/1/2
+set for NULL sifra/barkod/naziv.
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import glob
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from array import array
+
+SNAPSHOT_DIR = os.getenv('WPH_LOOKUP_SNAPSHOT_DIR') or os.path.join(tempfile.gettempdir(), 'wph_lookup_snapshot')
+TOKEN_TTL = float(os.getenv('WPH_LOOKUP_TOKEN_TTL', '30'))
+MAGIC = b'WPHLKP01'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def lookup_sql(schema_prefix='ref.'):
+    """Best row per COALESCE(sifra, barkod): highest current stock, then avg daily sales"""
+    return f"""
+        WITH artikli_with_metrics AS (
+            SELECT DISTINCT ON (COALESCE(ra.sifra, ra.barkod))
+                ra.sifra, ra.barkod, ra.naziv,
+                COALESCE(wo.current_stock, 0) as current_stock,
+                COALESCE(wo.avg_daily_sales, 0) as avg_daily_sales
+            FROM {schema_prefix}artikli ra
+            LEFT JOIN wph_core.get_orders(28, 30, false, NULL, NULL) wo ON wo.sifra = ra.sifra
+            WHERE ra.sifra IS NOT NULL OR ra.barkod IS NOT NULL
+            ORDER BY COALESCE(ra.sifra, ra.barkod),
+                     COALESCE(wo.current_stock, 0) DESC,
+                     COALESCE(wo.avg_daily_sales, 0) DESC
+        )
+        SELECT COALESCE(NULLIF(TRIM(sifra),''),NULL) AS sifra,
+        COALESCE(NULLIF(TRIM(barkod),''),NULL) AS barkod,
+        COALESCE(NULLIF(TRIM(naziv),''),NULL) AS naziv,
+        current_stock, avg_daily_sales
+        FROM artikli_with_metrics
+    """
+
+
+def metric(value):
+    """Stock/sales value as float; anything that is not a plain number counts as 0 (loader semantics)"""
+    if value and value not in ('NULL', '') and str(value).replace('.', '').replace('-', '').isdigit():
+        return float(value)
+    return 0
+
+
+def change_token(cur, schema_prefix='ref.'):
+    table = f"{schema_prefix}artikli"
+    cur.execute("""
+        SELECT current_date, s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+        FROM (SELECT 1) one
+        LEFT JOIN pg_stat_all_tables s ON s.relid = to_regclass(%s)
+    """, [table])
+    day, ins, upd, dele = cur.fetchone()
+    if ins is None:
+        # Foreign tables have no local DML counters: count plus a content checksum of the
+        # looked-up columns (immutable built-ins only, so postgres_fdw can push it to the remote)
+        cur.execute(f"""
+            SELECT count(*),
+                   COALESCE(sum(hashtext(COALESCE(sifra, '') || '|' || COALESCE(barkod, '') || '|'
+                                         || COALESCE(naziv, ''))::bigint), 0)
+            FROM {table}
+        """)
+        count, checksum = cur.fetchone()
+        counters = f"n{count}h{checksum}"
+    else:
+        counters = f"{ins}/{upd}/{dele}"
+    return f"{table}@{day.isoformat()}:{counters}"
+
+
+def write_snapshot(path, rows, token, schema_prefix):
+    """Write rows [(sifra, barkod, naziv, stock, sales)] to path atomically (temp file + os.replace)"""
+    stock, sales, offsets, nulls, blob = array('d'), array('d'), array('I', [0]), bytearray(), bytearray()
+    for sifra, barkod, naziv, row_stock, row_sales in rows:
+        mask = 0
+        for bit, value in enumerate((sifra, barkod, naziv)):
+            if value is None:
+                mask |= 1 << bit
+            else:
+                blob += value.encode('utf-8')
+            offsets.append(len(blob))
+        nulls.append(mask)
+        stock.append(metric(row_stock))
+        sales.append(metric(row_sales))
+
+    header = json.dumps({
+        'token': token, 'schema': schema_prefix, 'rows': len(nulls),
+        'byteorder': sys.byteorder, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }).encode('utf-8')
+    lead = len(MAGIC) + 4 + len(header)
+    pad = b'\0' * (-lead % 8)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(pad)
+            for part in (stock, sales, offsets):
+                part.tofile(f)
+            f.write(nulls)
+            f.write(blob)
+        os.replace(tmp, path)
+    except OSError:
+        # Another process already published this version (Windows cannot replace a mapped file)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if not os.path.exists(path):
+            raise
+
+
+class LookupSnapshot:
+    """Read-only, memory-mapped view of a snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"Not a lookup snapshot: {path}")
+            (header_len,) = struct.unpack_from('<I', self._mm, len(MAGIC))
+            start = len(MAGIC) + 4
+            self.meta = json.loads(self._mm[start:start + header_len].decode('utf-8'))
+            if self.meta['byteorder'] != sys.byteorder:
+                raise ValueError(f"Snapshot byte order {self.meta['byteorder']} != {sys.byteorder}")
+            n = self.meta['rows']
+            pos = start + header_len
+            pos += -pos % 8
+            view = memoryview(self._mm)
+            self.stock = view[pos:pos + 8 * n].cast('d'); pos += 8 * n
+            self.sales = view[pos:pos + 8 * n].cast('d'); pos += 8 * n
+            self.offsets = view[pos:pos + 4 * (3 * n + 1)].cast('I'); pos += 4 * (3 * n + 1)
+            self.nulls = view[pos:pos + n]; pos += n
+            self.blob = view[pos:]
+            self._views = [view, self.stock, self.sales, self.offsets, self.nulls, self.blob]
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def token(self):
+        return self.meta['token']
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _field(self, k, mask, bit):
+        if mask & (1 << bit):
+            return None
+        return bytes(self.blob[self.offsets[k]:self.offsets[k + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        """(sifra, barkod, naziv, stock, sales) per row"""
+        for i in range(len(self)):
+            mask = self.nulls[i]
+            k = 3 * i
+            yield (self._field(k, mask, 0), self._field(k + 1, mask, 1), self._field(k + 2, mask, 2),
+                   self.stock[i], self.sales[i])
+
+    def to_lookup(self):
+        """sifra_set, barcode_set, name_list, artikli_map (sifra -> record), as the DB loaders return them"""
+        sifra_set, barcode_set, name_list, artikli_map = set(), set(), [], {}
+        for s, b, n, stock, sales in self:
+            if s:
+                sifra_set.add(s)
+                artikli_map[s] = {'sifra': s, 'barkod': b, 'naziv': n,
+                                  'current_stock': stock, 'avg_daily_sales': sales}
+            if b:
+                barcode_set.add(b)
+            if n:
+                name_list.append(n)
+        return sifra_set, barcode_set, name_list, artikli_map
+
+    def close(self):
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+def _source_key(conn, schema_prefix):
+    info = conn.info
+    return f"{info.host}:{info.port}/{info.dbname}/{schema_prefix}"
+
+
+def snapshot_path(source_key, token, snapshot_dir=None):
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', source_key).strip('_')
+    digest = hashlib.sha1(f"{source_key}|{token}".encode('utf-8')).hexdigest()[:16]
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"artikli_{slug}_{digest}.snap")
+
+
+def _remove_stale(path):
+    prefix = path[:path.rindex('_') + 1]
+    for old in glob.glob(glob.escape(prefix) + '*.snap'):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass  # still mapped by another process; removed on a later rebuild
+
+
+def load_lookup(conn, schema_prefix='ref.', fetch_rows=None, snapshot_dir=None):
+    """(sifra_set, barcode_set, name_list, artikli_map) from the snapshot for conn's database.
+
+    fetch_rows: callable returning [(sifra, barkod, naziv, stock, sales)] to build from;
+    defaults to lookup_sql() on conn. Only called when the change token moved.
+    """
+    key = _source_key(conn, schema_prefix)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and time.monotonic() - entry['checked'] < TOKEN_TTL:
+            return entry['lookup']
+
+        cur = conn.cursor()
+        try:
+            token = change_token(cur, schema_prefix)
+            if entry and entry['token'] == token:
+                entry['checked'] = time.monotonic()
+                return entry['lookup']
+
+            start = time.monotonic()
+            path = snapshot_path(key, token, snapshot_dir)
+            action = 'opened'
+            try:
+                snap = LookupSnapshot(path)
+                if snap.token != token:
+                    snap.close()
+                    raise ValueError('token mismatch')
+            except (OSError, ValueError, KeyError):
+                if fetch_rows is None:
+                    cur.execute(lookup_sql(schema_prefix))
+                    rows = cur.fetchall()
+                else:
+                    rows = fetch_rows()
+                write_snapshot(path, rows, token, schema_prefix)
+                _remove_stale(path)
+                snap = LookupSnapshot(path)
+                action = 'rebuilt'
+        finally:
+            cur.close()
+
+        try:
+            lookup = snap.to_lookup()
+        finally:
+            snap.close()
+        print(f"Lookup snapshot {action}: {len(lookup[3])} artikli ({token}) in "
+              f"{(time.monotonic() - start) * 1000.0:.1f} ms")
+        _cache[key] = {'token': token, 'checked': time.monotonic(), 'lookup': lookup}
+        return lookup
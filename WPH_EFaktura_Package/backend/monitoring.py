@@ -19,7 +19,7 @@ except ImportError:
 
 # Import db connection
 try:
-    from db import get_conn
+    from db import pooled_conn
     DB_AVAILABLE = True
 except ImportError:
     DB_AVAILABLE = False
@@ -41,25 +41,20 @@ class SystemMonitor:
             return {"status": "unavailable", "error": "db module not imported"}
         
         try:
-            conn = get_conn()
-            cursor = conn.cursor()
+            with pooled_conn() as conn, conn.cursor() as cursor:
+                # Test query
+                cursor.execute("SELECT version();")
+                version = cursor.fetchone()[0]
             
-            # Test query
-            cursor.execute("SELECT version();")
-            version = cursor.fetchone()[0]
+                # Get database size
+                db_name = os.getenv("WPH_DB_NAME", "wph_ai")
+                cursor.execute(f"SELECT pg_database_size('{db_name}');")
+                size_bytes = cursor.fetchone()[0]
+                size_mb = round(size_bytes / (1024 * 1024), 2)
             
-            # Get database size
-            db_name = os.getenv("WPH_DB_NAME", "wph_ai")
-            cursor.execute(f"SELECT pg_database_size('{db_name}');")
-            size_bytes = cursor.fetchone()[0]
-            size_mb = round(size_bytes / (1024 * 1024), 2)
-            
-            # Check connection count
-            cursor.execute("SELECT count(*) FROM pg_stat_activity;")
-            connections = cursor.fetchone()[0]
-            
-            cursor.close()
-            conn.close()
+                # Check connection count
+                cursor.execute("SELECT count(*) FROM pg_stat_activity;")
+                connections = cursor.fetchone()[0]
             
             return {
                 "status": "healthy",
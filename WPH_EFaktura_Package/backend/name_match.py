@@ -0,0 +1,141 @@
+# file: backend/name_match.py - Semantic artikal name matching
+"""
+semantic_name_match compared an invoice name against every inventory name,
+normalizing each one with extract_core_name on every call. NameMatchIndex
+normalizes the catalog once and keeps:
+
+  core -> first name        exact match after normalization
+  token -> [core ids]       inverted index for the word-Jaccard match
+
+A fuzzy match needs Jaccard(words) >= threshold. That means the candidate has
+between t*|q| and |q|/t words and shares at least ceil(t*|q|) of the query's
+words. So any candidate contains at least one of the query's
+|q| - ceil(t*|q|) + 1 rarest words. Only those posting lists are read. The
+surviving candidates are scored exactly as before, and ties go to the
+earliest name, so results match the linear scan.
+"""
+import math
+import re
+
+EPS = 1e-9
+
+
+def extract_core_name(name):
+    # Normalize common abbreviations
+    name = name.replace('UL CLEAN', 'ULTRA CLEAN')
+    name = name.replace('UL ', 'ULTRA ')
+    name = name.replace(' PAS ', ' PASTE ')
+    name = name.replace(' TBL ', ' TABLET ')
+    name = name.replace(' CPS ', ' CAPSULES ')
+
+    # For semantic matching, we want to keep the dosage as part of the identity
+    # Only remove packaging quantities (30x, 20x) but keep the actual dosage
+    name = re.sub(r'\d+x\s*$', '', name)  # Remove trailing quantities like "30x"
+
+    # Clean up extra spaces
+    name = ' '.join(name.split())
+    return name.lower().strip()
+
+
+def _rank(art):
+    return (art.get('current_stock', 0.0), art.get('avg_daily_sales', 0.0))
+
+
+class NameMatchIndex:
+    def __init__(self, names):
+        self.exact = {}       # core -> first inventory name with that core
+        self.cores = []       # [(inventory name, word set)] per distinct core, in first-seen order
+        self.postings = {}    # word -> [core id]
+        for name in names:
+            if not name:
+                continue
+            core = extract_core_name(name)
+            if not core or core in self.exact:
+                continue
+            self.exact[core] = name
+            words = frozenset(core.split())
+            if len(words) < 2:
+                continue  # never a fuzzy candidate
+            cid = len(self.cores)
+            self.cores.append((name, words))
+            for word in words:
+                self.postings.setdefault(word, []).append(cid)
+
+    @classmethod
+    def from_artikli(cls, artikli_map):
+        """Index over artikli_map names, with the best record (stock, sales) per name"""
+        index = cls(art.get('naziv') for art in artikli_map.values())
+        index.best = {}
+        for art in artikli_map.values():
+            name = art.get('naziv')
+            if not name:
+                continue
+            best = index.best.get(name)
+            if best is None or _rank(art) > _rank(best):
+                index.best[name] = art
+        return index
+
+    def match(self, invoice_name, threshold=0.8):
+        """Best matching inventory name or None (same result as the linear semantic_name_match)"""
+        if not invoice_name:
+            return None
+        invoice_core = extract_core_name(invoice_name)
+        if not invoice_core:
+            return None
+        exact = self.exact.get(invoice_core)
+        if exact is not None:
+            return exact
+
+        words = set(invoice_core.split())
+        n = len(words)
+        if n < 2:
+            return None
+        if threshold <= 0:
+            return self._scan(words, threshold, range(len(self.cores)))
+
+        min_overlap = max(1, math.ceil(threshold * n - EPS))
+        probe = sorted(words, key=lambda w: len(self.postings.get(w, ())))[:n - min_overlap + 1]
+        candidates = set()
+        for word in probe:
+            candidates.update(self.postings.get(word, ()))
+        lo, hi = threshold * n - EPS, n / threshold + EPS
+        candidates = [cid for cid in candidates if lo <= len(self.cores[cid][1]) <= hi]
+        return self._scan(words, threshold, sorted(candidates))
+
+    def _scan(self, words, threshold, cids):
+        best_match = None
+        best_score = 0
+        for cid in cids:
+            name, inv_words = self.cores[cid]
+            score = len(words & inv_words) / len(words | inv_words)
+            # Only match if score is very high (near identical); ties keep the earliest name
+            if score > best_score and score >= threshold:
+                best_score = score
+                best_match = name
+        return best_match if best_score >= threshold else None
+
+    def best_artikli(self, name, threshold=0.8):
+        """Best artikli record for the matched name (index built with from_artikli)"""
+        matched_name = self.match(name, threshold)
+        return self.best.get(matched_name) if matched_name else None
+
+
+_artikli_index = (None, None)
+
+
+def index_for_artikli(artikli_map):
+    """NameMatchIndex for artikli_map, reused while the same (unchanged) map is passed in"""
+    global _artikli_index
+    cached_map, index = _artikli_index
+    if cached_map is not artikli_map or index.size != len(artikli_map):
+        index = NameMatchIndex.from_artikli(artikli_map)
+        index.size = len(artikli_map)
+        _artikli_index = (artikli_map, index)
+    return index
+
+
+def semantic_name_match(invoice_name, inventory_names, threshold=0.8):
+    """Semantic matching for products that are essentially the same but with different wording.
+    This should NOT match different dosages or strengths of the same medication.
+    Build a NameMatchIndex once when matching many names against the same inventory."""
+    return NameMatchIndex(inventory_names).match(invoice_name, threshold)
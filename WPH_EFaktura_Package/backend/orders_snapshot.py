@@ -0,0 +1,232 @@
+"""
+WPH Pharmacy SMART - In-memory Orders Snapshot
+Columnar (NumPy) copy of ops.orders_30d_snapshot for /api/orders/v2.
+
+The snapshot is loaded once and kept pre-sorted in the keyset order used by
+the SQL path, so filtering, pagination and projection are array operations:
+the supplier filter is an isin over integer codes, and q is one np.char.find
+over a fixed-width string array (still a scan of every row, but in C). Output
+columns stay object arrays, since they are only indexed, never computed on.
+A background thread LISTENs on WPH_ORDERS_INMEMORY_CHANNEL and reloads after
+a refresh (see patches/orders_snapshot_notify.sql). Every RECHECK seconds it
+also compares the snapshot version, in case a NOTIFY was missed. The new copy
+is built off to the side and swapped in with a single reference assignment,
+so readers never see a half-loaded snapshot.
+
+Text keys (flow_status, sifra) compare by Python code point, which is the
+byte order of the "C" collation; the SQL keyset path compares them with
+COLLATE "C" too, so a cursor from either path is valid on the other.
+"""
+import re
+import time
+import select
+import logging
+import threading
+from bisect import bisect_left
+from decimal import Decimal
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from db import fetch_iter, get_conn
+
+log = logging.getLogger(__name__)
+
+
+def _sort_key(alarm, flow, qty, sifra):
+    # Mirrors the SQL keyset order (alarm, flow, qty, sifra, each DESC): a NULL sorts above
+    # every value, so it is first in DESC order, as Postgres puts it
+    return ((alarm is None, bool(alarm)), (flow is None, flow or ""),
+            (qty is None, qty if qty is not None else Decimal(0)), (sifra is None, sifra or ""))
+
+
+class _Columns:
+    """One immutable load of the snapshot; rows are stored in DESC keyset order"""
+
+    def __init__(self, columns, rows, version):
+        keyed = sorted(((_sort_key(r["_k_alarm"], r["_k_flow"], r["_k_qty"], r["_k_sifra"]), r) for r in rows),
+                       key=lambda kr: kr[0], reverse=True)
+        self.n = len(keyed)
+        self.keys_asc = [k for k, _ in reversed(keyed)]
+        self.raw_keys = [(r["_k_alarm"], r["_k_flow"], r["_k_qty"], r["_k_sifra"]) for _, r in keyed]
+        self.columns = {}
+        for col in columns:
+            arr = np.empty(self.n, dtype=object)
+            arr[:] = [r.get(col) for _, r in keyed]
+            self.columns[col] = arr
+        flow = [r.get("_k_flow") for _, r in keyed]
+        self.nonzero = np.fromiter((f is not None and f != "0_FLOW" for f in flow), dtype=bool, count=self.n)
+        # Supplier as integer codes into supplier_names, so the filter is an isin over ints
+        self.supplier_names, self.supplier_code = np.unique(
+            np.array([(r.get("supplier_name") or "").upper() for _, r in keyed], dtype=str), return_inverse=True)
+        # Fixed-width unicode array: the q filter is one np.char.find over it, no per-row Python
+        self.haystack = np.array([
+            "\x1f".join(str(r.get(c) or "") for c in ("emri", "sifra", "barkod")).lower()
+            for _, r in keyed
+        ], dtype=str)
+        self.version = version
+        self.loaded_at = time.time()
+        # Cache/ETag token of this load; falls back to the load time when the version probe failed
+        self.token = version or f"mem-{self.loaded_at:.6f}"
+
+    def start_after(self, key):
+        """Position of the first row sorting strictly after key (DESC order)"""
+        return self.n - bisect_left(self.keys_asc, key)
+
+
+class OrdersSnapshotStore:
+    """Process-wide in-memory orders snapshot with NOTIFY-driven reload.
+
+    select_sql must return the output columns plus the raw sort key as
+    _k_alarm, _k_flow, _k_qty, _k_sifra (same aliases as the SQL keyset path).
+    """
+
+    def __init__(self, select_sql, columns, channel="wph_orders_snapshot",
+                 recheck=60.0, debounce=0.5, version_fn=None):
+        if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", channel):
+            raise ValueError(f"Invalid LISTEN channel: {channel!r}")
+        self.select_sql = select_sql
+        self.columns = list(columns)
+        self.channel = channel
+        self.recheck = recheck
+        self.debounce = debounce
+        self.version_fn = version_fn
+        self._snap = None
+        self._load_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"loads": 0, "load_errors": 0, "notifies": 0, "queries": 0,
+                       "last_load_ms": None, "last_error": None}
+
+    @property
+    def ready(self):
+        return self._snap is not None
+
+    def current(self):
+        """The loaded copy (None before the first load); pass it to query() to pin one version"""
+        return self._snap
+
+    def reload(self):
+        """Load a fresh copy and swap it in; returns the row count"""
+        with self._load_lock:
+            start = time.monotonic()
+            version = self.version_fn() if self.version_fn else None
+            try:
+                rows = [row for batch in fetch_iter(self.select_sql) for row in batch]
+                snap = _Columns(self.columns, rows, version)
+            except Exception as e:
+                self._stats["load_errors"] += 1
+                self._stats["last_error"] = str(e)
+                raise
+            self._snap = snap
+            self._stats["loads"] += 1
+            self._stats["last_load_ms"] = round((time.monotonic() - start) * 1000.0, 1)
+            log.info("Orders snapshot loaded: %s rows in %s ms", snap.n, self._stats["last_load_ms"])
+            return snap.n
+
+    def start(self):
+        """Start the LISTEN thread (it performs the initial load)"""
+        if not NUMPY_AVAILABLE:
+            log.warning("numpy not installed - in-memory orders snapshot disabled")
+            return False
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return True
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._listen_loop, name="orders-snapshot-listener", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen_loop(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = get_conn()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                # (Re)load after (re)connecting so refreshes missed while disconnected are picked up
+                self.reload()
+                backoff = 1.0
+                last_check = time.monotonic()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) != ([], [], []):
+                        conn.poll()
+                        if conn.notifies:
+                            # Coalesce bursts (one NOTIFY per statement of a multi-step refresh)
+                            time.sleep(self.debounce)
+                            conn.poll()
+                            self._stats["notifies"] += len(conn.notifies)
+                            conn.notifies.clear()
+                            self.reload()
+                            last_check = time.monotonic()
+                    if self.version_fn and time.monotonic() - last_check >= self.recheck:
+                        last_check = time.monotonic()
+                        if self.version_fn() != self._snap.version:
+                            self.reload()
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                log.warning("Orders snapshot listener error (retry in %ss): %s", backoff, e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def query(self, fields, include_zero=False, suppliers=None, q=None, limit=None, cursor=None, snap=None):
+        """Filter/paginate/project the in-memory copy (snap: a copy from current(), default the latest).
+
+        Returns (rows, total, last_key); last_key is the raw (alarm, flow, qty, sifra) of
+        the last returned row when a full page was returned (for the next cursor), else None.
+        """
+        snap = snap or self._snap
+        self._stats["queries"] += 1
+        mask = np.ones(snap.n, dtype=bool) if include_zero else snap.nonzero.copy()
+        if suppliers:
+            wanted = np.flatnonzero(np.isin(snap.supplier_names, list(suppliers)))
+            mask &= np.isin(snap.supplier_code, wanted)
+        if q:
+            needle = q.lower()
+            mask &= np.char.find(snap.haystack, needle) >= 0
+        idx = np.flatnonzero(mask)
+
+        total = len(idx)
+        if cursor is not None:
+            total = cursor["t"]
+            qty = None if cursor["q"] is None else Decimal(cursor["q"])
+            start = snap.start_after(_sort_key(cursor["a"], cursor["f"], qty, cursor["s"]))
+            idx = idx[np.searchsorted(idx, start):]
+        if limit is not None:
+            idx = idx[:limit]
+
+        cols = [snap.columns[f][idx] for f in fields]
+        rows = [dict(zip(fields, vals)) for vals in zip(*cols)] if fields else []
+        last_key = None
+        if limit is not None and len(idx) == limit:
+            last_key = snap.raw_keys[idx[-1]]
+        return rows, total, last_key
+
+    def stats(self):
+        snap = self._snap
+        s = dict(self._stats)
+        s.update({
+            "enabled": True,
+            "ready": snap is not None,
+            "rows": snap.n if snap else 0,
+            "version": snap.version if snap else None,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(snap.loaded_at)) if snap else None,
+            "channel": self.channel,
+            "listening": bool(self._thread and self._thread.is_alive()),
+        })
+        return s
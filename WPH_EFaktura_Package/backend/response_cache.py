@@ -0,0 +1,121 @@
+"""
+WPH Pharmacy SMART - Response Cache
+Bounded in-memory LRU cache with TTL expiry and single-flight loading,
+used for the /api/orders responses.
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+    """LRU + TTL cache bounded by entry count and total bytes.
+
+    Concurrent misses for the same key are collapsed: one caller runs the
+    loader, the others wait for its result instead of hitting the DB too.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 64, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, nbytes, value)
+        self._bytes = 0
+        self._inflight = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                       "coalesced": 0, "oversize": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def _pop(self, key):
+        _, nbytes, _ = self._data.pop(key)
+        self._bytes -= nbytes
+
+    def _lookup(self, key) -> Tuple[bool, Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            self._pop(key)
+            self._stats["expirations"] += 1
+            return False, None
+        self._data.move_to_end(key)
+        return True, entry[2]
+
+    def _store(self, key, value, nbytes: int):
+        if nbytes > self.max_bytes:
+            self._stats["oversize"] += 1
+            return
+        if key in self._data:
+            self._pop(key)
+        self._data[key] = (time.monotonic() + self.ttl, nbytes, value)
+        self._bytes += nbytes
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._pop(oldest)
+            self._stats["evictions"] += 1
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            found, value = self._lookup(key)
+            self._stats["hits" if found else "misses"] += 1
+            return value
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Tuple[Any, Optional[int]]]) -> Tuple[Any, bool]:
+        """Return (value, from_cache).
+
+        loader() must return (value, nbytes); nbytes=None means "do not cache"
+        (e.g. error responses). Waiters on a failed/uncached load retry themselves.
+        """
+        waited = False
+        while True:
+            with self._lock:
+                found, value = self._lookup(key)
+                if found:
+                    self._stats["hits"] += 1
+                    if waited:
+                        self._stats["coalesced"] += 1
+                    return value, True
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    self._stats["misses"] += 1
+                    break
+            waited = True
+            event.wait()
+
+        try:
+            value, nbytes = loader()
+            if nbytes is not None:
+                with self._lock:
+                    self._store(key, value, nbytes)
+            return value, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def clear(self) -> int:
+        with self._lock:
+            n = len(self._data)
+            self._data.clear()
+            self._bytes = 0
+            return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            lookups = s["hits"] + s["misses"]
+            s.update({
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_sec": self.ttl,
+                "inflight": len(self._inflight),
+                "hit_rate_pct": round(s["hits"] / lookups * 100, 1) if lookups else 0.0,
+            })
+            return s
@@ -0,0 +1,167 @@
+# file: backend/staging_index.py - Parsed-summary index for the staging folder
+"""
+/api/faktura/pending and /api/efaktura/invoices parsed every XML in
+staging/faktura_uploads on every request, only to show supplier, number,
+date, total and line count.
+
+StagingIndex keeps those summaries in a SQLite sidecar inside the folder
+(.staging_index.sqlite), one row per file:
+
+  filename, size, mtime_ns, sha1, version, summary (JSON) or parse error
+
+A listing stats the folder and reuses every row whose size and mtime still
+match. For a changed or new file the content hash is checked first, so a
+copied or re-fetched file with identical bytes reuses the stored summary.
+Only new content is parsed. Rows of files that left the folder (archived
+after import) are dropped on the next listing, or right away via forget().
+Bump the caller's version when the summary layout changes.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+INDEX_NAME = '.staging_index.sqlite'
+HASH_CHUNK = 1 << 20
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StagingIndex:
+    def __init__(self, staging_dir, summarize, version=1, suffix='.xml'):
+        """summarize(path) -> JSON-serializable summary; an exception is stored as the file's error"""
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.db_path = os.path.join(self.staging_dir, INDEX_NAME)
+        self.summarize = summarize
+        self.version = version
+        self.suffix = suffix.lower()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            # Unreadable sidecar: it only holds derived data, rebuild it
+            os.remove(self.db_path)
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                filename TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha1 TEXT,
+                version INTEGER, summary TEXT, error TEXT, indexed_at REAL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1)")
+        return db
+
+    def _summarize(self, path):
+        try:
+            return json.dumps(self.summarize(path)), None
+        except Exception as e:
+            return None, str(e)
+
+    def _store(self, db, name, st, sha1, summary, error):
+        db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   [name, st.st_size, st.st_mtime_ns, sha1, self.version, summary, error, time.time()])
+
+    def _entry(self, name, st, summary, error):
+        return {
+            'filename': name,
+            'path': os.path.join(self.staging_dir, name),
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'summary': json.loads(summary) if summary is not None else None,
+            'error': error,
+        }
+
+    def scan(self):
+        """One entry {filename, path, size, mtime, summary, error} per staged file (os.listdir order);
+        parses only files whose content is not indexed yet"""
+        start = time.monotonic()
+        parsed = rehashed = 0
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    known = {row[0]: row[1:] for row in db.execute(
+                        "SELECT filename, size, mtime_ns, summary, error FROM files WHERE version = ?",
+                        [self.version])}
+                    entries, seen = [], set()
+                    for name in os.listdir(self.staging_dir):
+                        if not name.lower().endswith(self.suffix):
+                            continue
+                        path = os.path.join(self.staging_dir, name)
+                        try:
+                            st = os.stat(path)
+                        except FileNotFoundError:
+                            continue  # archived while listing
+                        seen.add(name)
+                        row = known.get(name)
+                        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                            summary, error = row[2], row[3]
+                        else:
+                            sha1 = file_sha1(path)
+                            hit = db.execute(
+                                "SELECT summary, error FROM files WHERE sha1 = ? AND version = ? LIMIT 1",
+                                [sha1, self.version]).fetchone()
+                            if hit:
+                                summary, error = hit
+                                rehashed += 1
+                            else:
+                                summary, error = self._summarize(path)
+                                parsed += 1
+                            self._store(db, name, st, sha1, summary, error)
+                        entries.append(self._entry(name, st, summary, error))
+                    stale = [(name,) for (name,) in db.execute("SELECT filename FROM files") if name not in seen]
+                    db.executemany("DELETE FROM files WHERE filename = ?", stale)
+            finally:
+                db.close()
+        if parsed or rehashed or stale:
+            print(f"Staging index {self.staging_dir}: {len(entries)} files, {parsed} parsed, "
+                  f"{rehashed} matched by hash, {len(stale)} removed in {(time.monotonic() - start) * 1000.0:.1f} ms")
+        return entries
+
+    def put(self, path, summary):
+        """Record the summary of a file that was just written and parsed (e.g. an upload)"""
+        st = os.stat(path)
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    self._store(db, os.path.basename(path), st, file_sha1(path), json.dumps(summary), None)
+            finally:
+                db.close()
+
+    def forget(self, path):
+        """Drop the row of a file moved out of the folder (archived after import)"""
+        if not os.path.exists(self.db_path):
+            return
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    db.execute("DELETE FROM files WHERE filename = ?", [os.path.basename(path)])
+            finally:
+                db.close()
+
+
+def index_for(staging_dir, summarize, version=1):
+    """Shared StagingIndex per (folder, version)"""
+    key = (os.path.abspath(staging_dir), version)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = StagingIndex(staging_dir, summarize, version)
+        return index
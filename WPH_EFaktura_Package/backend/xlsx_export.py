@@ -0,0 +1,256 @@
+"""
+WPH Pharmacy SMART - XLSX Export Engine
+Streaming workbook writer on openpyxl write-only mode.
+
+Rows are written once and never kept as cell objects, so memory stays flat
+no matter how many rows a sheet has. Column widths are estimated from the
+first SAMPLE_ROWS data rows, and number formats come from preset named
+styles instead of per-cell styling. Output goes to a path or to a spooled
+temp file (RAM up to WPH_XLSX_SPOOL_MB, then disk).
+"""
+import os
+import re
+import tempfile
+import warnings
+import itertools
+from collections import namedtuple
+from copy import copy
+from decimal import Decimal
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.filters import AutoFilter
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+SAMPLE_ROWS = 200
+MIN_WIDTH = 8
+MAX_WIDTH = 50
+SPOOL_MAX_BYTES = int(float(os.getenv("WPH_XLSX_SPOOL_MB", "16")) * 1024 * 1024)
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Column format name -> number format (None = text/general)
+FORMATS = {
+    "int": "#,##0",
+    "qty": "#,##0.##",
+    "money": "#,##0.00",
+    "pct": "0.00%",
+    "wrap": None,
+    "bold": None,
+}
+
+KPI_FILLS = {"good": "E7F4EA", "warn": "FFF5E5", "info": "EAF2FF"}
+
+# Preamble styles that are allowed to overflow into the next columns (ignored when sizing columns)
+OVERFLOW_STYLES = {"title", "heading", "banner"}
+
+# A pre-styled cell for preamble/footer rows: Styled("TOTAL", "bold") or Styled(x, "kpi_good", "#,##0.00")
+Styled = namedtuple("Styled", "value style number_format", defaults=(None, None))
+
+# Where a sheet's rows ended up, for charts/conditional formats added by the caller
+SheetInfo = namedtuple("SheetInfo", "ws header_row first_row last_row rows")
+
+
+def _thin_border(color="D9D9D9"):
+    side = Side(style="thin", color=color)
+    return Border(left=side, right=side, top=side, bottom=side)
+
+
+def _named_styles(header_color):
+    border = _thin_border()
+    styles = [
+        NamedStyle(name="wph_header", font=Font(bold=True, color="FFFFFF"),
+                   fill=PatternFill("solid", fgColor=header_color),
+                   alignment=Alignment(horizontal="center", vertical="center"), border=border),
+        NamedStyle(name="wph_title", font=Font(size=16, bold=True)),
+        NamedStyle(name="wph_heading", font=Font(size=14, bold=True)),
+        NamedStyle(name="wph_bold", font=Font(bold=True)),
+        NamedStyle(name="wph_banner", font=Font(bold=True), alignment=Alignment(horizontal="center")),
+        NamedStyle(name="wph_wrap", alignment=Alignment(wrap_text=True, vertical="center")),
+    ]
+    for name, fmt in FORMATS.items():
+        if fmt:
+            styles.append(NamedStyle(name=f"wph_{name}", number_format=fmt))
+    for name, color in KPI_FILLS.items():
+        styles.append(NamedStyle(name=f"wph_kpi_{name}", font=Font(bold=True),
+                                 fill=PatternFill("solid", fgColor=color), border=border))
+    return styles
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _display_len(value):
+    if isinstance(value, Styled):
+        value = value.value
+    if value is None:
+        return 0
+    if isinstance(value, float):
+        return len(f"{value:,.2f}")
+    return len(str(value))
+
+
+class XlsxReport:
+    """Multi-sheet write-only workbook.
+
+    Each add_sheet() call writes its sheet completely; sheets cannot be
+    revisited afterwards. save() can only be called once.
+    """
+
+    def __init__(self, header_color="22313F"):
+        self.wb = Workbook(write_only=True)
+        for style in _named_styles(header_color):
+            self.wb.add_named_style(style)
+        self._templates = {}
+        self._table_names = set()
+
+    def _style_array(self, ws, style, number_format=None):
+        key = (style, number_format)
+        arr = self._templates.get(key)
+        if arr is None:
+            cell = WriteOnlyCell(ws)
+            if style:
+                cell.style = style if style.startswith("wph_") else f"wph_{style}"
+            if number_format:
+                cell.number_format = number_format
+            arr = self._templates[key] = cell._style
+        return arr
+
+    def _cell(self, ws, value, style, number_format=None):
+        cell = WriteOnlyCell(ws, value=_plain(value))
+        cell._style = copy(self._style_array(ws, style, number_format))
+        return cell
+
+    def _free_row(self, ws, row):
+        out = []
+        for v in row or ():
+            if isinstance(v, Styled):
+                out.append(self._cell(ws, v.value, v.style, v.number_format))
+            else:
+                out.append(_plain(v))
+        return out
+
+    def table_name(self, display_name):
+        name = re.sub(r"[^A-Za-z0-9_]", "_", display_name)
+        if not re.match(r"^[A-Za-z_]", name):
+            name = f"t_{name}"
+        while name in self._table_names:
+            name += "_x"
+        self._table_names.add(name)
+        return name
+
+    def add_sheet(self, title, headers, rows, *, formats=None, widths=None, freeze=None,
+                  table=None, table_style="TableStyleMedium9", preamble=(), merge=(),
+                  conditional=(), footer=None, sample_rows=SAMPLE_ROWS,
+                  min_width=MIN_WIDTH, max_width=MAX_WIDTH):
+        """Write one sheet: preamble rows, header row, data rows, footer rows.
+
+        rows: iterable of sequences in headers order (consumed lazily); values may be Styled.
+        formats: {header: "money"|"int"|"qty"|"pct"|"wrap"|"bold"} per data column.
+        widths: {header: width} overrides for the sampled widths.
+        conditional: [(header, rule)] applied over the data range.
+        footer: callable(SheetInfo) -> list of rows, e.g. totals referencing the data range.
+        """
+        ws = self.wb.create_sheet(title)
+        headers = list(headers or [])
+        preamble = list(preamble)
+        formats = formats or {}
+        widths = widths or {}
+
+        rows = iter(rows)
+        sample = list(itertools.islice(rows, sample_rows))
+        sized = sample + [[None if isinstance(v, Styled) and v.style in OVERFLOW_STYLES else v for v in prow]
+                          for prow in preamble]
+
+        # Column dimensions and panes go into the sheet header, so they must be set before the first row
+        ncols = max([len(headers)] + [len(r) for r in sized])
+        for idx in range(ncols):
+            name = headers[idx] if idx < len(headers) else None
+            width = widths.get(name)
+            if width is None:
+                longest = max([_display_len(name)] + [_display_len(r[idx]) for r in sized if idx < len(r)])
+                width = min(max(min_width, longest + 2), max_width)
+            ws.column_dimensions[get_column_letter(idx + 1)].width = width
+        if freeze:
+            ws.freeze_panes = freeze
+        for ref in merge:
+            ws.merged_cells.add(ref)
+
+        row_no = 0
+        for prow in preamble:
+            ws.append(self._free_row(ws, prow))
+            row_no += 1
+
+        header_row = None
+        if headers:
+            ws.append([self._cell(ws, h, "header") for h in headers])
+            row_no += 1
+            header_row = row_no
+
+        col_styles = {}
+        for idx, name in enumerate(headers):
+            fmt = formats.get(name)
+            if fmt:
+                col_styles[idx] = self._style_array(ws, fmt)
+
+        count = 0
+        for row in itertools.chain(sample, rows):
+            out = []
+            for idx, value in enumerate(row):
+                arr = col_styles.get(idx)
+                if isinstance(value, Styled):
+                    out.append(self._cell(ws, value.value, value.style, value.number_format))
+                elif arr is None:
+                    out.append(_plain(value))
+                else:
+                    cell = WriteOnlyCell(ws, value=_plain(value))
+                    cell._style = copy(arr)
+                    out.append(cell)
+            ws.append(out)
+            count += 1
+        row_no += count
+
+        first_row = (header_row or 0) + 1
+        info = SheetInfo(ws, header_row, first_row, row_no, count)
+
+        if count and headers:
+            for name, rule in conditional:
+                letter = get_column_letter(headers.index(name) + 1)
+                ws.conditional_formatting.add(f"{letter}{first_row}:{letter}{row_no}", rule)
+            if table:
+                self._add_table(ws, table, table_style, headers, header_row, row_no)
+
+        if footer:
+            for frow in footer(info):
+                ws.append(self._free_row(ws, frow))
+        return info
+
+    def _add_table(self, ws, display_name, style, headers, header_row, last_row):
+        # Write-only sheets cannot be read back, so the table columns are named here explicitly
+        ref = f"A{header_row}:{get_column_letter(len(headers))}{last_row}"
+        t = Table(displayName=self.table_name(display_name), ref=ref)
+        t.tableColumns = [TableColumn(id=i, name=str(h)) for i, h in enumerate(headers, start=1)]
+        t.autoFilter = AutoFilter(ref=ref)
+        t.tableStyleInfo = TableStyleInfo(name=style, showRowStripes=True)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)  # "you must add table columns manually" - done above
+            ws.add_table(t)
+
+    def save(self, path=None):
+        """Save to path, or return a spooled temp file positioned at 0 (caller closes it)"""
+        if path:
+            self.wb.save(path)
+            return path
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            self.wb.save(spool)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
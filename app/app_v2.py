@@ -13,7 +13,8 @@ from flask import abort
 import requests
 from flask import send_file
 from dotenv import load_dotenv
-from .db import fetch_all
+from .db import fetch_all, pooled_conn, pool_stats
+from .staging_index import index_for as staging_index_for
 
 try:
     from openpyxl import Workbook
@@ -359,6 +360,7 @@ def api_faktura_upload():
             return jsonify({"error": "Only XML invoices supported currently"}), 400
         
         hdr, items = parse_invoice_xml(temp_path)
+        _staging_index(temp_dir).put(temp_path, _staging_summary_of(hdr, items))
         
         # Load validation lookup
         cfg_path = os.path.join(base, '..', 'configs', 'faktura_ai.json')
@@ -548,6 +550,36 @@ def api_faktura_download(date, invoice_no, file_type):
         return jsonify({"error": str(e)}), 500
 
 
+# Listing fields of staged XMLs, kept in staging/faktura_uploads/.staging_index.sqlite
+# (staging_index.py); bump the version when the summary fields change
+STAGING_SUMMARY_VERSION = 1
+
+
+def _staging_summary_of(header, items):
+    total_calc = sum(
+        to_number(it.get('qty'), 0) *
+        to_number(it.get('price'), 0) *
+        (1 - to_number(it.get('rabat_pct'), 0) / 100.0)
+        for it in items
+    )
+    return {
+        "supplier": header.get('supplier', 'N/A'),
+        "invoice_no": header.get('invoice_no', 'N/A'),
+        "invoice_date": header.get('invoice_date', 'N/A'),
+        "currency": header.get('currency', 'RSD'),
+        "items_count": len(items),
+        "total_amount": round(total_calc, 2),
+    }
+
+
+def _staging_summary(fpath):
+    return _staging_summary_of(*parse_invoice_xml(fpath))
+
+
+def _staging_index(staging_dir):
+    return staging_index_for(staging_dir, _staging_summary, STAGING_SUMMARY_VERSION)
+
+
 @app.route("/api/faktura/pending", methods=["GET"])
 def api_faktura_pending():
     """
@@ -574,37 +606,34 @@ def api_faktura_pending():
         ensure_dir(staging_dir)
         
         pending = []
-        for fname in os.listdir(staging_dir):
-            if not fname.lower().endswith('.xml'):
-                continue
-            
+        for entry in _staging_index(staging_dir).scan():
+            fname = entry['filename']
             fpath = os.path.join(staging_dir, fname)
-            stat = os.stat(fpath)
+            summary = entry['summary']
             
-            # Quick parse to get header info
-            try:
-                header, items = parse_invoice_xml(fpath)
+            # Header info from the staging index (parsed once per file content)
+            if summary is not None:
                 pending.append({
                     "filename": fname,
                     "path": fpath,
-                    "uploaded_at": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "size_kb": round(stat.st_size / 1024, 2),
-                    "supplier": header.get('supplier', 'N/A'),
-                    "invoice_no": header.get('invoice_no', 'N/A'),
-                    "invoice_date": header.get('invoice_date', 'N/A'),
-                    "items_count": len(items)
+                    "uploaded_at": datetime.datetime.fromtimestamp(entry['mtime']).isoformat(),
+                    "size_kb": round(entry['size'] / 1024, 2),
+                    "supplier": summary['supplier'],
+                    "invoice_no": summary['invoice_no'],
+                    "invoice_date": summary['invoice_date'],
+                    "items_count": summary['items_count']
                 })
-            except Exception as e:
+            else:
                 # If parse fails, still show file
                 pending.append({
                     "filename": fname,
                     "path": fpath,
-                    "uploaded_at": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "size_kb": round(stat.st_size / 1024, 2),
+                    "uploaded_at": datetime.datetime.fromtimestamp(entry['mtime']).isoformat(),
+                    "size_kb": round(entry['size'] / 1024, 2),
                     "supplier": "PARSE_ERROR",
                     "invoice_no": "N/A",
                     "items_count": 0,
-                    "error": str(e)
+                    "error": entry['error']
                 })
         
         return jsonify({"pending": pending})
@@ -773,9 +802,8 @@ def api_faktura_execute():
         if not db_cfg['password']:
             return jsonify({"error": "WPH_PG18_PASS environment variable not set"}), 500
         
-        # Connect and execute
-        conn = psycopg2.connect(**db_cfg)
-        try:
+        # Borrow a pooled connection and execute
+        with pooled_conn(**db_cfg) as conn:
             allow_remote = os.getenv('WPH_WRITE_REMOTE', '0') == '1'
             
             kalk_id = insert_kalkulacija(
@@ -797,6 +825,7 @@ def api_faktura_execute():
                     ensure_dir(archive_dir)
                     archive_path = os.path.join(archive_dir, os.path.basename(resolved_path))
                     os.rename(resolved_path, archive_path)
+                    _staging_index(os.path.dirname(resolved_path)).forget(resolved_path)
                 
                 return jsonify({
                     "success": True,
@@ -807,9 +836,6 @@ def api_faktura_execute():
                 })
             else:
                 return jsonify({"error": "insert_kalkulacija returned None"}), 500
-        
-        finally:
-            conn.close()
     
     except Exception as e:
         import traceback
@@ -862,17 +888,15 @@ def api_efaktura_invoices():
         
         invoices = []
         
-        for fname in os.listdir(staging_dir):
-            if not fname.lower().endswith('.xml'):
-                continue
-            
-            fpath = os.path.join(staging_dir, fname)
-            stat = os.stat(fpath)
-            uploaded_at = datetime.datetime.fromtimestamp(stat.st_mtime)
+        for entry in _staging_index(staging_dir).scan():
+            fname = entry['filename']
+            uploaded_at = datetime.datetime.fromtimestamp(entry['mtime'])
             
-            # Parse XML to get header info
+            # Header info from the staging index (parsed once per file content)
             try:
-                header, items = parse_invoice_xml(fpath)
+                if entry['error'] is not None:
+                    raise ValueError(entry['error'])
+                header = entry['summary']
                 
                 # Apply filters
                 if supplier_filter and supplier_filter.lower() not in (header.get('supplier') or '').lower():
@@ -900,23 +924,15 @@ def api_efaktura_invoices():
                         except:
                             pass
                 
-                # Calculate total
-                total_calc = sum(
-                    to_number(it.get('qty'), 0) * 
-                    to_number(it.get('price'), 0) * 
-                    (1 - to_number(it.get('rabat_pct'), 0) / 100.0)
-                    for it in items
-                )
-                
                 invoice_data = {
                     "id": os.path.splitext(fname)[0],
                     "filename": fname,
-                    "supplier": header.get('supplier', 'N/A'),
-                    "invoice_no": header.get('invoice_no', 'N/A'),
-                    "invoice_date": header.get('invoice_date', 'N/A'),
-                    "total_amount": round(total_calc, 2),
-                    "currency": header.get('currency', 'RSD'),
-                    "items_count": len(items),
+                    "supplier": header['supplier'],
+                    "invoice_no": header['invoice_no'],
+                    "invoice_date": header['invoice_date'],
+                    "total_amount": header['total_amount'],
+                    "currency": header['currency'],
+                    "items_count": header['items_count'],
                     "status": "pending",
                     "uploaded_at": uploaded_at.isoformat() + 'Z'
                 }
@@ -1018,9 +1034,8 @@ def api_efaktura_import_invoice(invoice_id):
         if not db_cfg['password']:
             return jsonify({"error": "WPH_PG18_PASS environment variable not set"}), 500
         
-        # Connect and execute import
-        conn = psycopg2.connect(**db_cfg)
-        try:
+        # Borrow a pooled connection and execute import
+        with pooled_conn(**db_cfg) as conn:
             allow_remote = os.getenv('WPH_WRITE_REMOTE', '0') == '1'
             
             kalk_id = insert_kalkulacija(
@@ -1059,14 +1074,12 @@ def api_efaktura_import_invoice(invoice_id):
                     ensure_dir(archive_dir)
                     archive_path = os.path.join(archive_dir, os.path.basename(xml_path))
                     os.rename(xml_path, archive_path)
+                    _staging_index(os.path.dirname(xml_path)).forget(xml_path)
                     response_data["archived_to"] = archive_path
                 
                 return jsonify(response_data)
             else:
                 return jsonify({"error": "Import failed - no kalk_id returned"}), 500
-        
-        finally:
-            conn.close()
     
     except Exception as e:
         import traceback
@@ -1493,6 +1506,7 @@ def api_health_full():
     
     try:
         health_data = monitor.get_full_health()
+        health_data["db_pool"] = pool_stats()
         
         # Check for critical issues
         issues = monitor.check_critical_issues()
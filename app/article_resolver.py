@@ -0,0 +1,235 @@
+# file: app/article_resolver.py - In-memory artikal resolution for invoice imports
+"""
+lookup_or_create_artikal used to resolve every invoice line with a chain of
+single-row queries (barkod, LTRIM(barkod,'0'), artikliean, name LIKE, sifra).
+ArticleResolver loads artikli and artikliean once and answers the same
+cascade from hash indexes:
+
+  barkod -> sifra, LTRIM(barkod,'0') -> sifra, ean -> [sifra],
+  sifra -> naziv, name token -> {sifra}
+
+Ties are resolved as the SQL path's ORDER BY sifra (lowest sifra wins).
+Artikli and alternative EANs created during the import are written through,
+and are removed again by rollback() if the transaction does not commit.
+
+Build one resolver per import batch, pass it to every insert_kalkulacija call,
+and the whole batch runs on two bulk queries. Loading costs a full catalog
+read, so single-invoice imports do not use it and keep the per-item queries.
+"""
+import re
+import time
+from bisect import insort
+
+FETCH_SIZE = 5000
+NAME_NEEDLE_LEN = 25
+_NAME_STRIP = re.compile(r'[^A-Z0-9 ]')
+
+
+def name_key(naziv):
+    """Stored-name form used by the SQL path: REGEXP_REPLACE(naziv,'[^A-Z0-9 ]','','g')"""
+    return _NAME_STRIP.sub('', naziv or '')
+
+
+def name_needle(naziv):
+    """Invoice-name form used by the SQL path: whitespace-normalized upper name, first 25 chars"""
+    return ' '.join((naziv or '').upper().split())[:NAME_NEEDLE_LEN]
+
+
+def _like_matcher(needle):
+    """Predicate equivalent to LIKE '%needle%' (needle may contain LIKE wildcards)"""
+    if not any(c in needle for c in '%_\\'):
+        return lambda hay: needle in hay
+    parts, i = [], 0
+    while i < len(needle):
+        c = needle[i]
+        if c == '\\' and i + 1 < len(needle):
+            parts.append(re.escape(needle[i + 1]))
+            i += 1
+        elif c == '%':
+            parts.append('.*')
+        elif c == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    pattern = re.compile(''.join(parts), re.S)
+    return lambda hay: pattern.search(hay) is not None
+
+
+class ArticleResolver:
+    def __init__(self):
+        self.schema_prefix = None
+        self.loaded = False
+        self.load_ms = None
+        self._pending = []  # undo callbacks for write-through entries of the open transaction
+
+    def ensure(self, cur, schema_prefix):
+        """Load (or reload for another schema) on first use"""
+        if not self.loaded or self.schema_prefix != schema_prefix:
+            self.load(cur, schema_prefix)
+        return self
+
+    def load(self, cur, schema_prefix):
+        start = time.monotonic()
+        self.schema_prefix = schema_prefix
+        self.naziv = {}        # sifra -> naziv
+        self.by_barkod = {}    # barkod -> sifra
+        self.by_trimmed = {}   # LTRIM(barkod,'0') -> sifra
+        self.by_ean = {}       # artikliean.ean -> [sifra]
+        self.by_token = {}     # name token -> {sifra}
+        self.names = []        # sorted [(sifra, name_key)]
+        self._pending = []
+
+        for sifra, naziv, barkod in self._rows(cur, f"SELECT sifra, naziv, barkod FROM {schema_prefix}artikli ORDER BY sifra"):
+            self._index_artikal(sifra, naziv, barkod)
+        self.names.sort()
+
+        for sifra, ean in self._rows(cur, f"SELECT sifra, ean FROM {schema_prefix}artikliean", optional=True):
+            if ean is not None:
+                self.by_ean.setdefault(ean, []).append(sifra)
+        for sifre in self.by_ean.values():
+            sifre.sort()
+
+        self.loaded = True
+        self.load_ms = round((time.monotonic() - start) * 1000.0, 1)
+        print(f"ArticleResolver: {len(self.naziv)} artikli, {len(self.by_ean)} alt EAN "
+              f"loaded from {schema_prefix} in {self.load_ms} ms")
+
+    def _rows(self, cur, sql, optional=False):
+        """Fetch all rows; optional queries (artikliean may be missing on FDW) yield nothing on error"""
+        savepoint = optional and not cur.connection.autocommit
+        if savepoint:
+            cur.execute("SAVEPOINT article_resolver")
+        try:
+            cur.execute(sql)
+            rows = []
+            while True:
+                batch = cur.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                rows.extend(batch)
+        except Exception as e:
+            if not optional:
+                raise
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT article_resolver")
+            print(f"Note: ArticleResolver skipped optional source: {e}")
+            return []
+        if savepoint:
+            cur.execute("RELEASE SAVEPOINT article_resolver")
+        return rows
+
+    def _index_artikal(self, sifra, naziv, barkod):
+        self.naziv[sifra] = naziv
+        if barkod is not None:
+            self.by_barkod.setdefault(barkod, sifra)
+            self.by_trimmed.setdefault(barkod.lstrip('0'), sifra)
+        key = name_key(naziv)
+        self.names.append((sifra, key))
+        for token in set(key.split(' ')):
+            self.by_token.setdefault(token, set()).add(sifra)
+
+    # --- lookups -----------------------------------------------------------
+
+    def by_barcode(self, barcode):
+        """sifra for barcode: primary barkod, then zero-trimmed barkod, then artikliean (artikal must exist)"""
+        sifra = self.by_barkod.get(barcode)
+        if sifra is not None:
+            return sifra
+        trimmed = barcode.lstrip('0')
+        if trimmed and trimmed != barcode:
+            sifra = self.by_trimmed.get(trimmed)
+            if sifra is not None:
+                return sifra
+        for sifra in self.by_ean.get(barcode, ()):
+            if sifra in self.naziv:
+                return sifra
+        return None
+
+    def by_name(self, naziv):
+        """Lowest sifra whose stored name contains the invoice name's first 25 chars (SQL: LIKE '%...%')"""
+        needle = name_needle(naziv)
+        matches = _like_matcher(needle)
+        # Tokens with a space on both sides in the needle must be whole tokens of any matching name
+        inner = needle.split(' ')[1:-1]
+        if inner and not any(c in needle for c in '%_\\'):
+            candidates = None
+            for token in sorted(inner, key=lambda t: len(self.by_token.get(t, ()))):
+                found = self.by_token.get(token, set())
+                candidates = found if candidates is None else candidates & found
+                if not candidates:
+                    return None
+            hits = [s for s in candidates if matches(name_key(self.naziv[s]))]
+            return min(hits) if hits else None
+        for sifra, key in self.names:
+            if matches(key):
+                return sifra
+        return None
+
+    def resolve(self, barcode, naziv, supplier_sifra):
+        """(sifra, naziv, action) following lookup_or_create_artikal's cascade, or None"""
+        if barcode:
+            sifra = self.by_barcode(barcode)
+            if sifra is not None:
+                return sifra, self.naziv[sifra], 'FOUND'
+            sifra = self.by_name(naziv)
+            if sifra is not None:
+                return sifra, self.naziv[sifra], 'BARCODE_ADDED'
+        else:
+            sifra = self.by_name(naziv)
+            if sifra is not None:
+                return sifra, self.naziv[sifra], 'FOUND'
+        if supplier_sifra and supplier_sifra in self.naziv:
+            return supplier_sifra, self.naziv[supplier_sifra], 'SIFRA_FALLBACK'
+        return None
+
+    def has_ean(self, sifra, ean):
+        return sifra in self.by_ean.get(ean, ())
+
+    # --- write-through -----------------------------------------------------
+
+    def add_artikal(self, sifra, naziv, barkod=None):
+        """Register an artikal inserted in the open transaction"""
+        key = name_key(naziv)
+        self.naziv[sifra] = naziv
+        insort(self.names, (sifra, key))
+        added_barkod = barkod is not None and barkod not in self.by_barkod
+        added_trimmed = barkod is not None and barkod.lstrip('0') not in self.by_trimmed
+        if added_barkod:
+            self.by_barkod[barkod] = sifra
+        if added_trimmed:
+            self.by_trimmed[barkod.lstrip('0')] = sifra
+        tokens = set(key.split(' '))
+        for token in tokens:
+            self.by_token.setdefault(token, set()).add(sifra)
+
+        def undo():
+            self.naziv.pop(sifra, None)
+            self.names.remove((sifra, key))
+            if added_barkod:
+                self.by_barkod.pop(barkod, None)
+            if added_trimmed:
+                self.by_trimmed.pop(barkod.lstrip('0'), None)
+            for token in tokens:
+                self.by_token[token].discard(sifra)
+        self._pending.append(undo)
+
+    def add_ean(self, sifra, ean):
+        """Register an artikliean row inserted in the open transaction"""
+        if self.has_ean(sifra, ean):
+            return
+        insort(self.by_ean.setdefault(ean, []), sifra)
+        self._pending.append(lambda: self.by_ean[ean].remove(sifra))
+
+    def mark(self):
+        """Position to roll back to when only part of the open transaction is undone (SAVEPOINT)"""
+        return len(self._pending)
+
+    def commit(self):
+        """The transaction committed: keep write-through entries"""
+        self._pending = []
+
+    def rollback(self, mark=0):
+        """The transaction (or the part after mark) rolled back: drop those write-through entries"""
+        while len(self._pending) > mark:
+            self._pending.pop()()
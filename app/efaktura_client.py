@@ -2,17 +2,32 @@
 import os
 import datetime as dt
 import re
+import time
+import random
+import threading
+import email.utils
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
 except Exception:
     requests = None
 
+try:
+    from overview_cache import cache_for as overview_cache_for
+except ImportError:
+    from app.overview_cache import cache_for as overview_cache_for
+
 SAFE_FILENAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
 
 class EFakturaError(Exception):
-    pass
+    def __init__(self, message: str = '', status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status            # HTTP status of the failed response, if any
+        self.retry_after = retry_after  # seconds from the Retry-After header, if any
 
 def _env(name: str, default: Optional[str] = None) -> Optional[str]:
     v = os.getenv(name)
@@ -33,17 +48,197 @@ SALES_STATUSES = [
 # Corrected base for fiscal (retail) bills endpoints:
 FISCAL_BASE = 'https://efaktura.mfin.gov.rs/api/publicApi/efiscalization/sales'
 
+# Overview cache for list_incoming_invoices(fetch_details=True); '0' disables it
+OVERVIEW_CACHE = _env('WPH_EFAKT_OVERVIEW_CACHE') or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), 'staging', '.efaktura_overviews.sqlite')
+
+# /ids endpoints return at most this many IDs per call (see list_windows)
+LISTING_CAP = int(_env('WPH_EFAKT_LISTING_CAP', '50'))
+
+# Download engine (see DownloadEngine)
+DOWNLOAD_WORKERS = int(_env('WPH_EFAKT_WORKERS', '4'))
+DOWNLOAD_RATE = float(_env('WPH_EFAKT_RATE', '3'))     # requests/second ceiling (API allows ~3/s)
+DOWNLOAD_BURST = float(_env('WPH_EFAKT_BURST', '3'))
+RATE_FLOOR = 0.2          # requests/second the limiter never drops below
+RATE_STEP = 0.1           # requests/second regained per successful request
+MAX_PAUSE = 120.0         # cap on a server-requested Retry-After pause (seconds)
+
+# Transport (see EFakturaSession)
+POOL_SIZE = int(_env('WPH_EFAKT_POOL', '0')) or max(10, DOWNLOAD_WORKERS * 2)
+RETRIES = int(_env('WPH_EFAKT_RETRIES', '4'))
+RETRY_BASE = float(_env('WPH_EFAKT_RETRY_BASE', '0.5'))   # seconds, doubled per attempt
+RETRY_MAX_DELAY = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)                 # retried for GET
+RETRY_ANY_METHOD = (429, 503)                              # request was not processed: safe for POST too
+BREAKER_THRESHOLD = int(_env('WPH_EFAKT_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(_env('WPH_EFAKT_BREAKER_COOLDOWN', '30'))
+BREAKER_MAX_COOLDOWN = 300.0
+BREAKER_GIVE_UP = float(_env('WPH_EFAKT_BREAKER_GIVE_UP', '900'))
+
 
 def _require_requests():
     if requests is None:
         raise EFakturaError('requests library not installed. pip install requests')
 
 
-def make_session() -> 'requests.Session':
+def _retry_after(r) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), None if absent/unparseable"""
+    value = r.headers.get('Retry-After') if getattr(r, 'headers', None) is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (when - dt.datetime.now(dt.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _failed(r, message: str) -> EFakturaError:
+    return EFakturaError(f'{message} {r.status_code} {r.text[:300]}', status=r.status_code, retry_after=_retry_after(r))
+
+
+class CircuitBreaker:
+    """Pauses every request of a session while the eFaktura API is failing.
+
+    BREAKER_THRESHOLD consecutive failures (5xx, connection errors, timeouts)
+    open the circuit: requests wait out the cooldown instead of hitting the
+    API, then a single probe goes through. A good probe closes the circuit,
+    a failed one reopens it with twice the cooldown. After BREAKER_GIVE_UP
+    seconds of outage requests fail fast with EFakturaError.
+    """
+
+    def __init__(self, threshold: int = None, cooldown: float = None, give_up: float = None):
+        self.threshold = max(1, threshold or BREAKER_THRESHOLD)
+        self.base_cooldown = cooldown or BREAKER_COOLDOWN
+        self.give_up = give_up or BREAKER_GIVE_UP
+        self.cooldown = self.base_cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.open_until = 0.0
+        self.probing = False
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def before(self):
+        """Block while the circuit is open; raises once the outage exceeds give_up"""
+        while True:
+            with self.lock:
+                if self.opened_at is None:
+                    return
+                now = time.monotonic()
+                if now - self.opened_at > self.give_up:
+                    raise EFakturaError(f'eFaktura API unavailable for {now - self.opened_at:.0f}s '
+                                        f'(circuit open after {self.failures} failures)')
+                if now >= self.open_until and not self.probing:
+                    self.probing = True
+                    return
+                wait = self.open_until - now if now < self.open_until else 1.0  # probe in flight
+            time.sleep(min(max(wait, 0.1), 5.0))
+
+    def record(self, ok: bool):
+        with self.lock:
+            if ok:
+                if self.opened_at is not None:
+                    print(f"eFaktura: API recovered, circuit closed after {time.monotonic() - self.opened_at:.0f}s")
+                self.failures = 0
+                self.opened_at = None
+                self.probing = False
+                self.cooldown = self.base_cooldown
+                return
+            self.failures += 1
+            now = time.monotonic()
+            if self.probing:
+                self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            elif self.opened_at is not None or self.failures < self.threshold:
+                return
+            else:
+                self.opened_at = now
+                self.trips += 1
+            self.probing = False
+            self.open_until = now + self.cooldown
+            print(f"eFaktura: {self.failures} consecutive failures, pausing requests for {self.cooldown:.0f}s")
+
+    def release(self):
+        """A request ended without an outcome (interrupted): let the next one probe"""
+        with self.lock:
+            self.probing = False
+
+
+def _retry_delay(attempt: int, retry_after: Optional[float]) -> float:
+    """Retry-After when the server sent one, else exponential backoff with jitter"""
+    if retry_after is not None:
+        return retry_after
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+
+if requests is not None:
+    class EFakturaSession(requests.Session):
+        """requests.Session with the eFaktura transport policy.
+
+        GETs are retried on connection errors, timeouts and RETRY_STATUSES;
+        any method is retried on 429/503 (the server did not process it).
+        Retries wait Retry-After or a jittered exponential backoff, and every
+        attempt goes through the session's CircuitBreaker. When retries run
+        out the last response is returned (or the last error raised), so the
+        EFakturaError raised by the callers is unchanged.
+        """
+
+        def __init__(self, retries: int = None, breaker: CircuitBreaker = None):
+            super().__init__()
+            self.retries = RETRIES if retries is None else retries
+            self.breaker = breaker or CircuitBreaker()
+
+        def request(self, method, url, *args, **kwargs):
+            method = method.upper()
+            attempt = 0
+            while True:
+                self.breaker.before()
+                try:
+                    r = super().request(method, url, *args, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self.breaker.record(False)
+                    if method != 'GET' or attempt >= self.retries:
+                        raise
+                    delay = _retry_delay(attempt, None)
+                    reason = type(e).__name__
+                except Exception:
+                    # ChunkedEncodingError, ContentDecodingError, TooManyRedirects...: a failure, not retried
+                    self.breaker.record(False)
+                    raise
+                except BaseException:
+                    self.breaker.release()
+                    raise
+                else:
+                    self.breaker.record(r.status_code < 500)
+                    retryable = r.status_code in (RETRY_STATUSES if method == 'GET' else RETRY_ANY_METHOD)
+                    if not retryable or attempt >= self.retries:
+                        return r
+                    retry_after = _retry_after(r)
+                    if retry_after is not None and retry_after > MAX_PAUSE:
+                        return r
+                    delay = _retry_delay(attempt, retry_after)
+                    reason = r.status_code
+                attempt += 1
+                print(f"eFaktura: {method} {url.rsplit('/', 1)[-1]} -> {reason}, "
+                      f"retry {attempt}/{self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+
+def make_session(pool_size: Optional[int] = None) -> 'requests.Session':
+    """Session with the retry/circuit-breaker transport and a connection pool of pool_size
+    (default WPH_EFAKT_POOL, at least twice the download workers)"""
     _require_requests()
     if not API_KEY:
         raise EFakturaError('Missing API key. Set WPH_EFAKT_API_KEY in environment.')
-    s = requests.Session()
+    s = EFakturaSession()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size or POOL_SIZE, max_retries=0)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
     s.headers.update({
         'Accept': '*/*',
         'User-Agent': DEFAULT_USER_AGENT,
@@ -52,15 +247,61 @@ def make_session() -> 'requests.Session':
     return s
 
 
-def list_incoming_invoices(s: 'requests.Session', date_from: dt.date, date_to: dt.date, fetch_details: bool = False) -> List[Dict]:
-    """
-    Returns a list of dicts with at least: id, supplier, invoice_no, issue_date.
-    Uses POST /api/publicApi/purchase-invoice/ids to get invoice IDs.
-    
-    Args:
-        fetch_details: If True, fetches overview for each invoice (slower but has supplier info)
-                      If False, returns only IDs (faster)
+def _overview_cache():
+    return overview_cache_for(OVERVIEW_CACHE) if OVERVIEW_CACHE != '0' else None
+
+
+def list_windows(s: 'requests.Session', list_window, date_from: dt.date, date_to: dt.date,
+                 engine: Optional['DownloadEngine'] = None, cap: Optional[int] = None) -> List[Tuple[dt.date, dt.date, List]]:
+    """Cover [date_from, date_to] with listing windows, bisecting only the windows that hit the cap.
+
+    list_window(s, d_from, d_to) -> [ids] is one listing call. The first call covers the whole
+    range; every window returning cap or more IDs is split in half and both halves are listed
+    again, all windows of a round in parallel on engine (a temporary DownloadEngine when a round
+    has more than one window). Returns [(d_from, d_to, ids)] in date order. A single day that
+    still hits the cap cannot be split by date: it is kept and reported.
+    Do not pass the engine from inside one of its own workers.
     """
+    cap = cap or LISTING_CAP
+    windows = [(date_from, date_to)]
+    done = []
+    own_engine = None
+    try:
+        while windows:
+            if len(windows) == 1 and engine is None:
+                listed = [list_window(s, *windows[0])]
+            else:
+                if engine is None:
+                    engine = own_engine = DownloadEngine(s)
+                futures = [engine.submit_call(list_window, a, b) for a, b in windows]
+                listed = [f.result() for f in futures]  # a failed window raises: never drop it silently
+            split = []
+            for (a, b), ids in zip(windows, listed):
+                if len(ids) < cap:
+                    done.append((a, b, ids))
+                elif a < b:
+                    mid = a + (b - a) // 2
+                    split += [(a, mid), (mid + dt.timedelta(days=1), b)]
+                else:
+                    print(f"eFaktura: WARNING {a} returned {len(ids)} IDs (listing cap {cap}), "
+                          f"invoices of this day may be missing")
+                    done.append((a, b, ids))
+            windows = split
+    finally:
+        if own_engine is not None:
+            own_engine.close()
+    done.sort(key=lambda w: w[0])
+    return done
+
+
+def list_range(s: 'requests.Session', list_window, date_from: dt.date, date_to: dt.date,
+               engine: Optional['DownloadEngine'] = None) -> List:
+    """De-duplicated IDs of list_windows() in date order"""
+    return list(dict.fromkeys(i for _, _, ids in list_windows(s, list_window, date_from, date_to, engine) for i in ids))
+
+
+def list_purchase_ids_window(s: 'requests.Session', date_from: dt.date, date_to: dt.date) -> List:
+    """One POST /api/publicApi/purchase-invoice/ids call (capped at LISTING_CAP IDs)"""
     # Serbia eFaktura uses POST for listing with JSON body
     url = LIST_URL or 'https://efaktura.mfin.gov.rs/api/publicApi/purchase-invoice/ids'
     
@@ -72,7 +313,7 @@ def list_incoming_invoices(s: 'requests.Session', date_from: dt.date, date_to: d
     
     r = s.post(url, json=payload, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'List invoices failed: {r.status_code} {r.text[:300]}')
+        raise _failed(r, 'List invoices failed:')
     
     data = r.json()
     
@@ -82,31 +323,61 @@ def list_incoming_invoices(s: 'requests.Session', date_from: dt.date, date_to: d
         invoice_ids = data.get('PurchaseInvoiceIds', [])
     elif isinstance(data, list):
         invoice_ids = data
+    return invoice_ids
+
+
+def list_incoming_invoices(s: 'requests.Session', date_from: dt.date, date_to: dt.date, fetch_details: bool = False,
+                           engine: Optional['DownloadEngine'] = None) -> List[Dict]:
+    """
+    Returns a list of dicts with at least: id, supplier, invoice_no, issue_date.
+    Uses POST /api/publicApi/purchase-invoice/ids to get invoice IDs, split into
+    windows under the 50-ID cap by list_range (parallel on engine when split).
+    
+    Args:
+        fetch_details: If True, adds supplier info from each invoice's overview. Overviews come
+                      from the overview cache (see overview_cache.py); missing ones are fetched
+                      in parallel on engine (a temporary DownloadEngine when None).
+                      If False, returns only IDs
+    """
+    invoice_ids = list_range(s, list_purchase_ids_window, date_from, date_to, engine)
     
     # Option 1: Fast - return only IDs
     if not fetch_details:
         return [{'id': inv_id, 'supplier': '', 'invoice_no': '', 'issue_date': None} 
                 for inv_id in invoice_ids]
     
-    # Option 2: Slow - get overview for each ID to get supplier info
+    # Option 2: overview per ID for supplier info - cached ones first, the rest in parallel
+    cache = _overview_cache()
+    overviews = cache.get_many(invoice_ids) if cache else {}
+    missing = [i for i in invoice_ids if int(i) not in overviews]
+    if missing:
+        own_engine = engine is None
+        if own_engine:
+            engine = DownloadEngine(s)
+        try:
+            futures = [(i, engine.submit_call(get_invoice_overview, i)) for i in missing]
+            fetched = []
+            for invoice_id, future in futures:
+                try:
+                    overview = overviews[int(invoice_id)] = future.result()
+                    fetched.append((invoice_id, overview, invoice_state(overview)))
+                except Exception:
+                    pass  # If overview fails, still include the ID
+        finally:
+            if own_engine:
+                engine.close()
+        if cache:
+            cache.put_many(fetched)
+    
     items = []
     for invoice_id in invoice_ids:
-        try:
-            overview = get_invoice_overview(s, invoice_id)
-            items.append({
-                'id': invoice_id,
-                'supplier': overview.get('supplierName', ''),
-                'invoice_no': overview.get('invoiceNumber', ''),
-                'issue_date': overview.get('invoiceDate', None),
-            })
-        except Exception as e:
-            # If overview fails, still include the ID
-            items.append({
-                'id': invoice_id,
-                'supplier': '',
-                'invoice_no': '',
-                'issue_date': None,
-            })
+        overview = overviews.get(int(invoice_id)) or {}
+        items.append({
+            'id': invoice_id,
+            'supplier': overview.get('supplierName', ''),
+            'invoice_no': overview.get('invoiceNumber', ''),
+            'issue_date': overview.get('invoiceDate', None),
+        })
     
     return items
 
@@ -117,10 +388,23 @@ def get_invoice_overview(s: 'requests.Session', invoice_id: int) -> Dict:
     params = {'invoiceId': invoice_id}
     r = s.get(url, params=params, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'Get overview failed for id={invoice_id}: {r.status_code} {r.text[:300]}')
+        raise _failed(r, f'Get overview failed for id={invoice_id}:')
     return r.json()
 
 
+def invoice_state(overview: Dict) -> Dict:
+    """{'status', 'last_modified'} of an overview (field casing differs between API versions)"""
+    def pick(*names):
+        for name in names:
+            if overview.get(name) not in (None, ''):
+                return overview[name]
+        return None
+    return {
+        'status': pick('purchaseInvoiceStatus', 'status', 'Status'),
+        'last_modified': pick('lastModifiedUtc', 'LastModifiedUtc', 'lastModified'),
+    }
+
+
 def download_invoice_xml(s: 'requests.Session', invoice_id) -> bytes:
     """Download invoice XML using GET /api/publicApi/purchase-invoice/xml"""
     url = GET_URL or 'https://efaktura.mfin.gov.rs/api/publicApi/purchase-invoice/xml'
@@ -130,7 +414,7 @@ def download_invoice_xml(s: 'requests.Session', invoice_id) -> bytes:
     
     r = s.get(url, params=params, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'Download XML failed for id={invoice_id}: {r.status_code} {r.text[:300]}')
+        raise _failed(r, f'Download XML failed for id={invoice_id}:')
     return r.content
 
 
@@ -157,30 +441,230 @@ def save_xml_to_staging(content: bytes, base_dir: Optional[str], supplier: str,
     return fpath
 
 
+class RateLimiter:
+    """Token bucket shared by all download workers.
+
+    Starts at the configured rate (the ceiling). Every 429/5xx halves the rate
+    and empties the bucket, a Retry-After pauses it; every success adds
+    RATE_STEP back (AIMD), so the engine settles just under what the API
+    currently accepts instead of sleeping a fixed delay per request.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.max_rate = max(RATE_FLOOR, rate or DOWNLOAD_RATE)
+        self.rate = self.max_rate
+        self.burst = max(1.0, burst or DOWNLOAD_BURST)
+        self.tokens = self.burst
+        self.updated = time.monotonic()  # may lie in the future while paused
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now > self.updated:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (self.updated - now) + (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, retry_after: Optional[float] = None):
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(RATE_FLOOR, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.updated = max(self.updated, time.monotonic() + min(retry_after, MAX_PAUSE))
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_STEP)
+
+
+class RequestStats:
+    """Latency and outcome of every request made through a DownloadEngine"""
+
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = Counter()  # per call: HTTP status or 'error' (no response)
+        self.responses = Counter()  # per attempt (transport retries included): HTTP status
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, outcome):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.outcomes[outcome] += 1
+
+    def observe(self, status: int):
+        with self.lock:
+            self.responses[status] += 1
+
+    def as_dict(self) -> Dict:
+        with self.lock:
+            lat = sorted(self.latencies)
+            outcomes = dict(self.outcomes)
+            responses = dict(self.responses)
+        wall = time.monotonic() - self.started
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000.0, 1) if lat else None
+
+        return {
+            'requests': len(lat),
+            'wall_s': round(wall, 2),
+            'per_s': round(len(lat) / wall, 2) if wall else None,
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'max_ms': round(lat[-1] * 1000.0, 1) if lat else None,
+            'throttled': responses.get(429, 0),
+            'server_errors': sum(n for k, n in responses.items() if k >= 500),
+            'outcomes': outcomes,
+            'responses': responses,
+        }
+
+    def summary(self) -> str:
+        m = self.as_dict()
+        return (f"eFaktura: {m['requests']} requests in {m['wall_s']}s ({m['per_s']}/s), "
+                f"p50 {m['p50_ms']} ms, p95 {m['p95_ms']} ms, max {m['max_ms']} ms, "
+                f"429: {m['throttled']}, 5xx: {m['server_errors']}")
+
+
+class DownloadEngine:
+    """Bounded thread pool downloading invoice XMLs on one keep-alive session.
+
+    All workers share the session (and its connection pool), one RateLimiter
+    and one RequestStats. Retries are the session's job (EFakturaSession);
+    the limiter sees every attempt's 429/5xx through a response hook. Errors
+    are returned per invoice so one bad invoice never stops a run.
+
+        with DownloadEngine(s) as engine:
+            for row, path, error in engine.download(rows, base_dir):
+                ...
+    """
+
+    def __init__(self, s: 'requests.Session', workers: Optional[int] = None, rate: Optional[float] = None,
+                 burst: Optional[float] = None):
+        self.session = s
+        self.workers = max(1, workers or DOWNLOAD_WORKERS)
+        self.limiter = RateLimiter(rate, burst)
+        self.stats = RequestStats()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='efaktura-dl')
+        self._hooks = getattr(s, 'hooks', {}).get('response')
+        if self._hooks is not None:
+            self._hooks.append(self._observe)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _observe(self, r, *args, **kwargs):
+        self.stats.observe(r.status_code)
+        if r.status_code == 429 or r.status_code >= 500:
+            self.limiter.backoff(_retry_after(r))
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        if self._hooks is not None and self._observe in self._hooks:
+            self._hooks.remove(self._observe)
+        if self.stats.latencies:
+            print(self.stats.summary())
+
+    def call(self, fn, *args):
+        """fn(session, *args) paced by the shared limiter and timed (including transport retries)"""
+        self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            result = fn(self.session, *args)
+        except EFakturaError as e:
+            self.stats.record(time.monotonic() - start, e.status or 'error')
+            raise
+        except Exception:
+            self.stats.record(time.monotonic() - start, 'error')
+            raise
+        self.stats.record(time.monotonic() - start, 200)
+        self.limiter.success()
+        return result
+
+    def _download(self, row: Dict, base_dir: Optional[str]) -> str:
+        xml = self.call(download_invoice_xml, row['id'])
+        return save_xml_to_staging(xml, base_dir, row.get('supplier', ''), row.get('invoice_no', ''),
+                                   row.get('issue_date'), row.get('id'))
+
+    def submit(self, row: Dict, base_dir: Optional[str] = None):
+        """Future of the saved path (save_xml_to_staging layout) for one listing row"""
+        return self._pool.submit(self._download, row, base_dir)
+
+    def submit_call(self, fn, *args):
+        """Future of call(fn, *args) on the worker pool"""
+        return self._pool.submit(self.call, fn, *args)
+
+    def _sync(self, row: Dict, known: Optional[Dict]):
+        state = None
+        if known is not None:
+            overview = self.call(get_invoice_overview, row['id'])
+            state = invoice_state(overview)
+            cache = _overview_cache()
+            if cache:
+                cache.put_many([(row['id'], overview, state)])
+            if not any(state[k] is not None and known.get(k) is not None and state[k] != known[k]
+                       for k in ('status', 'last_modified')):
+                return state, None
+        return state, self.call(download_invoice_xml, row['id'])
+
+    def submit_sync(self, row: Dict, known: Optional[Dict] = None):
+        """Future of (state, xml) for an incremental sync (see sync_manifest).
+
+        known: the manifest's {'status', 'last_modified'} of an invoice seen before;
+        its overview is fetched first and xml is None when neither changed.
+        Without it (new invoice) the XML is downloaded right away and state is None.
+        Nothing is written: the caller compares hashes and saves.
+        """
+        return self._pool.submit(self._sync, row, known)
+
+    def download(self, rows: List[Dict], base_dir: Optional[str] = None):
+        """Yield (row, path, error) in input order while later rows keep downloading"""
+        futures = [(row, self.submit(row, base_dir)) for row in rows]
+        for row, future in futures:
+            try:
+                yield row, future.result(), None
+            except Exception as e:
+                yield row, None, e
+
+
 def fetch_to_staging(date_from: dt.date, date_to: dt.date, base_dir: Optional[str]=None) -> Tuple[int, List[str]]:
     """Fetch incoming invoices from eFaktura and save into staging. Returns (count, paths)."""
     s = make_session()
     got = list_incoming_invoices(s, date_from, date_to)
     saved = []
-    for row in got:
-        try:
-            xml = download_invoice_xml(s, row['id'])
-            path = save_xml_to_staging(xml, base_dir, row.get('supplier',''), row.get('invoice_no',''), row.get('issue_date'), row.get('id'))
-            saved.append(path)
-        except Exception as e:
+    with DownloadEngine(s) as engine:
+        for row, path, error in engine.download(got, base_dir):
             # continue on individual download errors
-            saved.append(f"ERROR:{row.get('id')}: {e}")
+            saved.append(path if error is None else f"ERROR:{row.get('id')}: {error}")
     return (len([p for p in saved if not str(p).startswith('ERROR:')]), saved)
 
 
-def list_sales_invoice_ids(s: 'requests.Session', date_from: dt.date, date_to: dt.date, status: Optional[str]=None) -> List[int]:
+def list_sales_invoice_ids(s: 'requests.Session', date_from: dt.date, date_to: dt.date, status: Optional[str]=None,
+                           engine: Optional['DownloadEngine'] = None) -> List[int]:
     """Return list of sales invoice IDs using POST /api/publicApi/sales-invoice/ids with query params.
 
     Args:
         s: requests session
-        date_from/date_to: date range (inclusive) as date objects
+        date_from/date_to: date range (inclusive) as date objects; split into windows under
+            the 50-ID cap by list_range (parallel on engine when split)
         status: optional status filter (see SALES_STATUSES)
     """
+    return list_range(s, lambda s_, a, b: list_sales_ids_window(s_, a, b, status), date_from, date_to, engine)
+
+
+def list_sales_ids_window(s: 'requests.Session', date_from: dt.date, date_to: dt.date, status: Optional[str]) -> List[int]:
+    """One POST /api/publicApi/sales-invoice/ids call (capped at LISTING_CAP IDs)"""
     url = 'https://efaktura.mfin.gov.rs/api/publicApi/sales-invoice/ids'
     params = {
         'dateFrom': date_from.isoformat(),
@@ -190,7 +674,7 @@ def list_sales_invoice_ids(s: 'requests.Session', date_from: dt.date, date_to: d
         params['status'] = status
     r = s.post(url, params=params, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'List sales invoices failed: {r.status_code} {r.text[:300]}')
+        raise _failed(r, 'List sales invoices failed:')
     data = r.json()
     if isinstance(data, dict):
         return data.get('SalesInvoiceIds', []) or data.get('salesInvoiceIds', []) or []
@@ -205,7 +689,7 @@ def download_sales_invoice_xml(s: 'requests.Session', invoice_id: int) -> bytes:
     params = {'invoiceId': int(invoice_id)}
     r = s.get(url, params=params, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'Download sales XML failed for id={invoice_id}: {r.status_code} {r.text[:300]}')
+        raise _failed(r, f'Download sales XML failed for id={invoice_id}:')
     return r.content
 
 
@@ -218,7 +702,7 @@ def list_fiscal_bills_for_date(s: 'requests.Session', date_obj: dt.date) -> List
     url = f"{FISCAL_BASE}/fiscal-bill/{date_str}"
     r = s.get(url, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'List fiscal bills failed {r.status_code} {r.text[:300]}')
+        raise _failed(r, 'List fiscal bills failed')
     try:
         data = r.json()
     except Exception:
@@ -242,7 +726,7 @@ def get_fiscal_bill(s: 'requests.Session', fiscal_bill_number: str) -> Dict:
     url = f"{FISCAL_BASE}/fiscal-bill/{num}"
     r = s.get(url, timeout=60)
     if r.status_code >= 400:
-        raise EFakturaError(f'Get fiscal bill failed {num} {r.status_code} {r.text[:300]}')
+        raise _failed(r, f'Get fiscal bill failed {num}')
     try:
         return r.json()
     except Exception:
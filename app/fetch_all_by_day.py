@@ -1,26 +1,37 @@
 """
-Fetch ALL invoices by breaking down into daily requests.
-Bypasses the 50-invoice API limit.
+Fetch ALL invoices by breaking the range down into listing windows.
+Bypasses the 50-invoice API limit: list_windows (efaktura_client) bisects only
+the windows that hit the cap, so quiet weeks cost one listing call and busy
+periods are split down to single days.
+
+Runs are incremental: the sync manifest in the output folder (sync_manifest.py)
+remembers every invoice and settled day, so a re-run downloads only new or
+changed invoices. --full re-checks everything.
 """
 import sys
 import os
 sys.stdout.reconfigure(encoding='utf-8')
 sys.stderr.reconfigure(encoding='utf-8')
 
-from efaktura_client import make_session, list_incoming_invoices, download_invoice_xml, save_xml_to_staging
+from efaktura_client import (make_session, list_windows, list_purchase_ids_window, save_xml_to_staging,
+                             DownloadEngine, LISTING_CAP)
+from sync_manifest import SyncManifest, content_sha1
+from collections import deque
 from datetime import date, timedelta
-import time
 import argparse
 
-def fetch_all_by_day(date_from, date_to, output_dir=None, delay=0.3):
+def fetch_all_by_day(date_from, date_to, output_dir=None, delay=None, full=False):
     """
-    Fetch invoices day-by-day to bypass 50-invoice limit.
+    Fetch invoices window by window to bypass 50-invoice limit.
     
     Args:
         date_from: Start date
         date_to: End date
         output_dir: Output directory for XML files
-        delay: Delay between requests (seconds)
+        delay: Minimum interval between requests (seconds); None uses WPH_EFAKT_RATE.
+            Listings and downloads share one DownloadEngine: windows are listed and
+            downloaded in parallel, paced by its adaptive rate limiter.
+        full: Ignore day checkpoints and final statuses (re-check every invoice)
     
     Returns:
         dict with results
@@ -40,7 +51,7 @@ def fetch_all_by_day(date_from, date_to, output_dir=None, delay=0.3):
     os.makedirs(output_dir, exist_ok=True)
     
     print("=" * 80)
-    print("  eFAKTURA DOWNLOADER - DAY BY DAY MODE")
+    print("  eFAKTURA DOWNLOADER - ADAPTIVE WINDOW MODE")
     print("  (Bypass 50-invoice API limit)")
     print("=" * 80)
     print(f"📅 Periudha: {date_from} deri {date_to}")
@@ -52,89 +63,156 @@ def fetch_all_by_day(date_from, date_to, output_dir=None, delay=0.3):
     results = {
         'total_invoices': 0,
         'downloaded': 0,
+        'updated': 0,
+        'unchanged': 0,
         'failed': 0,
         'skipped_existing': 0,
         'days_processed': 0,
+        'days_settled': 0,
         'errors': []
     }
     
     all_invoice_ids = set()  # Track unique IDs
+    pending = deque()  # (window, inv, manifest entry, future) in listing order
+    window_left = {}  # (first day, last day) -> [queued jobs not reported yet, failures, invoice count]
     current_date = date_from
     
-    while current_date <= date_to:
-        results['days_processed'] += 1
+    def finish_window(window):
+        left, failed, count = window_left[window]
+        if left == 0 and failed == 0:
+            day = window[0]
+            while day <= window[1]:
+                manifest.checkpoint(day, count)
+                day += timedelta(days=1)
+    
+    def report(wait=False):
+        # Save finished downloads in listing order
+        while pending and (wait or pending[0][3].done()):
+            window, inv, entry, future = pending.popleft()
+            invoice_id = inv.get('id')
+            filename = f"INV_{invoice_id}.xml"
+            day = window[0] if window[0] == window[1] else None
+            try:
+                state, xml = future.result()
+                if xml is not None and (entry is None or content_sha1(xml) != entry['sha1']):
+                    saved_path = save_xml_to_staging(
+                        xml,
+                        output_dir,
+                        inv.get('supplier', ''),
+                        inv.get('invoice_no', ''),
+                        inv.get('issue_date', ''),
+                        invoice_id
+                    )
+                    manifest.record(invoice_id, day=day, sha1=content_sha1(xml), path=saved_path, state=state)
+                    if entry is None:
+                        results['downloaded'] += 1
+                        print(f"     ✓ {filename}")
+                    else:
+                        results['updated'] += 1
+                        print(f"     ↻ {filename} (ndryshuar: {state['status']})")
+                else:
+                    manifest.record(invoice_id, day=day, state=state)
+                    results['unchanged'] += 1
+            except Exception as e:
+                results['failed'] += 1
+                window_left[window][1] += 1
+                error_msg = f"ID {invoice_id}: {str(e)}"
+                results['errors'].append(error_msg)
+                print(f"     ✗ {filename} - {e}")
+            window_left[window][0] -= 1
+            finish_window(window)
+    
+    def queue_window(window, invoice_ids):
+        first, last = window
+        days = (last - first).days + 1
+        results['days_processed'] += days
+        if days == 1:
+            print(f"\n📆 {first.strftime('%Y-%m-%d')} ({first.strftime('%A')})")
+        else:
+            print(f"\n📆 {first.strftime('%Y-%m-%d')} → {last.strftime('%Y-%m-%d')} ({days} ditë)")
+        # A day still at the listing cap may be incomplete: never checkpoint it
+        window_left[window] = [0, int(len(invoice_ids) >= LISTING_CAP), len(invoice_ids)]
         
-        print(f"\n📆 {current_date.strftime('%Y-%m-%d')} ({current_date.strftime('%A')})")
+        if not invoice_ids:
+            print(f"   ø Nuk ka faktura")
+        else:
+            known = manifest.known(invoice_ids)
+            queued = 0
+            
+            # Queue new invoices for download, known ones for a change check
+            for invoice_id in invoice_ids:
+                # Skip if already downloaded
+                if invoice_id in all_invoice_ids:
+                    results['skipped_existing'] += 1
+                    continue
+                
+                all_invoice_ids.add(invoice_id)
+                results['total_invoices'] += 1
+                
+                entry = known.get(invoice_id)
+                action = SyncManifest.action(entry, full)
+                if action == 'final':
+                    results['unchanged'] += 1
+                    continue
+                
+                # Adopt a file downloaded before the manifest existed
+                filename = f"INV_{invoice_id}.xml"
+                filepath = os.path.join(output_dir, filename)
+                
+                if action == 'new' and os.path.exists(filepath):
+                    print(f"     ⊙ {filename} (ekziston)")
+                    manifest.adopt(invoice_id, filepath, first if days == 1 else None)
+                    results['skipped_existing'] += 1
+                    continue
+                
+                inv = {'id': invoice_id, 'supplier': '', 'invoice_no': '', 'issue_date': None}
+                known_state = entry if action == 'check' else None
+                pending.append((window, inv, entry, engine.submit_sync(inv, known_state)))
+                window_left[window][0] += 1
+                queued += 1
+            
+            print(f"   ✓ {len(invoice_ids)} faktura gjetur, {queued} për shkarkim/kontroll")
         
-        try:
-            # Get invoices for this day
-            invoices = list_incoming_invoices(session, current_date, current_date)
+        finish_window(window)
+    
+    manifest = SyncManifest.for_dir(output_dir)
+    engine = DownloadEngine(session, rate=1.0 / delay if delay else None)
+    try:
+        while current_date <= date_to:
+            # Days synced after they settled are not listed again
+            run_end = current_date
+            settled = not full and manifest.day_settled(current_date)
+            while run_end < date_to and (full or manifest.day_settled(run_end + timedelta(days=1)) == settled):
+                run_end += timedelta(days=1)
+            days = (run_end - current_date).days + 1
             
-            if not invoices:
-                print(f"   ø Nuk ka faktura")
+            if settled:
+                print(f"\n📆 {current_date.strftime('%Y-%m-%d')} → {run_end.strftime('%Y-%m-%d')}: "
+                      f"⊙ Sinkronizuar më parë (checkpoint, {days} ditë)")
+                results['days_processed'] += days
+                results['days_settled'] += days
             else:
-                print(f"   ✓ {len(invoices)} faktura gjetur")
+                try:
+                    # As few listing calls as the cap allows, listed in parallel on the engine
+                    windows = list_windows(session, list_purchase_ids_window, current_date, run_end, engine)
+                except Exception as e:
+                    print(f"\n📆 {current_date.strftime('%Y-%m-%d')} → {run_end.strftime('%Y-%m-%d')}")
+                    print(f"   ✗ Gabim: {e}")
+                    results['errors'].append(f"Date {current_date}..{run_end}: {str(e)}")
+                    results['days_processed'] += days
+                    windows = []
                 
-                # Download each invoice
-                for inv in invoices:
-                    invoice_id = inv.get('id')
-                    
-                    # Skip if already downloaded
-                    if invoice_id in all_invoice_ids:
-                        results['skipped_existing'] += 1
-                        continue
-                    
-                    all_invoice_ids.add(invoice_id)
-                    results['total_invoices'] += 1
-                    
-                    supplier = inv.get('supplier', '')
-                    invoice_no = inv.get('invoice_no', '')
-                    issue_date = inv.get('issue_date', '')
-                    
-                    # Check if file already exists
-                    filename = f"INV_{invoice_id}.xml"
-                    filepath = os.path.join(output_dir, filename)
-                    
-                    if os.path.exists(filepath):
-                        print(f"     ⊙ {filename} (ekziston)")
-                        results['skipped_existing'] += 1
-                        continue
-                    
-                    try:
-                        # Download
-                        xml_content = download_invoice_xml(session, invoice_id)
-                        
-                        # Save
-                        saved_path = save_xml_to_staging(
-                            xml_content,
-                            output_dir,
-                            supplier,
-                            invoice_no,
-                            issue_date,
-                            invoice_id
-                        )
-                        
-                        results['downloaded'] += 1
-                        print(f"     ✓ {filename}")
-                        
-                        # Small delay
-                        time.sleep(delay)
-                        
-                    except Exception as e:
-                        results['failed'] += 1
-                        error_msg = f"ID {invoice_id}: {str(e)}"
-                        results['errors'].append(error_msg)
-                        print(f"     ✗ {filename} - {e}")
-            
-            # Delay between days (respect rate limit: max 3 req/sec)
-            time.sleep(max(delay, 0.4))
+                for first, last, invoice_ids in windows:
+                    queue_window((first, last), invoice_ids)
+                    report()
             
-        except Exception as e:
-            print(f"   ✗ Gabim: {e}")
-            results['errors'].append(f"Date {current_date}: {str(e)}")
+            current_date = run_end + timedelta(days=1)
         
-        # Next day
-        current_date += timedelta(days=1)
+        report(wait=True)
+    finally:
+        engine.close()
+        manifest.close()
+    results['http'] = engine.stats.as_dict()
     
     # Summary
     print("\n" + "=" * 80)
@@ -143,6 +221,9 @@ def fetch_all_by_day(date_from, date_to, output_dir=None, delay=0.3):
     print(f"📆 Ditë të kontrolluara: {results['days_processed']}")
     print(f"📋 Faktura të gjetura: {results['total_invoices']}")
     print(f"✓ Të shkarkuara: {results['downloaded']}")
+    print(f"↻ Të ndryshuara: {results['updated']}")
+    print(f"= Pa ndryshime: {results['unchanged']}")
+    print(f"⊙ Ditë me checkpoint: {results['days_settled']}")
     print(f"⊙ Ekzistonin më parë: {results['skipped_existing']}")
     print(f"✗ Dështuan: {results['failed']}")
     
@@ -157,11 +238,14 @@ def fetch_all_by_day(date_from, date_to, output_dir=None, delay=0.3):
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Fetch ALL invoices day-by-day from eFaktura')
+    parser = argparse.ArgumentParser(description='Fetch ALL invoices from eFaktura in adaptive date windows')
     parser.add_argument('--from', dest='date_from', required=True, help='Start date (YYYY-MM-DD)')
     parser.add_argument('--to', dest='date_to', required=True, help='End date (YYYY-MM-DD)')
     parser.add_argument('--output', dest='output_dir', help='Output directory')
-    parser.add_argument('--delay', type=float, default=0.5, help='Delay between requests (seconds)')
+    parser.add_argument('--delay', type=float, default=None,
+                        help='Minimum interval between requests (seconds, default: WPH_EFAKT_RATE req/s)')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the sync checkpoints and re-check every invoice')
     
     args = parser.parse_args()
     
@@ -169,5 +253,6 @@ if __name__ == "__main__":
         args.date_from,
         args.date_to,
         args.output_dir,
-        args.delay
+        args.delay,
+        args.full
     )
@@ -31,10 +31,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.efaktura_client import (
     make_session, 
     list_incoming_invoices, 
-    download_invoice_xml,
     save_xml_to_staging,
+    DownloadEngine,
     EFakturaError
 )
+from app.sync_manifest import SyncManifest, content_sha1
 
 def ensure_utf8():
     """Ensure UTF-8 encoding for console output."""
@@ -44,7 +45,7 @@ def ensure_utf8():
     except Exception:
         pass
 
-def fetch_all_invoices(date_from, date_to, output_dir=None, delay_between_downloads=0.5):
+def fetch_all_invoices(date_from, date_to, output_dir=None, delay_between_downloads=None, full=False):
     """
     Fetch të gjitha fakturat nga eFaktura për periudhën e specifikuar.
     
@@ -52,15 +53,22 @@ def fetch_all_invoices(date_from, date_to, output_dir=None, delay_between_downlo
         date_from: Data fillestare (datetime.date ose string YYYY-MM-DD)
         date_to: Data përfundimtare (datetime.date ose string YYYY-MM-DD)
         output_dir: Direktoria ku ruhen XML-të (default: staging/faktura_uploads)
-        delay_between_downloads: Delay në sekonda midis shkarkimeve (për të shmangur rate limits)
+        delay_between_downloads: Intervali minimal në sekonda midis kërkesave; None = WPH_EFAKT_RATE
+            (shkarkimet bëhen paralelisht nga DownloadEngine, ritmi përshtatet me 429/5xx)
+        full: Injoro manifestin e sinkronizimit (kontrollo çdo faturë, edhe me status final)
+    
+    Shkarkimi është inkremental: manifesti në direktorinë e output (sync_manifest.py)
+    mban mend fakturat e shkarkuara; shkarkohen vetëm të rejat dhe të ndryshuarat.
     
     Returns:
         dict: {
             'total': numri total i fakturave,
             'downloaded': numri i shkarkuara me sukses,
             'failed': numri i dështuara,
-            'paths': lista e path-eve të shkarkuara,
-            'errors': lista e gabimeve
+            'unchanged': numri i fakturave pa ndryshime (nuk u shkarkuan),
+            'paths': lista e path-eve të shkarkuara (të reja ose të ndryshuara),
+            'errors': lista e gabimeve,
+            'http': statistikat e kërkesave (latency p50/p95, 429, 5xx)
         }
     """
     ensure_utf8()
@@ -87,6 +95,7 @@ def fetch_all_invoices(date_from, date_to, output_dir=None, delay_between_downlo
         'total': 0,
         'downloaded': 0,
         'failed': 0,
+        'unchanged': 0,
         'paths': [],
         'errors': []
     }
@@ -108,51 +117,72 @@ def fetch_all_invoices(date_from, date_to, output_dir=None, delay_between_downlo
         print(f"✓ U gjetën {len(invoices)} faktura")
         print("=" * 80)
         
-        # Download each invoice
-        for idx, inv in enumerate(invoices, 1):
-            invoice_id = inv.get('id')
-            supplier = inv.get('supplier', 'UNKNOWN')
-            invoice_no = inv.get('invoice_no', 'NO_NUM')
-            issue_date = inv.get('issue_date', '')
-            
-            print(f"\n[{idx}/{len(invoices)}] Faktura: {invoice_no}")
-            print(f"  Furnitori: {supplier}")
-            print(f"  Data: {issue_date}")
-            print(f"  ID: {invoice_id}")
+        # Download in parallel; results come back in listing order
+        rows = [{
+            'id': inv.get('id'),
+            'supplier': inv.get('supplier', 'UNKNOWN'),
+            'invoice_no': inv.get('invoice_no', 'NO_NUM'),
+            'issue_date': inv.get('issue_date', ''),
+        } for inv in invoices]
+        rate = 1.0 / delay_between_downloads if delay_between_downloads else None
+        os.makedirs(output_dir, exist_ok=True)
+        with SyncManifest.for_dir(output_dir) as manifest, DownloadEngine(session, rate=rate) as engine:
+            known = manifest.known([row['id'] for row in rows])
+            jobs = []
+            for row in rows:
+                entry = known.get(row['id'])
+                action = SyncManifest.action(entry, full)
+                future = None if action == 'final' else engine.submit_sync(row, entry if action == 'check' else None)
+                jobs.append((row, entry, future))
             
-            try:
-                # Download XML
-                xml_content = download_invoice_xml(session, invoice_id)
-                
-                # Save to file (pass invoice_id for unique filename)
-                file_path = save_xml_to_staging(
-                    xml_content, 
-                    output_dir, 
-                    supplier, 
-                    invoice_no, 
-                    issue_date,
-                    invoice_id
-                )
+            for idx, (row, entry, future) in enumerate(jobs, 1):
+                invoice_id = row['id']
+                invoice_no = row['invoice_no']
                 
-                results['downloaded'] += 1
-                results['paths'].append(file_path)
+                print(f"\n[{idx}/{len(invoices)}] Faktura: {invoice_no}")
+                print(f"  Furnitori: {row['supplier']}")
+                print(f"  Data: {row['issue_date']}")
+                print(f"  ID: {invoice_id}")
                 
-                print(f"  ✓ Shkarkuar: {os.path.basename(file_path)}")
-                
-                # Delay to avoid rate limiting
-                if delay_between_downloads > 0 and idx < len(invoices):
-                    time.sleep(delay_between_downloads)
+                if future is None:
+                    results['unchanged'] += 1
+                    print(f"  = Pa ndryshime ({entry['status']})")
+                    continue
+                try:
+                    state, xml_content = future.result()
+                    if xml_content is None or (entry is not None and content_sha1(xml_content) == entry['sha1']):
+                        manifest.record(invoice_id, state=state)
+                        results['unchanged'] += 1
+                        print(f"  = Pa ndryshime ({(state or {}).get('status')})")
+                        continue
+                    
+                    # Save to file (pass invoice_id for unique filename)
+                    file_path = save_xml_to_staging(
+                        xml_content, 
+                        output_dir, 
+                        row['supplier'], 
+                        invoice_no, 
+                        row['issue_date'],
+                        invoice_id
+                    )
+                    manifest.record(invoice_id, sha1=content_sha1(xml_content), path=file_path, state=state)
                     
-            except Exception as e:
-                results['failed'] += 1
-                error_msg = f"Invoice {invoice_no} (ID: {invoice_id}): {str(e)}"
-                results['errors'].append(error_msg)
-                print(f"  ❌ Gabim: {str(e)}")
+                    results['downloaded'] += 1
+                    results['paths'].append(file_path)
+                    print(f"  ✓ Shkarkuar: {os.path.basename(file_path)}" + (" (ndryshuar)" if entry else ""))
+                    
+                except Exception as e:
+                    results['failed'] += 1
+                    error_msg = f"Invoice {invoice_no} (ID: {invoice_id}): {str(e)}"
+                    results['errors'].append(error_msg)
+                    print(f"  ❌ Gabim: {str(e)}")
+        results['http'] = engine.stats.as_dict()
         
         print("\n" + "=" * 80)
         print("📊 PËRMBLEDHJE:")
         print(f"  Total faktura: {results['total']}")
         print(f"  ✓ Shkarkuar me sukses: {results['downloaded']}")
+        print(f"  = Pa ndryshime: {results['unchanged']}")
         print(f"  ❌ Dështuan: {results['failed']}")
         
         if results['errors']:
@@ -206,9 +236,11 @@ def auto_import_invoices(xml_paths, dry_run=False):
         from app.faktura_import import (
             parse_invoice_xml,
             insert_kalkulacija,
+            ArticleResolver,
             MP_CONFIG,
             DB_DEFAULTS
         )
+        from app.import_pipeline import run_import_pipeline
         import psycopg2
     except ImportError as e:
         print(f"❌ Nuk mund të importoj modület e nevojshëm: {e}")
@@ -238,52 +270,59 @@ def auto_import_invoices(xml_paths, dry_run=False):
         stats['errors'].append(str(e))
         return stats
     
-    # Process each XML
-    for idx, xml_path in enumerate(xml_paths, 1):
-        print(f"\n[{idx}/{len(xml_paths)}] Importimi i: {os.path.basename(xml_path)}")
-        
-        try:
-            # Parse XML
-            header, items = parse_invoice_xml(xml_path)
-            
-            print(f"  Faktura: {header['broj_faktura']}")
-            print(f"  Furnitori: {header['dobavljac']}")
-            print(f"  Data: {header['datum']}")
-            print(f"  Artikuj: {len(items)}")
-            print(f"  Total neto: {header['total_neto']}")
-            
-            # Get remote write permission from env
-            allow_remote = os.getenv('WPH_WRITE_REMOTE', '0') == '1'
-            
-            # Insert kalkulacija
-            kalk_id = insert_kalkulacija(
-                conn, 
-                header, 
-                items, 
-                MP_CONFIG,
-                dokvrsta='20',
-                magacin='101',
-                komintent='1',  # Will be auto-resolved from dobavljac
-                periodid=4,
-                userid=14,
-                dry_run=dry_run,
-                allow_remote_write=allow_remote
-            )
-            
-            if kalk_id:
-                stats['imported'] += 1
-                print(f"  ✓ Importuar me sukses (kalkid={kalk_id})")
-            else:
-                stats['skipped'] += 1
-                print(f"  ⚠️  Kalkulacija nuk u krijua (ndoshta ekziston)")
-                
-        except Exception as e:
+    # One artikal index for the whole batch (loaded by the first insert_kalkulacija)
+    resolver = ArticleResolver()
+    
+    # Get remote write permission from env
+    allow_remote = os.getenv('WPH_WRITE_REMOTE', '0') == '1'
+    positions = {path: idx for idx, path in enumerate(xml_paths, 1)}
+    
+    def show(xml_path, header, items):
+        print(f"\n[{positions[xml_path]}/{len(xml_paths)}] Importimi i: {os.path.basename(xml_path)}")
+        print(f"  Faktura: {header['broj_faktura']}")
+        print(f"  Furnitori: {header['dobavljac']}")
+        print(f"  Data: {header['datum']}")
+        print(f"  Artikuj: {len(items)}")
+        print(f"  Total neto: {header['total_neto']}")
+        return None
+    
+    def insert(header, items, commit):
+        # Insert kalkulacija
+        return insert_kalkulacija(
+            conn, 
+            header, 
+            items, 
+            MP_CONFIG,
+            dokvrsta='20',
+            magacin='101',
+            komintent='1',  # Will be auto-resolved from dobavljac
+            periodid=4,
+            userid=14,
+            dry_run=dry_run,
+            allow_remote_write=allow_remote,
+            resolver=resolver,
+            commit=commit
+        )
+    
+    # Parse in parallel, write in order (see import_pipeline.py)
+    results, metrics = run_import_pipeline(
+        xml_paths, parse_invoice_xml, insert,
+        conn=conn, resolver=resolver, prepare=show, dry_run=dry_run
+    )
+    stats['pipeline'] = metrics.as_dict()
+    
+    for r in results:
+        name = os.path.basename(r['path'])
+        if r['kalk_id']:
+            stats['imported'] += 1
+            print(f"  ✓ {name}: Importuar me sukses (kalkid={r['kalk_id']})")
+        elif r['status'] in ('parse_failed', 'failed'):
             stats['failed'] += 1
-            error_msg = f"{os.path.basename(xml_path)}: {str(e)}"
-            stats['errors'].append(error_msg)
-            print(f"  ❌ Gabim: {e}")
-            import traceback
-            traceback.print_exc()
+            stats['errors'].append(f"{name}: {r['error']}")
+            print(f"  ❌ {name}: Gabim: {r['error']}")
+        else:
+            stats['skipped'] += 1
+            print(f"  ⚠️  {name}: Kalkulacija nuk u krijua (ndoshta ekziston)")
     
     # Close connection
     conn.close()
@@ -325,6 +364,10 @@ VARIABLAT E MJEDISIT:
   WPH_EFAKT_API_KEY        - API key për eFaktura (e detyrueshme)
   WPH_EFAKT_LIST_URL       - URL për listën e fakturave
   WPH_EFAKT_GET_XML_URL    - URL për shkarkimin e XML
+  WPH_EFAKT_WORKERS        - Shkarkime paralele (default: 4)
+  WPH_EFAKT_RATE           - Kufiri i kërkesave në sekondë (default: 3)
+  WPH_SYNC_SETTLE_DAYS     - Pas sa ditësh një ditë konsiderohet e mbyllur (default: 30)
+  WPH_SYNC_FINAL_STATUSES  - Statuset që nuk kontrollohen më (default: Approved,Rejected,Cancelled,Storno)
   WPH_DB_NAME              - Emri i bazës së të dhënave (default: wph_ai)
   WPH_DB_USER              - Përdoruesi i DB (default: postgres)
   WPH_DB_PASS              - Fjalëkalimi i DB
@@ -370,8 +413,14 @@ VARIABLAT E MJEDISIT:
     parser.add_argument(
         '--delay',
         type=float,
-        default=0.5,
-        help='Delay në sekonda midis shkarkimeve (default: 0.5)'
+        default=None,
+        help='Intervali minimal në sekonda midis kërkesave (default: WPH_EFAKT_RATE, 3 kërkesa/s)'
+    )
+    
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Injoro manifestin e sinkronizimit dhe kontrollo çdo faturë'
     )
     
     args = parser.parse_args()
@@ -415,7 +464,8 @@ VARIABLAT E MJEDISIT:
         args.date_from,
         args.date_to,
         args.output_dir,
-        args.delay
+        args.delay,
+        args.full
     )
     
     # Auto-import if requested
@@ -6,7 +6,8 @@ Përdorimi:
   python fetch_all_sales_invoices.py --from 2025-11-01 --to 2025-11-18 --status Approved --download-xml
 
 Kufizime:
-  - Endpoint /sales-invoice/ids kthen MAX 50 ID
+  - Endpoint /sales-invoice/ids kthen MAX 50 ID për thirrje; list_sales_invoice_ids e ndan
+    periudhën automatikisht në dritare më të vogla (list_windows)
   - Nëse lista bosh: nuk ka faktura të shitjes në periudhë
 """
 import os, sys
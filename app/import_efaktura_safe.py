@@ -24,6 +24,8 @@ def check_duplicate_invoice(conn, broj_faktura, dobavljac, datum):
         tuple: (exists: bool, kalkid: int or None, details: str)
     """
     cursor = conn.cursor()
+    # Runs inside the import batch transaction: a missing schema must not abort it
+    savepoint = not conn.autocommit
     
     # Try multiple schemas (FDW ebdata, public, local tables)
     schemas_to_check = ['ebdata', 'public']
@@ -40,8 +42,12 @@ def check_duplicate_invoice(conn, broj_faktura, dobavljac, datum):
         """
         
         try:
+            if savepoint:
+                cursor.execute("SAVEPOINT duplicate_check")
             cursor.execute(query, (broj_faktura, f"%{dobavljac}%", datum))
             row = cursor.fetchone()
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT duplicate_check")
             
             if row:
                 kalkid, total, stavki, datum_unosa = row
@@ -50,6 +56,8 @@ def check_duplicate_invoice(conn, broj_faktura, dobavljac, datum):
                 return (True, kalkid, details)
         except Exception:
             # Schema or table doesn't exist, try next
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT duplicate_check")
             continue
     
     cursor.close()
@@ -75,10 +83,12 @@ def import_invoices_safe(xml_dir, conn_params, force=False, dry_run=False):
     
     # Import required modules
     try:
-        from faktura_import import parse_invoice_xml, insert_kalkulacija, MP_CONFIG
+        from faktura_import import parse_invoice_xml, insert_kalkulacija, MP_CONFIG, ArticleResolver
+        from import_pipeline import run_import_pipeline
     except ImportError:
         try:
-            from app.faktura_import import parse_invoice_xml, insert_kalkulacija, MP_CONFIG
+            from app.faktura_import import parse_invoice_xml, insert_kalkulacija, MP_CONFIG, ArticleResolver
+            from app.import_pipeline import run_import_pipeline
         except ImportError:
             print("❌ Cannot import faktura_import module!")
             return
@@ -108,66 +118,77 @@ def import_invoices_safe(xml_dir, conn_params, force=False, dry_run=False):
         'errors': []
     }
     
-    # Process each XML
-    for idx, xml_file in enumerate(xml_files, 1):
-        xml_path = os.path.join(xml_dir, xml_file)
-        print(f"[{idx}/{len(xml_files)}] {xml_file}")
+    # One artikal index for the whole batch (loaded by the first insert_kalkulacija)
+    resolver = ArticleResolver()
+    
+    positions = {os.path.join(xml_dir, f): idx for idx, f in enumerate(xml_files, 1)}
+    
+    def check(xml_path, header, items):
+        print(f"[{positions[xml_path]}/{len(xml_files)}] {os.path.basename(xml_path)}")
         
-        try:
-            # Parse XML
-            header, items = parse_invoice_xml(xml_path)
-            
-            broj = header.get('broj_faktura', 'N/A')
-            dobavljac = header.get('dobavljac', 'N/A')
-            datum = header.get('datum', 'N/A')
-            total = header.get('total_neto', 0)
-            
-            print(f"  📄 {broj} | {dobavljac} | {datum} | {total:.2f} RSD")
-            print(f"  📦 {len(items)} artikuj")
-            
-            # Check for duplicate
-            exists, kalkid, details = check_duplicate_invoice(conn, broj, dobavljac, datum)
-            
-            if exists:
-                print(f"  ⚠️  DUPLIKAT! {details}")
-                
-                if not force:
-                    stats['skipped_duplicate'] += 1
-                    print(f"  ⊙ Anashkaluar (use --force për të importuar)")
-                    continue
-                else:
-                    print(f"  ⚡ FORCE MODE - do të importoj përsëri!")
+        broj = header.get('broj_faktura', 'N/A')
+        dobavljac = header.get('dobavljac', 'N/A')
+        datum = header.get('datum', 'N/A')
+        total = header.get('total_neto', 0)
+        
+        print(f"  📄 {broj} | {dobavljac} | {datum} | {total:.2f} RSD")
+        print(f"  📦 {len(items)} artikuj")
+        
+        # Check for duplicate (sees invoices already written in the open batch)
+        exists, kalkid, details = check_duplicate_invoice(conn, broj, dobavljac, datum)
+        
+        if exists:
+            print(f"  ⚠️  DUPLIKAT! {details}")
             
-            # Import
-            if dry_run:
-                print(f"  🔍 DRY-RUN: Do të importohej")
-                stats['imported'] += 1
+            if not force:
+                print(f"  ⊙ Anashkaluar (use --force për të importuar)")
+                return 'skipped_duplicate'
             else:
-                kalk_id = insert_kalkulacija(
-                    conn,
-                    header,
-                    items,
-                    MP_CONFIG,
-                    dokvrsta='20',
-                    magacin='101',
-                    periodid=4,
-                    userid=14,
-                    dry_run=False,
-                    allow_remote_write=True
-                )
-                
-                if kalk_id:
-                    stats['imported'] += 1
-                    print(f"  ✓ IMPORTUAR (KalkID={kalk_id})")
-                else:
-                    stats['skipped_duplicate'] += 1
-                    print(f"  ⊙ Anashkaluar (insert_kalkulacija returned None)")
+                print(f"  ⚡ FORCE MODE - do të importoj përsëri!")
         
-        except Exception as e:
+        if dry_run:
+            print(f"  🔍 DRY-RUN: Do të importohej")
+            return 'dry_run'
+        return None
+    
+    def insert(header, items, commit):
+        kalk_id = insert_kalkulacija(
+            conn,
+            header,
+            items,
+            MP_CONFIG,
+            dokvrsta='20',
+            magacin='101',
+            periodid=4,
+            userid=14,
+            dry_run=False,
+            allow_remote_write=True,
+            resolver=resolver,
+            commit=commit
+        )
+        if kalk_id:
+            print(f"  ✓ IMPORTUAR (KalkID={kalk_id})")
+        else:
+            print(f"  ⊙ Anashkaluar (insert_kalkulacija returned None)")
+        return kalk_id
+    
+    # Parse in parallel, check + write in order (see import_pipeline.py)
+    results, metrics = run_import_pipeline(
+        [os.path.join(xml_dir, f) for f in xml_files], parse_invoice_xml, insert,
+        conn=conn, resolver=resolver, prepare=check
+    )
+    stats['pipeline'] = metrics.as_dict()
+    
+    for r in results:
+        if r['status'] in ('imported', 'dry_run'):
+            stats['imported'] += 1
+        elif r['status'] in ('skipped_duplicate', 'no_kalk'):
+            stats['skipped_duplicate'] += 1
+        else:
             stats['failed'] += 1
-            error_msg = f"{xml_file}: {str(e)}"
-            stats['errors'].append(error_msg)
-            print(f"  ❌ ERROR: {e}")
+            stats['errors'].append(f"{os.path.basename(r['path'])}: {r['error']}")
+            if r['status'] == 'parse_failed':
+                print(f"  ❌ ERROR: {os.path.basename(r['path'])}: {r['error']}")
     
     # Summary
     print("\n" + "=" * 80)
@@ -0,0 +1,214 @@
+# file: app/import_pipeline.py - Staged bulk invoice import
+"""
+Bulk imports used to run one XML at a time: parse, match, price, write,
+commit. run_import_pipeline splits that into stages:
+
+  parse   process pool (WPH_IMPORT_WORKERS) parses the XMLs in parallel
+  queue   a bounded window (WPH_IMPORT_WINDOW) of parsed invoices, consumed in input order
+  write   this process: artikal matching (shared ArticleResolver, in memory), pricing
+          and the ERP inserts, WPH_IMPORT_BATCH invoices per transaction
+
+Matching and pricing stay in the writer on purpose. An invoice's MP/RUC
+depends on the price history written by earlier invoices, and artikli
+auto-created by one invoice must be found by the next. Both only hold when
+invoices are written in order. Within a batch each invoice runs in its own
+SAVEPOINT (insert_kalkulacija(commit=False)), so a bad invoice does not take
+the rest of the batch down.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+IMPORT_WORKERS = int(os.getenv('WPH_IMPORT_WORKERS', '0')) or max(1, (os.cpu_count() or 2) - 1)
+IMPORT_BATCH = max(1, int(os.getenv('WPH_IMPORT_BATCH', '10')))
+IMPORT_WINDOW = int(os.getenv('WPH_IMPORT_WINDOW', '0'))
+
+
+def _parse_job(parse, xml_path):
+    """Worker side: (header, items, error, seconds); errors are returned so results stay in order"""
+    start = time.monotonic()
+    try:
+        header, items = parse(xml_path)
+        return header, items, None, time.monotonic() - start
+    except Exception as e:
+        return None, None, f"{type(e).__name__}: {e}", time.monotonic() - start
+
+
+class _InlineFuture:
+    def __init__(self, value):
+        self._value = value
+
+    def done(self):
+        return True
+
+    def result(self):
+        return self._value
+
+
+class PipelineMetrics:
+    def __init__(self, workers, batch_size):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.started = time.monotonic()
+        self.parsed = 0
+        self.parse_errors = 0
+        self.parse_s = 0.0      # summed worker time
+        self.written = 0
+        self.write_errors = 0
+        self.skipped = 0
+        self.write_s = 0.0
+        self.batches = 0
+        self.commit_s = 0.0
+        self.writer_wait_s = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.depth_max = 0
+
+    def sample_depth(self, window):
+        depth = sum(1 for f in window if f.done())
+        self.depth_samples += 1
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def as_dict(self):
+        wall = time.monotonic() - self.started
+        return {
+            'wall_s': round(wall, 2),
+            'parse': {'workers': self.workers, 'count': self.parsed, 'errors': self.parse_errors,
+                      'busy_s': round(self.parse_s, 2), 'per_s': round(self.parsed / wall, 2) if wall else None},
+            'write': {'count': self.written, 'errors': self.write_errors, 'skipped': self.skipped,
+                      'batches': self.batches, 'batch_size': self.batch_size,
+                      'busy_s': round(self.write_s + self.commit_s, 2), 'idle_s': round(self.writer_wait_s, 2),
+                      'per_s': round(self.written / wall, 2) if wall else None},
+            'queue_depth': {'avg': round(self.depth_total / self.depth_samples, 2) if self.depth_samples else 0,
+                            'max': self.depth_max},
+        }
+
+    def summary(self):
+        m = self.as_dict()
+        return (f"Pipeline {m['wall_s']}s | parse {m['parse']['count']} ({m['parse']['workers']} workers, "
+                f"{m['parse']['per_s']}/s, {m['parse']['errors']} errors) | write {m['write']['count']} in "
+                f"{m['write']['batches']} batches ({m['write']['per_s']}/s, idle {m['write']['idle_s']}s) | "
+                f"queue depth avg {m['queue_depth']['avg']} max {m['queue_depth']['max']}")
+
+
+def run_import_pipeline(xml_paths, parse, insert, *, conn, resolver=None, prepare=None,
+                        workers=None, batch_size=None, window=None, dry_run=False):
+    """Parse xml_paths in a process pool and write them in order.
+
+    parse: picklable module-level callable(xml_path) -> (header, items)
+    insert: callable(header, items, commit) -> kalk_id; normally insert_kalkulacija bound to
+            conn/options with commit passed through (None means the invoice failed)
+    prepare: optional callable(xml_path, header, items) run in the writer before insert;
+             return None to import or a status string to skip the invoice with (e.g. duplicate)
+    dry_run: every invoice commits/rolls back on its own (insert_kalkulacija's dry-run mode)
+
+    Returns (results, metrics): results are dicts {path, status, kalk_id, error, header, items}
+    in input order, status in 'imported' | 'no_kalk' (insert returned None) | 'failed' |
+    'parse_failed' | <prepare status>.
+    """
+    paths = list(xml_paths)
+    workers = max(1, workers or IMPORT_WORKERS)
+    batch_size = 1 if dry_run else max(1, batch_size or IMPORT_BATCH)
+    window_size = window or IMPORT_WINDOW or workers * 4
+    metrics = PipelineMetrics(workers if len(paths) > 1 else 1, batch_size)
+    results = []
+    pending = []  # written in the open batch, final once committed
+
+    def flush():
+        if not pending:
+            return
+        start = time.monotonic()
+        try:
+            conn.commit()
+            if resolver is not None:
+                resolver.commit()
+        except Exception as e:
+            conn.rollback()
+            if resolver is not None:
+                resolver.rollback()
+            for r in pending:
+                r['status'], r['error'] = 'failed', f"batch commit failed: {e}"
+                metrics.written -= 1
+                metrics.write_errors += 1
+        metrics.commit_s += time.monotonic() - start
+        metrics.batches += 1
+        pending.clear()
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(paths) > 1 else None
+    try:
+        queue = deque()
+        todo = iter(paths)
+
+        def fill():
+            while len(queue) < window_size:
+                path = next(todo, None)
+                if path is None:
+                    return
+                future = pool.submit(_parse_job, parse, path) if pool else _InlineFuture(_parse_job(parse, path))
+                queue.append((path, future))
+
+        fill()
+        while queue:
+            metrics.sample_depth([f for _, f in queue])
+            path, future = queue.popleft()
+            wait_start = time.monotonic()
+            header, items, error, parse_s = future.result()
+            metrics.writer_wait_s += time.monotonic() - wait_start
+            fill()
+
+            metrics.parsed += 1
+            metrics.parse_s += parse_s
+            result = {'path': path, 'status': None, 'kalk_id': None, 'error': error, 'header': header, 'items': items}
+            results.append(result)
+            if error:
+                metrics.parse_errors += 1
+                result['status'] = 'parse_failed'
+                continue
+
+            if prepare is not None:
+                skip = prepare(path, header, items)
+                if skip:
+                    metrics.skipped += 1
+                    result['status'] = skip
+                    continue
+
+            start = time.monotonic()
+            try:
+                kalk_id = insert(header, items, batch_size == 1)
+            except Exception as e:
+                # insert_kalkulacija only raises here when its savepoint could not be rolled back: drop the batch
+                kalk_id = None
+                result['error'] = str(e)
+                conn.rollback()
+                if resolver is not None:
+                    resolver.rollback()
+                for r in pending:
+                    r['status'], r['error'] = 'failed', f"batch rolled back: {e}"
+                    metrics.written -= 1
+                    metrics.write_errors += 1
+                pending.clear()
+            metrics.write_s += time.monotonic() - start
+
+            if kalk_id is None and not dry_run:
+                # insert_kalkulacija printed the reason and rolled this invoice back
+                metrics.write_errors += 1
+                result['status'] = 'failed' if result['error'] else 'no_kalk'
+                continue
+            metrics.written += 1
+            result['status'] = 'imported'
+            result['kalk_id'] = kalk_id
+            if batch_size > 1:
+                pending.append(result)
+                if len(pending) >= batch_size:
+                    flush()
+            else:
+                metrics.batches += 1
+        flush()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    print(metrics.summary())
+    return results, metrics
@@ -0,0 +1,342 @@
+# file: app/invoice_xml.py - Streaming invoice XML parser
+"""
+The invoice parsers (faktura_import.parse_invoice_xml, sopharma_to_erp,
+faktura_ai_mvp) loaded the whole document with ET.parse and then ran a
+'.//...' search over the full tree for every header field, plus several per
+line ('.//Stavke/Stavka' or './/Stavka' walked the tree twice).
+
+scan() reads the file once with iterparse (lxml when installed, else
+xml.etree). Paths are compiled once per document format into tuples of
+namespace-qualified tags and indexed by their last tag, so an element is
+only tested against the paths that can end on it. Each record element (an
+invoice line) and each top-level block is cleared and detached once its
+end event has been handled, so memory stays flat on large UBL files.
+
+Result semantics follow ElementPath find()/findtext(): per path, the text of
+the first matching element (None if it has no text), in document order.
+"""
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+try:
+    from lxml import etree as _lxml
+except ImportError:  # optional fast path
+    _lxml = None
+
+UBL_NS = {
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+}
+UBL_DOCUMENTS = (
+    '{urn:oasis:names:specification:ubl:schema:xsd:Invoice-2}',
+    '{urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2}',
+)
+
+CHILD, DESC = '/', '//'
+
+
+def compile_path(path, namespaces=UBL_NS):
+    """'.//cac:A//cbc:B/C' -> ((DESC, '{uri}A'), (DESC, '{uri}B'), (CHILD, 'C'));
+    the axis of a step relates it to the previous step (the context for the first).
+    Raises KeyError for a prefix not in namespaces."""
+    if path.startswith('.//'):
+        axis, rest = DESC, path[3:]
+    elif path.startswith('./'):
+        axis, rest = CHILD, path[2:]
+    else:
+        axis, rest = CHILD, path
+    steps = []
+    for part in rest.split('/'):
+        if not part:
+            axis = DESC
+            continue
+        if ':' in part:
+            prefix, local = part.split(':', 1)
+            part = f"{{{namespaces[prefix]}}}{local}"
+        steps.append((axis, part))
+        axis = CHILD
+    return tuple(steps)
+
+
+def path_matches(steps, tags, start):
+    """True if the element tags[-1] matches steps relative to the context element tags[start - 1]"""
+    if len(tags) - start < len(steps):
+        return False
+
+    def match(si, ti):
+        axis, tag = steps[si]
+        if tags[ti] != tag:
+            return False
+        if si == 0:
+            return ti == start or axis == DESC
+        if axis == CHILD:
+            return ti - 1 >= start and match(si - 1, ti - 1)
+        return any(match(si - 1, j) for j in range(ti - 1, start - 1, -1))
+
+    return match(len(steps) - 1, len(tags) - 1)
+
+
+def matcher(steps):
+    """path_matches(steps, ...) specialised for the common shapes './a/b' and './/a/b'"""
+    n = len(steps)
+    chain = [tag for _, tag in steps]
+    if all(axis == CHILD for axis, _ in steps[1:]):
+        if steps[0][0] == CHILD:
+            return lambda tags, start: len(tags) - start == n and tags[-n:] == chain
+        return lambda tags, start: len(tags) - start >= n and tags[-n:] == chain
+    return lambda tags, start: path_matches(steps, tags, start)
+
+
+class Section:
+    """Records taken from the elements matching select (None = the root element):
+    for each field, the text of the first element matching its path relative to the record element"""
+
+    def __init__(self, name, select, fields, namespaces=UBL_NS, limit=None):
+        self.name = name
+        self.select = compile_path(select, namespaces) if select else None
+        self.limit = limit
+        self.fields = []  # [(field, steps)]
+        for field, path in fields.items():
+            try:
+                self.fields.append((field, compile_path(path, namespaces)))
+            except KeyError:
+                continue  # prefix not declared for this document: the path cannot match
+
+
+class ScanPlan:
+    """Sections compiled into tag-indexed matchers; build once per document format"""
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.root_sections = [s for s in sections if s.select is None]
+        self.selects = {}  # last tag of select -> [(section, matcher)]
+        self.fields = {}   # last tag of a field path -> [(section, field, matcher)]
+        for s in sections:
+            if s.select is not None:
+                self.selects.setdefault(s.select[-1][1], []).append((s, matcher(s.select)))
+            for field, steps in s.fields:
+                self.fields.setdefault(steps[-1][1], []).append((s, field, matcher(steps)))
+
+
+def _iterparse(xml_path):
+    if _lxml is not None:
+        return _lxml.iterparse(xml_path, events=('start', 'end'), huge_tree=True,
+                               resolve_entities=False, no_network=True)
+    return ET.iterparse(xml_path, events=('start', 'end'))
+
+
+def scan(xml_path, plan_for_root):
+    """Stream xml_path once. plan_for_root(root_tag) -> ScanPlan (sniffs the format from the root).
+    Returns (root_tag, {section name: [record dict]}) with records in document order."""
+    tags, elems = [], []
+    root_tag, out, plan = None, None, None
+    open_records = {}  # section name -> [(depth, record)] of open record elements
+    closing = []       # depths of open record elements, cleared at their end
+    for event, elem in _iterparse(xml_path):
+        if event == 'start':
+            tags.append(elem.tag)
+            elems.append(elem)
+            if plan is None:
+                root_tag = elem.tag
+                plan = plan_for_root(root_tag)
+                out = {s.name: [] for s in plan.sections}
+                open_records = {s.name: [] for s in plan.sections}
+                for s in plan.root_sections:
+                    record = {}
+                    out[s.name].append(record)
+                    open_records[s.name].append((0, record))
+                continue
+            selected = plan.selects.get(elem.tag)
+            if selected:
+                depth = len(tags) - 1
+                for s, matches in selected:
+                    records = out[s.name]
+                    if (s.limit is None or len(records) < s.limit) and matches(tags, 1):
+                        record = {}
+                        records.append(record)
+                        open_records[s.name].append((depth, record))
+                        if not closing or closing[-1] != depth:
+                            closing.append(depth)
+            continue
+
+        depth = len(tags) - 1
+        wanted = plan.fields.get(elem.tag)
+        if wanted:
+            for s, field, matches in wanted:
+                for ctx_depth, record in open_records[s.name]:
+                    if ctx_depth < depth and field not in record and matches(tags, ctx_depth + 1):
+                        record[field] = elem.text
+        if depth == 1 or (closing and closing[-1] == depth):
+            if closing and closing[-1] == depth:
+                closing.pop()
+                for records in open_records.values():
+                    while records and records[-1][0] == depth:
+                        records.pop()
+            # Record done (or a top-level block): free its subtree
+            elem.clear()
+            elems[-2].remove(elem)
+        tags.pop()
+        elems.pop()
+    return root_tag, out
+
+
+# --- faktura_import / sopharma_to_erp format --------------------------------
+
+STAVKA_FIELDS = {f: f for f in ('Sifra', 'GTIN', 'Naziv', 'BrojSerije', 'RokUpotrebe',
+                                'Kolicina', 'CenaFakturna', 'RabatProcenat', 'PorezProcenat')}
+UBL_LINE_FIELDS = {
+    'qty': './cbc:InvoicedQuantity',
+    'price': './cac:Price/cbc:PriceAmount',
+    'disc_pct': './cac:AllowanceCharge/cbc:MultiplierFactorNumeric',
+    'pdv_item': './cac:Item/cac:ClassifiedTaxCategory/cbc:Percent',
+    'pdv_tax': './cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent',
+    'supplier_id': './cac:Item/cac:SellersItemIdentification/cbc:ID',
+    'gtin': './cac:Item/cac:StandardItemIdentification/cbc:ID',
+    'name': './cac:Item/cbc:Name',
+}
+VENDOR_HEADER = {
+    'valuta': './/Valutacije/Valutacija/Datum',
+    'popust': './/Valutacije/Valutacija/Popust',
+    'vrednost': './/Valutacije/Valutacija/Vrednost',
+    'dobavljac': './/Dobavljac/Naziv',
+    'total_neto': './/Vrednosti/NetoFakturna',
+}
+UBL_HEADER = {
+    'due_date': './/cbc:DueDate',
+    'id': './/cbc:ID',
+    'issue_date': './/cbc:IssueDate',
+    'registration_name': './/cac:AccountingSupplierParty//cbc:RegistrationName',
+    'tax_exclusive': './/cbc:TaxExclusiveAmount',
+}
+
+
+def _invoice_plan(vendor, ubl):
+    header, sections = {}, []
+    if vendor:
+        header.update(VENDOR_HEADER)
+        sections += [
+            Section('dokument', './/Dokument', {'broj': 'Broj', 'datum': 'Datum'}, limit=1),
+            Section('stavke_stavka', './/Stavke/Stavka', STAVKA_FIELDS),
+            Section('stavka', './/Stavka', STAVKA_FIELDS),
+        ]
+    if ubl:
+        header.update(UBL_HEADER)
+        sections.append(Section('invoice_line', './/cac:InvoiceLine', UBL_LINE_FIELDS))
+    return ScanPlan([Section('header', None, header)] + sections)
+
+
+_INVOICE_PLANS = {
+    'ubl': _invoice_plan(vendor=False, ubl=True),
+    'any': _invoice_plan(vendor=True, ubl=True),
+}
+
+
+def invoice_format(root_tag):
+    """'ubl' for UBL Invoice/CreditNote roots; anything else (Sopharma, envelopes) is scanned for both formats"""
+    return 'ubl' if root_tag.startswith(UBL_DOCUMENTS) else 'any'
+
+
+def D(val, default='0'):
+    if val is None:
+        return Decimal(default)
+    s = str(val).strip().replace(',', '.')
+    if not s:
+        return Decimal(default)
+    try:
+        return Decimal(s)
+    except (InvalidOperation, ValueError):
+        return Decimal(default)
+
+
+def _first(record, *fields):
+    """Text of the first field present in record, like 'node = find(a); if node is None: node = find(b)'"""
+    for field in fields:
+        if field in record:
+            return record[field]
+    return None
+
+
+def _text(record, field):
+    """findtext() or '': missing element and element without text both give ''"""
+    return record.get(field) or ''
+
+
+def parse_invoice(xml_path):
+    """(header, items) for Sopharma vendor XML or UBL eFaktura, in faktura_import's structure"""
+    _, found = scan(xml_path, lambda tag: _INVOICE_PLANS[invoice_format(tag)])
+    head = found['header'][0]
+    dok = (found.get('dokument') or [{}])[0]
+
+    # Valuta datum - podržava oba Sopharma i UBL (eFaktura.rs) format
+    valuta_text = _first(head, 'valuta', 'due_date')
+    valuta_dt = datetime.strptime(valuta_text, '%Y-%m-%d') if valuta_text else None
+    cash_discount = D(head.get('popust'), '0')
+    payable_amount = D(head.get('vrednost'), '0')
+
+    # Broj/Datum: children of the first <Dokument>, else UBL cbc:ID / cbc:IssueDate
+    broj_text = dok['broj'] if 'broj' in dok else head.get('id')
+    broj_faktura = broj_text.strip() if broj_text else ''
+    datum_text = dok['datum'] if 'datum' in dok else head.get('issue_date')
+    datum = datetime.strptime(datum_text, '%Y-%m-%d') if datum_text else datetime.now()
+
+    dobavljac_text = _first(head, 'dobavljac', 'registration_name')
+    dobavljac = dobavljac_text.strip() if dobavljac_text else ''
+
+    total_text = _first(head, 'total_neto', 'tax_exclusive')
+    total_neto = D(total_text, '0') if total_text else D('0')
+
+    header = {
+        'broj_faktura': broj_faktura,
+        'datum': datum,
+        'dobavljac': dobavljac,
+        'total_neto': total_neto,
+        'valuta_datum': valuta_dt,
+        'cash_discount': cash_discount,
+        'payable_amount': payable_amount,
+    }
+
+    items = []
+    # Try legacy vendor format first
+    stavke = found.get('stavke_stavka') or found.get('stavka')
+    if stavke:
+        print(f'Parsed items: {len(stavke)} (legacy vendor format)')
+        for stavka in stavke:
+            serija = _text(stavka, 'BrojSerije').strip()
+            rok = _text(stavka, 'RokUpotrebe').strip()
+            if serija in ('0', '0000', 'None', ''):
+                serija = None
+            if rok in ('0', '0000-00-00', 'None', ''):
+                rok_dt = None
+            else:
+                rok_dt = datetime.strptime(rok, '%Y-%m-%d')
+
+            items.append({
+                'sifra': _text(stavka, 'Sifra').strip(),
+                'barcode': _text(stavka, 'GTIN').strip() or None,
+                'naziv': _text(stavka, 'Naziv').strip(),
+                'kolicina': D(stavka.get('Kolicina'), '0'),
+                'cena_fakturna': D(stavka.get('CenaFakturna'), '0'),
+                'rabat_pct': D(stavka.get('RabatProcenat'), '0'),
+                'serija': serija,
+                'rok_dt': rok_dt,
+                'pdv_pct': float(D(_text(stavka, 'PorezProcenat').strip(), '10.0')),
+            })
+    else:
+        # Fallback to UBL eFaktura format
+        inv_lines = found.get('invoice_line') or []
+        print(f'Parsed items: {len(inv_lines)} (UBL format)')
+        for il in inv_lines:
+            items.append({
+                'sifra': _text(il, 'supplier_id').strip(),
+                'barcode': _text(il, 'gtin').strip() or None,
+                'naziv': _text(il, 'name').strip(),
+                'kolicina': D(il.get('qty'), '0'),
+                'cena_fakturna': D(il.get('price'), '0'),
+                'rabat_pct': D(il.get('disc_pct'), '0'),
+                'serija': None,
+                'rok_dt': None,
+                'pdv_pct': float(D(il.get('pdv_item') or il.get('pdv_tax') or '10', '10.0')),
+            })
+
+    return header, items
@@ -6,11 +6,14 @@ import argparse
 from getpass import getpass
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
-import xml.etree.ElementTree as ET
 import psycopg2
 
 # Ensure local app path import
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'app'))
+try:
+    from invoice_xml import parse_invoice
+except ImportError:
+    from app.invoice_xml import parse_invoice
 
 # Defaults can be overridden via env or CLI flags
 def env_or(name, default=None):
@@ -53,125 +56,8 @@ def D(val, default='0'):
         return Decimal(default)
 
 def parse_sopharma_xml(xml_path):
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
-    # UBL namespace definitions
-    ns = {
-        'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
-        'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2'
-    }
-    
-    dok = root.find('.//Dokument')
-
-    # Valuta datum - podržava oba Sopharma i UBL (eFaktura.rs) format
-    valuta_node = root.find('.//Valutacije/Valutacija/Datum')
-    if valuta_node is None:
-        # Fallback za UBL format (eFaktura.rs)
-        valuta_node = root.find('.//cbc:DueDate', ns)
-    valuta_dt = datetime.strptime(valuta_node.text, '%Y-%m-%d') if valuta_node is not None and valuta_node.text else None
-
-    popust_node = root.find('.//Valutacije/Valutacija/Popust')
-    vrednost_node = root.find('.//Valutacije/Valutacija/Vrednost')
-    cash_discount = D(popust_node.text if popust_node is not None else None, '0')
-    payable_amount = D(vrednost_node.text if vrednost_node is not None else None, '0')
-
-    # Broj fakture - podržava Sopharma i UBL format
-    broj_node = dok.find('Broj') if dok is not None else None
-    if broj_node is None:
-        broj_node = root.find('.//cbc:ID', ns)
-    broj_faktura = broj_node.text.strip() if broj_node is not None and broj_node.text else ''
-
-    # Datum fakture - podržava Sopharma i UBL format
-    datum_node = dok.find('Datum') if dok is not None else None
-    if datum_node is None:
-        datum_node = root.find('.//cbc:IssueDate', ns)
-    datum_text = datum_node.text if datum_node is not None and datum_node.text else None
-    datum = datetime.strptime(datum_text, '%Y-%m-%d') if datum_text else datetime.now()
-
-    # Dobavljač - podržava Sopharma i UBL format
-    dobavljac_node = root.find('.//Dobavljac/Naziv')
-    if dobavljac_node is None:
-        dobavljac_node = root.find('.//cac:AccountingSupplierParty//cbc:RegistrationName', ns)
-    dobavljac = dobavljac_node.text.strip() if dobavljac_node is not None and dobavljac_node.text else ''
-
-    # Total neto - podržava Sopharma i UBL format  
-    total_neto_node = root.find('.//Vrednosti/NetoFakturna')
-    if total_neto_node is None:
-        total_neto_node = root.find('.//cbc:TaxExclusiveAmount', ns)
-    total_neto = D(total_neto_node.text, '0') if total_neto_node is not None and total_neto_node.text else D('0')
-
-    header = {
-        'broj_faktura': broj_faktura,
-        'datum': datum,
-        'dobavljac': dobavljac,
-        'total_neto': total_neto,
-        'valuta_datum': valuta_dt,
-        'cash_discount': cash_discount,
-        'payable_amount': payable_amount,
-    }
-
-    items = []
-    # Try legacy vendor format first
-    stavke = root.findall('.//Stavke/Stavka') or root.findall('.//Stavka')
-    if stavke:
-        for stavka in stavke:
-            pdv_txt = (stavka.findtext('PorezProcenat') or '').strip()
-            pdv_val = D(pdv_txt, '10.0')
-
-            sifra = (stavka.findtext('Sifra') or '').strip()
-            gtin = (stavka.findtext('GTIN') or '').strip() or None
-            naziv = (stavka.findtext('Naziv') or '').strip()
-            serija = (stavka.findtext('BrojSerije') or '').strip()
-            rok = (stavka.findtext('RokUpotrebe') or '').strip()
-
-            if serija in ('0', '0000', 'None', ''):
-                serija = None
-            if rok in ('0', '0000-00-00', 'None', ''):
-                rok_dt = None
-            else:
-                rok_dt = datetime.strptime(rok, '%Y-%m-%d')
-
-            items.append({
-                'sifra': sifra,
-                'barcode': gtin,
-                'naziv': naziv,
-                'kolicina': D(stavka.findtext('Kolicina'), '0'),
-                'cena_fakturna': D(stavka.findtext('CenaFakturna'), '0'),
-                'rabat_pct': D(stavka.findtext('RabatProcenat'), '0'),
-                'serija': serija,
-                'rok_dt': rok_dt,
-                'pdv_pct': float(pdv_val),
-            })
-    else:
-        # Fallback to UBL eFaktura format
-        inv_lines = root.findall('.//cac:InvoiceLine', ns)
-        for il in inv_lines:
-            qty_txt = il.findtext('./cbc:InvoicedQuantity', namespaces=ns) or '0'
-            price_txt = il.findtext('./cac:Price/cbc:PriceAmount', namespaces=ns) or '0'
-            disc_pct_txt = il.findtext('./cac:AllowanceCharge/cbc:MultiplierFactorNumeric', namespaces=ns) or '0'
-            pdv_txt = (
-                il.findtext('./cac:Item/cac:ClassifiedTaxCategory/cbc:Percent', namespaces=ns)
-                or il.findtext('./cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent', namespaces=ns)
-                or '10'
-            )
-            supplier_id = il.findtext('./cac:Item/cac:SellersItemIdentification/cbc:ID', namespaces=ns) or ''
-            gtin = il.findtext('./cac:StandardItemIdentification/cbc:ID', namespaces=ns) or None
-            name = il.findtext('./cac:Item/cbc:Name', namespaces=ns) or ''
-
-            items.append({
-                'sifra': supplier_id.strip(),
-                'barcode': gtin.strip() if gtin else None,
-                'naziv': name.strip(),
-                'kolicina': D(qty_txt, '0'),
-                'cena_fakturna': D(price_txt, '0'),
-                'rabat_pct': D(disc_pct_txt, '0'),
-                'serija': None,
-                'rok_dt': None,
-                'pdv_pct': float(D(pdv_txt, '10.0')),
-            })
-
-    return header, items
+    """(header, items) from Sopharma vendor XML or UBL eFaktura, streamed once (invoice_xml.py)"""
+    return parse_invoice(xml_path)
 
 def insert_kalkulacija(conn, header, items, mp_cfg, *, dokvrsta='20', magacin='101', komintent='1', periodid=4, userid=14, dry_run=False, allow_remote_write=False, schema_override=None):
     """
@@ -0,0 +1,100 @@
+# file: app/overview_cache.py - Persistent cache of eFaktura invoice overviews
+"""
+list_incoming_invoices(fetch_details=True) needs one purchase-invoice/overview
+request per invoice for supplier, number and date. The UI skipped it, so the
+supplier columns stayed blank.
+
+OverviewCache keeps every overview in a SQLite file, one row per invoice:
+
+  invoice_id, last_modified, status, overview (JSON), fetched_at
+
+A row is served as long as its status is final (WPH_SYNC_FINAL_STATUSES) or
+it is younger than WPH_EFAKT_OVERVIEW_TTL seconds. A newer overview (other
+last-modified) replaces the row. Overviews fetched by the incremental sync
+(DownloadEngine.submit_sync) are stored too.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+try:
+    from sync_manifest import FINAL_STATUSES
+except ImportError:
+    from app.sync_manifest import FINAL_STATUSES
+
+OVERVIEW_TTL = float(os.getenv('WPH_EFAKT_OVERVIEW_TTL', '900'))
+QUERY_CHUNK = 500
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class OverviewCache:
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = OVERVIEW_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        try:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            # Unreadable cache: it only holds API copies, rebuild it
+            os.remove(self.path)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS overviews (
+                invoice_id INTEGER PRIMARY KEY, last_modified TEXT, status TEXT,
+                overview TEXT, fetched_at REAL
+            )
+        """)
+        return db
+
+    def get_many(self, invoice_ids):
+        """{invoice_id: overview} for the ids with a usable cached overview"""
+        ids = [int(i) for i in invoice_ids]
+        found = {}
+        oldest = time.time() - self.ttl
+        with self._lock:
+            db = self._connect()
+            try:
+                for i in range(0, len(ids), QUERY_CHUNK):
+                    chunk = ids[i:i + QUERY_CHUNK]
+                    for invoice_id, status, overview, fetched_at in db.execute(
+                            f"SELECT invoice_id, status, overview, fetched_at FROM overviews "
+                            f"WHERE invoice_id IN ({','.join('?' * len(chunk))})", chunk):
+                        if status in FINAL_STATUSES or fetched_at >= oldest:
+                            found[invoice_id] = json.loads(overview)
+            finally:
+                db.close()
+        return found
+
+    def put_many(self, rows):
+        """Store [(invoice_id, overview, state)] where state is {'status', 'last_modified'}"""
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    db.executemany("INSERT OR REPLACE INTO overviews VALUES (?, ?, ?, ?, ?)", [
+                        (int(invoice_id), state.get('last_modified'), state.get('status'), json.dumps(overview), now)
+                        for invoice_id, overview, state in rows])
+            finally:
+                db.close()
+
+
+def cache_for(path):
+    """Shared OverviewCache per file"""
+    key = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = OverviewCache(path)
+        return cache
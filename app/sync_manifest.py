@@ -0,0 +1,122 @@
+# file: app/sync_manifest.py - Incremental eFaktura sync state
+"""
+fetch_all_by_day and fetch_all_invoices used to list the whole range on every
+run and download every XML again, overwriting the INV_<id>.xml files already
+in staging.
+
+SyncManifest is a SQLite file next to the downloads (.efaktura_sync.sqlite):
+
+  invoices  invoice_id, status, last_modified, sha1, path, day, fetched_at, checked_at
+  days      day, invoice_count, checked_at        (per-day checkpoint)
+
+A re-run downloads only invoices the manifest has not seen. A known invoice
+whose status is not final (WPH_SYNC_FINAL_STATUSES) costs one overview
+request: its XML is fetched again only when status or last-modified changed,
+and written only when the content hash changed. A day whose checkpoint was
+taken WPH_SYNC_SETTLE_DAYS or more after the day itself is not listed again.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import datetime as dt
+
+MANIFEST_NAME = '.efaktura_sync.sqlite'
+FINAL_STATUSES = {s.strip() for s in os.getenv('WPH_SYNC_FINAL_STATUSES', 'Approved,Rejected,Cancelled,Storno').split(',') if s.strip()}
+SETTLE_DAYS = int(os.getenv('WPH_SYNC_SETTLE_DAYS', '30'))
+QUERY_CHUNK = 500
+
+
+def content_sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+class SyncManifest:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS invoices (
+                invoice_id INTEGER PRIMARY KEY, status TEXT, last_modified TEXT, sha1 TEXT,
+                path TEXT, day TEXT, fetched_at REAL, checked_at REAL
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS days (
+                day TEXT PRIMARY KEY, invoice_count INTEGER, checked_at TEXT
+            )
+        """)
+
+    @classmethod
+    def for_dir(cls, output_dir):
+        """Manifest of a download folder (WPH_SYNC_MANIFEST overrides the location)"""
+        return cls(os.getenv('WPH_SYNC_MANIFEST') or os.path.join(output_dir, MANIFEST_NAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    # --- invoices ----------------------------------------------------------
+
+    def known(self, invoice_ids):
+        """{invoice_id: {status, last_modified, sha1, path}} for the ids already in the manifest"""
+        ids = [int(i) for i in invoice_ids]
+        found = {}
+        for i in range(0, len(ids), QUERY_CHUNK):
+            chunk = ids[i:i + QUERY_CHUNK]
+            for invoice_id, status, last_modified, sha1, path in self.db.execute(
+                    f"SELECT invoice_id, status, last_modified, sha1, path FROM invoices "
+                    f"WHERE invoice_id IN ({','.join('?' * len(chunk))})", chunk):
+                found[invoice_id] = {'status': status, 'last_modified': last_modified, 'sha1': sha1, 'path': path}
+        return found
+
+    @staticmethod
+    def action(entry, full=False):
+        """'new' (download), 'check' (overview first) or 'final' (nothing to do) for a known() entry"""
+        if entry is None or entry['sha1'] is None:
+            return 'new'
+        if entry['status'] in FINAL_STATUSES and not full:
+            return 'final'
+        return 'check'
+
+    def record(self, invoice_id, *, day=None, sha1=None, path=None, state=None):
+        """Upsert an invoice; state is {'status', 'last_modified'} from its overview (None: unknown)"""
+        now = time.time()
+        state = state or {}
+        self.db.execute("""
+            INSERT INTO invoices (invoice_id, status, last_modified, sha1, path, day, fetched_at, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (invoice_id) DO UPDATE SET
+                status = COALESCE(excluded.status, status),
+                last_modified = COALESCE(excluded.last_modified, last_modified),
+                sha1 = COALESCE(excluded.sha1, sha1),
+                path = COALESCE(excluded.path, path),
+                day = COALESCE(excluded.day, day),
+                fetched_at = COALESCE(excluded.fetched_at, fetched_at),
+                checked_at = excluded.checked_at
+        """, [int(invoice_id), state.get('status'), state.get('last_modified'), sha1, path,
+              day.isoformat() if isinstance(day, dt.date) else day, now if sha1 else None, now])
+
+    def adopt(self, invoice_id, path, day=None):
+        """Record an XML that is already on disk (downloaded before the manifest existed)"""
+        with open(path, 'rb') as f:
+            self.record(invoice_id, day=day, sha1=content_sha1(f.read()), path=path)
+
+    # --- per-day checkpoints -----------------------------------------------
+
+    def day_settled(self, day):
+        """True when the day was fully synced SETTLE_DAYS or more after it (no need to list it again)"""
+        row = self.db.execute("SELECT checked_at FROM days WHERE day = ?", [day.isoformat()]).fetchone()
+        return bool(row) and (dt.date.fromisoformat(row[0]) - day).days >= SETTLE_DAYS
+
+    def checkpoint(self, day, invoice_count):
+        """Every invoice listed for the day is synced"""
+        self.db.execute("INSERT OR REPLACE INTO days VALUES (?, ?, ?)",
+                        [day.isoformat(), invoice_count, dt.date.today().isoformat()])
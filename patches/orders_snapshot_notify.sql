@@ -0,0 +1,20 @@
+-- NOTIFY listeners when ops.orders_30d_snapshot changes
+-- The backend's in-memory orders copy (WPH_ORDERS_INMEMORY=1) LISTENs on this
+-- channel and reloads. Postgres delivers the notifications at commit, and
+-- identical payloads within one transaction are folded into one.
+-- If the snapshot is a materialized view (REFRESH fires no triggers), add
+--   NOTIFY wph_orders_snapshot;
+-- to the refresh job instead.
+
+CREATE OR REPLACE FUNCTION ops.notify_orders_snapshot() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('wph_orders_snapshot', 'refresh');
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_orders_snapshot_notify ON ops.orders_30d_snapshot;
+CREATE TRIGGER trg_orders_snapshot_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ops.orders_30d_snapshot
+    FOR EACH STATEMENT EXECUTE FUNCTION ops.notify_orders_snapshot();
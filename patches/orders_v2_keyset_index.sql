@@ -0,0 +1,11 @@
+-- Keyset index for /api/orders/v2 pagination (limit= / cursor=)
+-- Matches its ORDER BY alarm_active, flow_status COLLATE "C", qty_to_order, sifra COLLATE "C"
+-- (all DESC, NULLs first) so a page is an index range scan + LIMIT instead of a full sort.
+-- The cursor predicate is a row comparison on the same columns.
+-- Re-run after the snapshot is rebuilt with DROP/CREATE (TRUNCATE/INSERT keeps the indexes).
+
+CREATE INDEX IF NOT EXISTS ix_orders_30d_snapshot_keyset
+    ON ops.orders_30d_snapshot (alarm_active DESC, flow_status COLLATE "C" DESC,
+                                qty_to_order DESC, sifra COLLATE "C" DESC);
+
+ANALYZE ops.orders_30d_snapshot;
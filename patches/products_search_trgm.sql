@@ -0,0 +1,16 @@
+-- Trigram search over the orders snapshot
+-- Used by /api/products/search (similarity-ranked type-ahead) and by the
+-- q= filter of /api/orders/v2 (ILIKE '%q%'), which a GIN trigram index can serve
+-- instead of a sequential scan.
+-- Re-run after the snapshot is rebuilt with DROP/CREATE (TRUNCATE/INSERT keeps the indexes).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_orders_30d_snapshot_emri_trgm
+    ON ops.orders_30d_snapshot USING gin (emri gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_orders_30d_snapshot_sifra_trgm
+    ON ops.orders_30d_snapshot USING gin (sifra gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_orders_30d_snapshot_barkod_trgm
+    ON ops.orders_30d_snapshot USING gin (barkod gin_trgm_ops);
+
+ANALYZE ops.orders_30d_snapshot;
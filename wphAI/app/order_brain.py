@@ -13,13 +13,10 @@ from math import ceil
 from typing import Optional, Dict, Set, Tuple, List, Union
 
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.styles import PatternFill
 from openpyxl.formatting.rule import CellIsRule, FormulaRule, DataBarRule
 from openpyxl.chart import BarChart, Reference
-from openpyxl.worksheet.table import Table, TableStyleInfo
 from openpyxl.utils import get_column_letter
-from openpyxl.utils.cell import range_boundaries
 
 # =================== CONFIG (URDHRI PA ULAZ) ===================
 TARGET_MODE = "izlaz"          # "izlaz" | "mes_muj" | "max"
@@ -67,53 +64,7 @@ def norm_code(s: str) -> str:
 
 # =================== ORDER POLICY HELPERS ===================
 from app.core.policy import compute_order_qty  # central policy logic
-
-# =================== Excel helpers ===================
-def style_header(ws, row=1):
-    hdr_fill = PatternFill("solid", fgColor="22313F")
-    hdr_font = Font(color="FFFFFF", bold=True)
-    border_thin = Border(
-        left=Side(style="thin", color="D9D9D9"),
-        right=Side(style="thin", color="D9D9D9"),
-        top=Side(style="thin", color="D9D9D9"),
-        bottom=Side(style="thin", color="D9D9D9"),
-    )
-    for c in ws[row]:
-        c.fill = hdr_fill; c.font = hdr_font
-        c.alignment = Alignment(vertical="center", horizontal="center")
-        c.border = border_thin
-
-def auto_fit(ws, min_w=8, extra=2):
-    for col in ws.columns:
-        maxlen = 0
-        idx = col[0].column if hasattr(col[0], "column") else col[0].col_idx
-        for cell in col:
-            s = "" if cell.value is None else str(cell.value)
-            if len(s) > maxlen: maxlen = len(s)
-        ws.column_dimensions[get_column_letter(idx)].width = max(min_w, maxlen + extra)
-
-def add_table_safe(wb, ws, display_name: str, ref: str, style: str = "TableStyleMedium9") -> None:
-    try:
-        min_c, min_r, max_c, max_r = range_boundaries(ref)
-    except Exception:
-        log(f"[TABLE] Skip {display_name}: ref invalid {ref}"); return
-    if max_r - min_r + 1 < 2 or max_c - min_c + 1 < 1:
-        log(f"[TABLE] Skip {display_name}: range i vogël {ref}"); return
-    headers = [ws.cell(row=min_r, column=c).value for c in range(min_c, max_c + 1)]
-    if any(h is None or str(h).strip()=="" for h in headers):
-        log(f"[TABLE] Skip {display_name}: header bosh"); return
-    existing = set()
-    for sh in wb.worksheets:
-        for nm in getattr(sh, "tables", {}): existing.add(nm)
-    name = re.sub(r"[^A-Za-z0-9_]", "_", display_name)
-    if not re.match(r"^[A-Za-z_]", name): name = f"t_{name}"
-    while name in existing: name += "_x"
-    t = Table(displayName=name, ref=ref)
-    t.tableStyleInfo = TableStyleInfo(name=style, showRowStripes=True)
-    try:
-        ws.add_table(t)
-    except Exception as e:
-        log(f"[TABLE] Skip {name}: {e}")
+from app.core.xlsx_export import XlsxReport, Styled  # write-only Excel export
 
 # =================== Paths ===================
 def parse_enddate_from_filename(fn: str) -> Optional[date]:
@@ -566,11 +517,11 @@ def add_rabat_columns(df_review: pd.DataFrame,
 
 def sup_id_for_row(row, sup_u, sup_bark_map, sup_sig_map):
     # Pse komentohet: fallback i fundit është barkodi, për t’ju krijuar porosi edhe kur s’ka SifraSup.
-    bark = str(row.get("Barkod_actual") or "").strip()
+    bark = str(getattr(row, "Barkod_actual", "") or "").strip()
     if bark and sup_u in sup_bark_map:
         hit = sup_bark_map[sup_u].get(bark)
         if hit: return hit
-    sig = norm_name(str(row.get("Artikal") or ""))
+    sig = norm_name(str(getattr(row, "Artikal", "") or ""))
     if sup_u in sup_sig_map:
         hit = sup_sig_map[sup_u].get(sig)
         if hit: return hit
@@ -787,160 +738,111 @@ def main():
     api_fuzzy_count   = int((df_review["MATCH_STATUS"] == "FUZZY").sum())
     api_no_count      = int((df_review["MATCH_STATUS"] == "NO_MATCH").sum())
 
-    # ---------------- Workbook ----------------
-    wb = Workbook()
-    if "Sheet" in wb.sheetnames: wb.remove(wb["Sheet"])
+    # ---------------- Workbook (write-only, streamed sheet by sheet) ----------------
+    report = XlsxReport()
 
     # Home
-    ws_home = wb.create_sheet("Home", 0)
-    ws_home["A1"] = "ORDER BRAIN — NAVIGATION"; ws_home["A1"].font = Font(size=16, bold=True)
-    ws_home["A3"] = "Kliko për seksionet & pamjet e shpejta:"; ws_home["A3"].font = Font(bold=True)
-    for i, name in enumerate(
-        ["Dashboard", "Review", "Summary", "MatchStats", "API_MatchStats", "Brand_Alias_Report",
-         "Watchlist", "Top20", "Exceptions", "ABC_Items", "ABC_Suppliers", "Legend",
-         "View_OrderOnly", "View_Unmatched", "View_HighValue"], start=5):
-        ws_home.cell(row=i, column=1, value=f'=HYPERLINK("#\'{name}\'!A1","→ {name}")')
-    auto_fit(ws_home)
+    nav = ["Dashboard", "Review", "Summary", "MatchStats", "API_MatchStats", "Brand_Alias_Report",
+           "Watchlist", "Top20", "Exceptions", "ABC_Items", "ABC_Suppliers", "Legend",
+           "View_OrderOnly", "View_Unmatched", "View_HighValue"]
+    report.add_sheet("Home", None, [[f'=HYPERLINK("#\'{name}\'!A1","→ {name}")'] for name in nav],
+                     preamble=[[Styled("ORDER BRAIN — NAVIGATION", "title")], [],
+                               [Styled("Kliko për seksionet & pamjet e shpejta:", "bold")], []])
 
     # Dashboard
-    ws_dash = wb.create_sheet("Dashboard")
-    ws_dash["A1"] = "Order Brain — Dashboard"; ws_dash["A1"].font = Font(size=16, bold=True)
-    ws_dash["A2"] = datetime.now().strftime("%Y-%m-%d %H:%M")
     kpis = [("Total items", total_items), ("Items to order", items_to_order), ("Negative stock", neg_stock_count),
             ("Unmatched", unmatched_count), ("API EXACT", api_exact_count), ("API FUZZY", api_fuzzy_count),
             ("API NO_MATCH", api_no_count), ("Total order value", total_order_value), ("Price > 1000", high_price_count)]
-    r0 = 4
-    border_thin = Border(left=Side(style="thin", color="D9D9D9"), right=Side(style="thin", color="D9D9D9"),
-                         top=Side(style="thin", color="D9D9D9"), bottom=Side(style="thin", color="D9D9D9"))
-    for i,(lab,val) in enumerate(kpis, start=r0):
-        ws_dash.cell(row=i, column=1, value=lab).font = Font(bold=True)
-        ws_dash.cell(row=i, column=2, value=val).font = Font(bold=True)
-        col = "E7F4EA" if lab in ("Total items","Items to order","Total order value","API EXACT") else ("FFF5E5" if lab in ("Negative stock","Unmatched","API NO_MATCH") else "EAF2FF")
-        for c in (1,2):
-            ws_dash.cell(row=i, column=c).fill = PatternFill("solid", fgColor=col)
-            ws_dash.cell(row=i, column=c).border = border_thin
-    ws_dash.cell(row=r0+6, column=2).number_format = "#,##0.00"
-    ws_dash.cell(row=12, column=1, value="Orders by Supplier").font = Font(bold=True)
+    def kpi_row(lab, val):
+        st = "kpi_good" if lab in ("Total items","Items to order","Total order value","API EXACT") else ("kpi_warn" if lab in ("Negative stock","Unmatched","API NO_MATCH") else "kpi_info")
+        return [Styled(lab, st), Styled(val, st, "#,##0.00" if lab == "Total order value" else None)]
 
     orders = (df_review[df_review["Porosit_final"] > 0]
               .groupby("Furnitor_best")
               .agg(Artikuj=("Artikal","count"), Sasi=("Porosit_final","sum"), Vlere=("value","sum"))
               .reset_index().sort_values("Vlere", ascending=False))
-    ws_dash.append(["Supplier","Items","Qty","Value"]); style_header(ws_dash, row=13)
-    for _, row in orders.iterrows():
-        ws_dash.append([row["Furnitor_best"], int(row["Artikuj"]), int(row["Sasi"]), float(row["Vlere"])])
-    if len(orders) > 0:
-        dash_last = 13 + len(orders)
-        add_table_safe(wb, ws_dash, "tblOrders", f"A13:D{dash_last}")
-        ws_dash.conditional_formatting.add(f"D14:D{dash_last}", DataBarRule(start_type="min", end_type="max", color="9CA3AF"))
+    dash = report.add_sheet(
+        "Dashboard", ["Supplier","Items","Qty","Value"],
+        ([r.Furnitor_best, int(r.Artikuj), int(r.Sasi), float(r.Vlere)] for r in orders.itertuples(index=False)),
+        preamble=[[Styled("Order Brain — Dashboard", "title")], [datetime.now().strftime("%Y-%m-%d %H:%M")], []]
+                 + [kpi_row(lab, val) for lab, val in kpis] + [[Styled("Orders by Supplier", "bold")]],
+        formats={"Value": "money"}, table="tblOrders",
+        conditional=[("Value", DataBarRule(start_type="min", end_type="max", color="9CA3AF"))])
+    if dash.rows:
         try:
             chart = BarChart(); chart.title = "Order Value by Supplier"
-            data = Reference(ws_dash, min_col=4, min_row=13, max_row=dash_last)
-            cats = Reference(ws_dash, min_col=1, min_row=14, max_row=dash_last)
+            data = Reference(dash.ws, min_col=4, min_row=dash.header_row, max_row=dash.last_row)
+            cats = Reference(dash.ws, min_col=1, min_row=dash.first_row, max_row=dash.last_row)
             chart.add_data(data, titles_from_data=True); chart.set_categories(cats)
-            chart.height = 9; chart.width = 18; ws_dash.add_chart(chart, "F13")
+            chart.height = 9; chart.width = 18; dash.ws.add_chart(chart, f"F{dash.header_row}")
         except Exception: pass
-    auto_fit(ws_dash)
 
     # Review
-    ws_rev = wb.create_sheet("Review")
     headers = ["Mes_Muj","Stanje","Artikal","Porosit_final","Izlaz","Furnitor_best","Needs_Order",
                "value","Barkod","Cmim_best","Target_Stock","Porosit_calc","Available_calc","Ulaz",
                "Barkod_actual","Sifra_actual","Match_method","MATCH_STATUS","Winner_Reason",
                "Rabat_best","Rabat_others_max","Rabat_others_avg",
                "Factor_used","MM_div_Izlaz"]
-    ws_rev.append(headers); style_header(ws_rev, row=1)
-    for _, row in df_review.iterrows(): ws_rev.append([row.get(c,"") for c in headers])
-    last_rev = ws_rev.max_row
-    for r in range(2,last_rev+1):
-        ws_rev.cell(row=r, column=headers.index("value")+1).number_format = "#,##0.00"
-        ws_rev.cell(row=r, column=headers.index("Cmim_best")+1).number_format = "#,##0.00"
-        ws_rev.cell(row=r, column=headers.index("Target_Stock")+1).number_format = "#,##0.##"
-        ws_rev.cell(row=r, column=headers.index("Porosit_calc")+1).number_format = "#,##0.##"
-        ws_rev.cell(row=r, column=headers.index("Rabat_best")+1).number_format = "0.00%"
-        ws_rev.cell(row=r, column=headers.index("Rabat_others_max")+1).number_format = "0.00%"
-        ws_rev.cell(row=r, column=headers.index("Rabat_others_avg")+1).number_format = "0.00%"
     red = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
     green = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-    c_st = headers.index("Stanje")+1; c_need = headers.index("Needs_Order")+1; c_val = headers.index("value")+1
-    ws_rev.conditional_formatting.add(f"{get_column_letter(c_st)}2:{get_column_letter(c_st)}{last_rev}", CellIsRule(operator="lessThan", formula=["0"], fill=red))
-    ws_rev.conditional_formatting.add(f"{get_column_letter(c_need)}2:{get_column_letter(c_need)}{last_rev}", FormulaRule(formula=[f'INDIRECT("{get_column_letter(c_need)}"&ROW())="Po"'], fill=green))
-    ws_rev.conditional_formatting.add(f"{get_column_letter(c_val)}2:{get_column_letter(c_val)}{last_rev}", DataBarRule(start_type="min", end_type="max", color="9CA3AF"))
-    add_table_safe(wb, ws_rev, "tblReview", f"A1:{get_column_letter(len(headers))}{last_rev}")
-    ws_rev.freeze_panes = "A2"; ws_rev.column_dimensions[get_column_letter(headers.index("Artikal")+1)].width = 46
-    for r in range(2,last_rev+1):
-        ws_rev.cell(row=r, column=headers.index("Artikal")+1).alignment = Alignment(wrap_text=True, vertical="center")
-    auto_fit(ws_rev)
+    need_col = get_column_letter(headers.index("Needs_Order")+1)
+    report.add_sheet(
+        "Review", headers, df_review.reindex(columns=headers, fill_value="").itertuples(index=False, name=None),
+        formats={"value": "money", "Cmim_best": "money", "Target_Stock": "qty", "Porosit_calc": "qty",
+                 "Rabat_best": "pct", "Rabat_others_max": "pct", "Rabat_others_avg": "pct", "Artikal": "wrap"},
+        widths={"Artikal": 46}, freeze="A2", table="tblReview",
+        conditional=[("Stanje", CellIsRule(operator="lessThan", formula=["0"], fill=red)),
+                     ("Needs_Order", FormulaRule(formula=[f'INDIRECT("{need_col}"&ROW())="Po"'], fill=green)),
+                     ("value", DataBarRule(start_type="min", end_type="max", color="9CA3AF"))])
 
     # Summary
-    ws_sum = wb.create_sheet("Summary")
-    ws_sum.append(["Dobavljac","Value","Share","CumShare","Class"]); style_header(ws_sum, row=1)
     total_val = df_review["value"].sum() or 1.0
     sups = df_review.groupby("Furnitor_best")["value"].sum().reset_index().sort_values("value", ascending=False)
     sups["Share"] = sups["value"]/total_val; sups["CumShare"]=sups["Share"].cumsum()
     sups["Class"] = sups["CumShare"].map(lambda p: "A" if p<=0.80 else ("B" if p<=0.95 else "C"))
-    for _, r in sups.iterrows():
-        ws_sum.append([r["Furnitor_best"], float(r["value"]), float(r["Share"]), float(r["CumShare"]), r["Class"]])
-    for r in range(2, ws_sum.max_row + 1):
-        ws_sum.cell(row=r, column=2).number_format = "#,##0.00"
-        ws_sum.cell(row=r, column=3).number_format = "0.00%"
-        ws_sum.cell(row=r, column=4).number_format = "0.00%"
-    add_table_safe(wb, ws_sum, "tblSummary", f"A1:E{ws_sum.max_row}"); auto_fit(ws_sum)
+    report.add_sheet("Summary", ["Dobavljac","Value","Share","CumShare","Class"],
+                     ([r.Furnitor_best, float(r.value), float(r.Share), float(r.CumShare), r.Class] for r in sups.itertuples(index=False)),
+                     formats={"Value": "money", "Share": "pct", "CumShare": "pct"}, table="tblSummary")
 
     # MatchStats
-    ws_ms = wb.create_sheet("MatchStats")
     stats = (df_review.groupby("Match_method").agg(Rreshta=("Artikal","count"), Qty=("Porosit_final","sum"), Vlere=("value","sum"))
              .reset_index().sort_values("Rreshta", ascending=False))
-    ws_ms.append(["Match_method","Rreshta","Qty","Vlere"]); style_header(ws_ms, row=1)
-    for _, row in stats.iterrows(): ws_ms.append([row["Match_method"], int(row["Rreshta"]), int(row["Qty"]), float(row["Vlere"])])
-    for r in range(2, ws_ms.max_row + 1): ws_ms.cell(row=r, column=4).number_format = "#,##0.00"
-    add_table_safe(wb, ws_ms, "tblMatchStats", f"A1:D{ws_ms.max_row}"); auto_fit(ws_ms)
+    report.add_sheet("MatchStats", ["Match_method","Rreshta","Qty","Vlere"],
+                     ([r.Match_method, int(r.Rreshta), int(r.Qty), float(r.Vlere)] for r in stats.itertuples(index=False)),
+                     formats={"Vlere": "money"}, table="tblMatchStats")
 
     # API_MatchStats
-    ws_ams = wb.create_sheet("API_MatchStats")
     stats2 = (df_review.groupby("MATCH_STATUS").agg(Rreshta=("Artikal","count"), Qty=("Porosit_final","sum"), Vlere=("value","sum"))
               .reset_index().sort_values("Rreshta", ascending=False))
-    ws_ams.append(["MATCH_STATUS","Rreshta","Qty","Vlere"]); style_header(ws_ams, row=1)
-    for _, row in stats2.iterrows(): ws_ams.append([row["MATCH_STATUS"], int(row["Rreshta"]), int(row["Qty"]), float(row["Vlere"])])
-    for r in range(2, ws_ams.max_row + 1): ws_ams.cell(row=r, column=4).number_format = "#,##0.00"
-    add_table_safe(wb, ws_ams, "tblAPIMatchStats", f"A1:D{ws_ams.max_row}"); auto_fit(ws_ams)
+    report.add_sheet("API_MatchStats", ["MATCH_STATUS","Rreshta","Qty","Vlere"],
+                     ([r.MATCH_STATUS, int(r.Rreshta), int(r.Qty), float(r.Vlere)] for r in stats2.itertuples(index=False)),
+                     formats={"Vlere": "money"}, table="tblAPIMatchStats")
 
     # Brand_Alias_Report
     try:
-        ws_br = wb.create_sheet("Brand_Alias_Report")
-        ws_br.append(["brand","winner_api","winner_count","total","candidates"]); style_header(ws_br, row=1)
-        for _, rr in alias_report.iterrows():
-            ws_br.append([rr.get("brand",""), rr.get("winner_api",""), int(rr.get("winner_count",0)),
-                          int(rr.get("total",0)), rr.get("candidates","")])
-        add_table_safe(wb, ws_br, "tblBrandAlias", f"A1:E{ws_br.max_row}")
-        auto_fit(ws_br)
+        alias_cols = ["brand","winner_api","winner_count","total","candidates"]
+        report.add_sheet("Brand_Alias_Report", alias_cols,
+                         ([rr.brand, rr.winner_api, int(rr.winner_count), int(rr.total), rr.candidates]
+                          for rr in alias_report.reindex(columns=alias_cols).itertuples(index=False)),
+                         table="tblBrandAlias")
     except Exception as e:
         log(f"[WARN] Alias report sheet: {e}")
 
     # Watchlist
-    ws_neg = wb.create_sheet("Watchlist")
     neg = df_review[df_review["Stanje"] < 0].copy().sort_values("Stanje")
-    ws_neg.append(["Artikal","Furnitor","Stanje","Izlaz","Mes_Muj","Porosit_final","Sifra","Barkod"]); style_header(ws_neg, row=1)
-    for _, row in neg.iterrows():
-        ws_neg.append([row["Artikal"], row["Furnitor_best"], float(row["Stanje"]), float(row["Izlaz"]),
-                       float(row["Mes_Muj"]), int(row["Porosit_final"]), row["Sifra_actual"], row["Barkod_actual"]])
-    for r in range(2, ws_neg.max_row + 1): ws_neg.cell(row=r, column=3).number_format = "#,##0"
-    add_table_safe(wb, ws_neg, "tblWatch", f"A1:H{ws_neg.max_row}"); auto_fit(ws_neg)
+    report.add_sheet("Watchlist", ["Artikal","Furnitor","Stanje","Izlaz","Mes_Muj","Porosit_final","Sifra","Barkod"],
+                     ([r.Artikal, r.Furnitor_best, float(r.Stanje), float(r.Izlaz), float(r.Mes_Muj),
+                       int(r.Porosit_final), r.Sifra_actual, r.Barkod_actual] for r in neg.itertuples(index=False)),
+                     formats={"Stanje": "int"}, table="tblWatch")
 
     # Top20
-    ws_top = wb.create_sheet("Top20")
     top = df_review.sort_values("value", ascending=False).head(20)
-    ws_top.append(["Artikal","Sifra","Furnitor","Kolicina","Vlera","Cmim","Stanje","Izlaz"]); style_header(ws_top, row=1)
-    for _, row in top.iterrows():
-        ws_top.append([row["Artikal"], row["Sifra_actual"], row["Furnitor_best"], int(row["Porosit_final"]),
-                       float(row["value"]), float(row["Cmim_best"]), float(row["Stanje"]), float(row["Izlaz"])])
-    for r in range(2, ws_top.max_row + 1):
-        ws_top.cell(row=r, column=5).number_format = "#,##0.00"
-        ws_top.cell(row=r, column=6).number_format = "#,##0.00"
-    add_table_safe(wb, ws_top, "tblTop20", f"A1:H{ws_top.max_row}"); auto_fit(ws_top)
+    report.add_sheet("Top20", ["Artikal","Sifra","Furnitor","Kolicina","Vlera","Cmim","Stanje","Izlaz"],
+                     ([r.Artikal, r.Sifra_actual, r.Furnitor_best, int(r.Porosit_final), float(r.value),
+                       float(r.Cmim_best), float(r.Stanje), float(r.Izlaz)] for r in top.itertuples(index=False)),
+                     formats={"Vlera": "money", "Cmim": "money"}, table="tblTop20")
 
     # Exceptions
-    ws_exc = wb.create_sheet("Exceptions")
     exc = df_review[
         (df_review["Match_method"] == "UNMATCHED") |
         ((df_review["Cmim_best"] <= 0) & (df_review["Porosit_final"] > 0)) |
@@ -948,46 +850,29 @@ def main():
         ((df_review["Mes_Muj"] == 0) & (df_review["Izlaz"] > 0)) |
         ((df_review["Stanje"] < 0) & (df_review["Needs_Order"] == "Jo"))
     ].copy()
-    ws_exc.append(["Artikal","Sifra","Furnitor","Match","Winner_Reason","Kolicina","Vlera","Cmim","Stanje","Min/Target","Mes_Muj","Izlaz","Ulaz","Barkod"])
-    style_header(ws_exc, row=1)
-    for _, row in exc.iterrows():
-        ws_exc.append([row["Artikal"], row["Sifra_actual"], row["Furnitor_best"], row["Match_method"], row.get("Winner_Reason",""),
-                       int(row["Porosit_final"]), float(row["value"]), float(row["Cmim_best"]), float(row["Stanje"]),
-                       float(row["Target_Stock"]), float(row["Mes_Muj"]), float(row["Izlaz"]), float(row["Ulaz"]),
-                       row["Barkod_actual"]])
-    for r in range(2, ws_exc.max_row + 1):
-        ws_exc.cell(row=r, column=7).number_format = "#,##0.00"
-        ws_exc.cell(row=r, column=8).number_format = "#,##0.00"
-    add_table_safe(wb, ws_exc, "tblExceptions", f"A1:N{ws_exc.max_row}"); auto_fit(ws_exc)
+    report.add_sheet("Exceptions", ["Artikal","Sifra","Furnitor","Match","Winner_Reason","Kolicina","Vlera","Cmim","Stanje","Min/Target","Mes_Muj","Izlaz","Ulaz","Barkod"],
+                     ([r.Artikal, r.Sifra_actual, r.Furnitor_best, r.Match_method, getattr(r, "Winner_Reason", ""),
+                       int(r.Porosit_final), float(r.value), float(r.Cmim_best), float(r.Stanje),
+                       float(r.Target_Stock), float(r.Mes_Muj), float(r.Izlaz), float(r.Ulaz),
+                       r.Barkod_actual] for r in exc.itertuples(index=False)),
+                     formats={"Vlera": "money", "Cmim": "money"}, table="tblExceptions")
 
     # ABC
     try:
         total_val = df_review["value"].sum();  total_val = total_val if total_val>0 else 1.0
         def cls(p): return "A" if p<=0.80 else ("B" if p<=0.95 else "C")
-        ws_abc_i = wb.create_sheet("ABC_Items")
         items = (df_review.groupby(["Sifra_actual","Artikal"], dropna=False)["value"].sum().reset_index()
                  .sort_values("value", ascending=False))
         items["Share"] = items["value"]/total_val; items["CumShare"]=items["Share"].cumsum(); items["Class"]=items["CumShare"].map(cls)
-        ws_abc_i.append(["Sifra","Artikal","Value","Share","CumShare","Class"]); style_header(ws_abc_i, row=1)
-        for _, r in items.iterrows():
-            ws_abc_i.append([r["Sifra_actual"], r["Artikal"], float(r["value"]), float(r["Share"]), float(r["CumShare"]), r["Class"]])
-        for rr in range(2, ws_abc_i.max_row + 1):
-            ws_abc_i.cell(row=rr, column=3).number_format = "#,##0.00"
-            ws_abc_i.cell(row=rr, column=4).number_format = "0.00%"
-            ws_abc_i.cell(row=rr, column=5).number_format = "0.00%"
-        add_table_safe(wb, ws_abc_i, "tblABCItems", f"A1:F{ws_abc_i.max_row}"); auto_fit(ws_abc_i)
-
-        ws_abc_s = wb.create_sheet("ABC_Suppliers")
+        report.add_sheet("ABC_Items", ["Sifra","Artikal","Value","Share","CumShare","Class"],
+                         ([r.Sifra_actual, r.Artikal, float(r.value), float(r.Share), float(r.CumShare), r.Class] for r in items.itertuples(index=False)),
+                         formats={"Value": "money", "Share": "pct", "CumShare": "pct"}, table="tblABCItems")
+
         sups2 = (df_review.groupby("Furnitor_best")["value"].sum().reset_index().sort_values("value", ascending=False))
         sups2["Share"] = sups2["value"]/total_val; sups2["CumShare"]=sups2["Share"].cumsum(); sups2["Class"]=sups2["CumShare"].map(cls)
-        ws_abc_s.append(["Furnitor","Value","Share","CumShare","Class"]); style_header(ws_abc_s, row=1)
-        for _, r in sups2.iterrows():
-            ws_abc_s.append([r["Furnitor_best"], float(r["value"]), float(r["Share"]), float(r["CumShare"]), r["Class"]])
-        for rr in range(2, ws_abc_s.max_row + 1):
-            ws_abc_s.cell(row=rr, column=2).number_format = "#,##0.00"
-            ws_abc_s.cell(row=rr, column=3).number_format = "0.00%"
-            ws_abc_s.cell(row=rr, column=4).number_format = "0.00%"
-        add_table_safe(wb, ws_abc_s, "tblABCSup", f"A1:E{ws_abc_s.max_row}"); auto_fit(ws_abc_s)
+        report.add_sheet("ABC_Suppliers", ["Furnitor","Value","Share","CumShare","Class"],
+                         ([r.Furnitor_best, float(r.value), float(r.Share), float(r.CumShare), r.Class] for r in sups2.itertuples(index=False)),
+                         formats={"Value": "money", "Share": "pct", "CumShare": "pct"}, table="tblABCSup")
     except Exception: pass
 
     # ---------------- PO_<Furnitor> ----------------
@@ -1001,84 +886,54 @@ def main():
             .groupby(["Furnitor","Signature"], as_index=False).first())
     for sup, grp in sub2.groupby("Furnitor"): SUP_SIG[sup] = dict(zip(grp["Signature"], grp["Sifra"]))
 
+    def po_total(info):
+        if not info.rows: return []
+        return [[None, None, Styled("TOTAL", "bold"),
+                 Styled(f"=SUBTOTAL(9,D{info.first_row}:D{info.last_row})", "bold", "#,##0")]]
+
     for furn in sorted([f for f in df_review["Furnitor_best"].dropna().unique() if str(f).strip() != ""]):
         sup_u = str(furn).upper().strip()
         block = df_review[(df_review["Furnitor_best"] == furn) & (df_review["Porosit_final"] > 0)].copy()
+        block = block.sort_values(["Porosit_final", "Artikal"], ascending=[False, True])
         sh = f"PO_{str(sup_u)[:25]}"
-        ws_po = wb.create_sheet(sh)
-        ws_po.merge_cells(start_row=1, start_column=1, end_row=1, end_column=7)
-        ws_po["A1"] = f"TREBOVANJE PËR FURNITORIN: {sup_u} | {datetime.now():%Y-%m-%d %H:%M}"
-        ws_po["A1"].font = Font(bold=True); ws_po["A1"].alignment = Alignment(horizontal="center")
-        ws_po.append([]); ws_po.append(["Sifra/ID","Barkod","Artikal","Kolicina","Stanje","Izlaz","Ulaz"])
-        style_header(ws_po, row=3)
-        if not block.empty:
-            block = block.sort_values(["Porosit_final", "Artikal"], ascending=[False, True])
-            for _, row in block.iterrows():
-                sup_id = sup_id_for_row(row, sup_u, SUP_BARK, SUP_SIG)  # pse: ID furnitori, fallback barkod
-                ws_po.append([
-                    sup_id,
-                    row.get("Barkod_actual", ""),
-                    row["Artikal"],
-                    int(row["Porosit_final"]),
-                    float(row["Stanje"]),
-                    float(row["Izlaz"]),
-                    float(row.get("Ulaz", 0.0)),
-                ])
-        last_po = ws_po.max_row
-        if last_po >= 4:
-            ws_po.conditional_formatting.add(f"D4:D{last_po}", DataBarRule(start_type="min", end_type="max", color="63BE7B"))
-            ws_po.conditional_formatting.add(f"E4:E{last_po}", CellIsRule(operator="lessThan", formula=["0"], fill=PatternFill("solid", fgColor="FFC7CE")))
-            ws_po.freeze_panes = "A4"
-            add_table_safe(wb, ws_po, f"tbl_{re.sub(r'[^A-Za-z0-9_]', '_', sh)}", f"A3:G{last_po}")
-            total_row = last_po + 1
-            ws_po.cell(row=total_row, column=3, value="TOTAL").font = Font(bold=True)
-            ws_po.cell(row=total_row, column=4, value=f"=SUBTOTAL(9,D4:D{last_po})").font = Font(bold=True)
-            ws_po.cell(row=total_row, column=4).number_format = "#,##0"
-        auto_fit(ws_po)
+        report.add_sheet(
+            sh, ["Sifra/ID","Barkod","Artikal","Kolicina","Stanje","Izlaz","Ulaz"],
+            ([sup_id_for_row(row, sup_u, SUP_BARK, SUP_SIG),  # pse: ID furnitori, fallback barkod
+              row.Barkod_actual,
+              row.Artikal,
+              int(row.Porosit_final),
+              float(row.Stanje),
+              float(row.Izlaz),
+              float(row.Ulaz)] for row in block.itertuples(index=False)),
+            preamble=[[Styled(f"TREBOVANJE PËR FURNITORIN: {sup_u} | {datetime.now():%Y-%m-%d %H:%M}", "banner")], []],
+            merge=["A1:G1"], freeze=None if block.empty else "A4", table=f"tbl_{sh}",
+            conditional=[("Kolicina", DataBarRule(start_type="min", end_type="max", color="63BE7B")),
+                         ("Stanje", CellIsRule(operator="lessThan", formula=["0"], fill=PatternFill("solid", fgColor="FFC7CE")))],
+            footer=po_total)
 
     # ---------------- Quick Views ----------------
     try:
         q1 = df_review[df_review["Porosit_final"] > 0].copy()
-        ws_q1 = wb.create_sheet("View_OrderOnly")
         cols = ["Furnitor_best","Sifra_actual","Artikal","Porosit_final","value","Cmim_best",
                 "Rabat_best","Rabat_others_max","Rabat_others_avg",
                 "Winner_Reason","Stanje","Izlaz","Ulaz","Match_method"]
-        ws_q1.append(cols); style_header(ws_q1, row=1)
-        for _, r in q1[cols].sort_values(["Furnitor_best","value"], ascending=[True,False]).iterrows():
-            ws_q1.append([r[c] for c in cols])
-        for rr in range(2, ws_q1.max_row + 1):
-            ws_q1.cell(row=rr, column=4).number_format = "#,##0"
-            ws_q1.cell(row=rr, column=5).number_format = "#,##0.00"
-            ws_q1.cell(row=rr, column=6).number_format = "#,##0.00"
-            ws_q1.cell(row=rr, column=7).number_format = "0.00%"
-            ws_q1.cell(row=rr, column=8).number_format = "0.00%"
-            ws_q1.cell(row=rr, column=9).number_format = "0.00%"
-        add_table_safe(wb, ws_q1, "tblOrderOnly", f"A1:N{ws_q1.max_row}"); auto_fit(ws_q1)
+        report.add_sheet("View_OrderOnly", cols,
+                         q1[cols].sort_values(["Furnitor_best","value"], ascending=[True,False]).itertuples(index=False, name=None),
+                         formats={"Porosit_final": "int", "value": "money", "Cmim_best": "money",
+                                  "Rabat_best": "pct", "Rabat_others_max": "pct", "Rabat_others_avg": "pct"},
+                         table="tblOrderOnly")
 
         q2 = df_review[df_review["Match_method"] == "UNMATCHED"].copy()
-        ws_q2 = wb.create_sheet("View_Unmatched")
         cols2 = ["Sifra_actual","Barkod_actual","Artikal","Stanje","Izlaz","Mes_Muj","Porosit_final"]
-        ws_q2.append(cols2); style_header(ws_q2, row=1)
-        for _, r in q2[cols2].iterrows():
-            ws_q2.append([r[c] for c in cols2])
-        add_table_safe(wb, ws_q2, "tblUnmatched", f"A1:G{ws_q2.max_row}"); auto_fit(ws_q2)
+        report.add_sheet("View_Unmatched", cols2, q2[cols2].itertuples(index=False, name=None), table="tblUnmatched")
 
         q3 = df_review.sort_values("value", ascending=False).head(100)
-        ws_q3 = wb.create_sheet("View_HighValue")
         cols3 = ["Furnitor_best","Sifra_actual","Artikal","Porosit_final","value","Cmim_best"]
-        ws_q3.append(cols3); style_header(ws_q3, row=1)
-        for _, r in q3[cols3].iterrows():
-            ws_q3.append([r[c] for c in cols3])
-        for rr in range(2, ws_q3.max_row + 1):
-            ws_q3.cell(row=rr, column=5).number_format = "#,##0.00"
-            ws_q3.cell(row=rr, column=6).number_format = "#,##0.00"
-        add_table_safe(wb, ws_q3, "tblHighValue", f"A1:F{ws_q3.max_row}"); auto_fit(ws_q3)
+        report.add_sheet("View_HighValue", cols3, q3[cols3].itertuples(index=False, name=None),
+                         formats={"value": "money", "Cmim_best": "money"}, table="tblHighValue")
     except Exception: pass
 
     # Legend
-    ws_leg = wb.create_sheet("Legend")
-    ws_leg["A1"] = "Legend — Shpjegime"; ws_leg["A1"].font = Font(size=14, bold=True)
-    ws_leg.append(["Fusha","Vlerë","Shpjegim"]); style_header(ws_leg, row=2)
     legends = [
         ("Match_method","BARKOD","Match exakt me barkod (#1)"),
         ("Match_method","SIFRA","Match me Sifra Artikla (#2)"),
@@ -1096,8 +951,8 @@ def main():
         ("Order Policy", f"TARGET_MODE={TARGET_MODE}", "Si llogaritet Target_Stock"),
         ("Order Policy", f"IGNORE_ULAZ_IN_ORDER={IGNORE_ULAZ_IN_ORDER}", "ULAZ injorohet në Available"),
     ]
-    for f,v,s in legends: ws_leg.append([f,v,s])
-    add_table_safe(wb, ws_leg, "tblLegend", f"A2:C{ws_leg.max_row}"); auto_fit(ws_leg)
+    report.add_sheet("Legend", ["Fusha","Vlerë","Shpjegim"], legends,
+                     preamble=[[Styled("Legend — Shpjegime", "heading")]], table="tblLegend")
 
     # ---------------- CSV EXPORT ----------------
     try:
@@ -1155,12 +1010,12 @@ def main():
         out_path = os.path.join(out_dir, f"{base}_v{v}.xlsx")
         v += 1
     try:
-        wb.save(out_path)
+        report.save(out_path)
         log(f"[DONE] Saved: {out_path}")
     except PermissionError as e:
         alt = os.path.join(out_dir, f"{base}_UNLOCKME.xlsx")
         log(f"[WARN] File i hapur nga Excel? Po ruaj: {alt}  ({e})")
-        wb.save(alt)
+        report.save(alt)
         log(f"[DONE] Saved (alt): {alt}")
 
 if __name__ == "__main__":
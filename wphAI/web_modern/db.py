@@ -1,10 +1,21 @@
-import os, psycopg2
+import os, time, uuid, threading, psycopg2
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
 
-def get_conn():
-    return psycopg2.connect(
+# Pool sizing (process-wide, shared by all request threads)
+POOL_MIN = int(os.getenv("WPH_DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("WPH_DB_POOL_MAX", "10"))
+POOL_MAX_LIFETIME = float(os.getenv("WPH_DB_POOL_MAX_LIFETIME", "1800"))  # seconds, 0 = never recycle
+POOL_TIMEOUT = float(os.getenv("WPH_DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+
+# Rows fetched per server round trip by the streaming (named cursor) API
+STREAM_ITERSIZE = int(os.getenv("WPH_DB_STREAM_ITERSIZE", "2000"))
+
+
+def _conn_kwargs():
+    return dict(
         host=os.getenv("WPH_DB_HOST","127.0.0.1"),
         port=int(os.getenv("WPH_DB_PORT","5432")),
         dbname=os.getenv("WPH_DB_NAME","wph_ai"),
@@ -12,9 +23,252 @@ def get_conn():
         password=os.getenv("WPH_DB_PASS","")
     )
 
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 pool with liveness check on checkout and max-lifetime recycling"""
+
+    def __init__(self, conn_kwargs, minconn=POOL_MIN, maxconn=POOL_MAX, max_lifetime=POOL_MAX_LIFETIME, timeout=POOL_TIMEOUT):
+        self.conn_kwargs = dict(conn_kwargs)
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self._idle = []        # [(conn, created_at)]
+        self._created = {}     # id(conn) -> created_at, for every open connection
+        self._in_use = 0
+        self._connecting = 0   # slots reserved by getconn() calls opening a connection
+        self._cond = threading.Condition()
+        self._stats = {"checkouts": 0, "waits": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+                       "created": 0, "recycled": 0, "broken": 0, "timeouts": 0}
+        for _ in range(self.minconn):
+            try:
+                self._idle.append(self._connect())
+            except Exception:
+                break
+
+    def _connect(self):
+        """Open and register a connection; call without holding the lock"""
+        conn = psycopg2.connect(**self.conn_kwargs)
+        created = time.monotonic()
+        with self._cond:
+            self._created[id(conn)] = created
+            self._stats["created"] += 1
+        return conn, created
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        self._close(conn)
+
+    def _expired(self, created):
+        return self.max_lifetime > 0 and (time.monotonic() - created) > self.max_lifetime
+
+    def _alive(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Check out a connection. A slot (idle connection or room for a new one) is
+        reserved under the lock; connecting and the liveness ping run outside it."""
+        start = time.monotonic()
+        waited = False
+        while True:
+            stale = []
+            with self._cond:
+                while True:
+                    while self._idle and self._expired(self._idle[-1][1]):
+                        conn, _ = self._idle.pop()
+                        self._created.pop(id(conn), None)
+                        self._stats["recycled"] += 1
+                        stale.append(conn)
+                    if self._idle:
+                        conn, _ = self._idle.pop()
+                        break
+                    if len(self._created) + self._connecting < self.maxconn:
+                        conn = None
+                        self._connecting += 1
+                        break
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No free DB connection after {self.timeout}s (max={self.maxconn})")
+                    waited = True
+                    self._cond.wait(remaining)
+                self._in_use += 1
+            for old in stale:
+                self._close(old)
+
+            if conn is None:
+                try:
+                    conn, _ = self._connect()
+                except BaseException:
+                    with self._cond:
+                        self._connecting -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._connecting -= 1
+                break
+            if self._alive(conn):
+                break
+            with self._cond:
+                self._stats["broken"] += 1
+                self._created.pop(id(conn), None)
+                self._in_use -= 1
+                self._cond.notify()
+            self._close(conn)
+
+        with self._cond:
+            wait_ms = (time.monotonic() - start) * 1000.0
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            self._in_use = max(0, self._in_use - 1)
+            created = self._created.get(id(conn))
+            if close or created is None or conn.closed or self._expired(created):
+                if created is not None and not close and not conn.closed:
+                    self._stats["recycled"] += 1
+                self._discard(conn)
+            else:
+                try:
+                    # Hand back a clean session: no open transaction, default autocommit
+                    if conn.status != psycopg2.extensions.STATUS_READY:
+                        conn.rollback()
+                    if conn.autocommit:
+                        conn.autocommit = False
+                    self._idle.append((conn, created))
+                except Exception:
+                    self._stats["broken"] += 1
+                    self._discard(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s.update({
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "open": len(self._created),
+                "wait_ms_avg": round(s["wait_ms_total"] / s["checkouts"], 2) if s["checkouts"] else 0.0,
+            })
+            s["wait_ms_total"] = round(s["wait_ms_total"], 2)
+            s["wait_ms_max"] = round(s["wait_ms_max"], 2)
+            return s
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(**conn_kwargs):
+    """Return the process-wide pool for these connection params (default: WPH_DB_* env)"""
+    kwargs = conn_kwargs or _conn_kwargs()
+    key = tuple(sorted((k, str(v)) for k, v in kwargs.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(kwargs)
+        return pool
+
+
+@contextmanager
+def pooled_conn(**conn_kwargs):
+    """Borrow a connection from the pool; broken connections are dropped instead of returned"""
+    pool = get_pool(**conn_kwargs)
+    conn = pool.getconn()
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        pool.putconn(conn, close=True)
+        raise
+    except BaseException:
+        pool.putconn(conn)
+        raise
+    else:
+        pool.putconn(conn)
+
+
+def pool_stats():
+    """Statistics for every pool opened in this process"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    out = []
+    for p in pools:
+        s = p.stats()
+        s["dbname"] = p.conn_kwargs.get("dbname")
+        s["application_name"] = p.conn_kwargs.get("application_name")
+        out.append(s)
+    return out
+
+
+def get_conn():
+    """Dedicated (unpooled) connection - caller owns and closes it"""
+    return psycopg2.connect(**_conn_kwargs())
+
+
 def fetch_all(sql, params=None):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, params or {})
-            cols = [d[0] for d in cur.description]
-            return [dict(zip(cols, r)) for r in cur.fetchall()]
+    with pooled_conn() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params or {})
+                cols = [d[0] for d in cur.description]
+                return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def stream_query(sql, params=None, itersize=STREAM_ITERSIZE):
+    """Run sql on a server-side (named) cursor and yield (columns, rows) batches.
+
+    Only itersize rows are held client-side at a time. The pooled connection is
+    returned when the generator is exhausted or closed.
+    """
+    with pooled_conn() as conn:
+        with conn:
+            with conn.cursor(name=f"wph_stream_{uuid.uuid4().hex[:12]}") as cur:
+                cur.itersize = itersize
+                cur.execute(sql, params or {})
+                cols = None
+                while True:
+                    batch = cur.fetchmany(itersize)
+                    if not batch:
+                        break
+                    if cols is None:
+                        cols = [d[0] for d in cur.description]
+                    yield cols, batch
+
+
+def fetch_iter(sql, params=None, itersize=STREAM_ITERSIZE):
+    """Lazy fetch_all: yields lists of row dicts, itersize rows per batch"""
+    for cols, batch in stream_query(sql, params, itersize):
+        yield [dict(zip(cols, r)) for r in batch]